@@ -0,0 +1,180 @@
+"""
+Ingest Atomic Red Team tests into abilities outside of Caldera, eg. to prebuild them in a build pipeline:
+
+    python -m app.atomic_cli --source path/to/atomic-red-team --output build/
+
+run from the plugin directory (or as plugins.atomic.app.atomic_cli from Caldera's). The output
+directory gets the plugin's layout, data/abilities and payloads, ready to be copied over an install.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import types
+
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FILTER_KINDS = ('platforms', 'executors', 'techniques', 'tactics')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='atomic_cli', description='Ingest Atomic Red Team tests into Caldera abilities.')
+    parser.add_argument('--source', action='append', dest='sources', metavar='PATH',
+                        help='Atomic Red Team checkout to ingest, repeat it to ingest several in precedence order '
+                             '(default: the checkout in the plugin data directory)')
+    parser.add_argument('--output', metavar='DIR', help='write data/abilities and payloads under DIR (default: the plugin directory)')
+    parser.add_argument('--workers', type=int, metavar='N', help='number of threads reading and writing files')
+    parser.add_argument('--incremental', action='store_true',
+                        help='do nothing when the abilities were already ingested from the same checkout and configuration')
+    for action in ('include', 'exclude'):
+        for kind in FILTER_KINDS:
+            parser.add_argument(f'--{action}-{kind[:-1]}', action='append', dest=f'{action}_{kind}', metavar='VALUE',
+                                help=f'{action} {kind} matching VALUE, replacing the configured list (repeatable)')
+    parser.add_argument('--export-pack', metavar='FILE', help='also write the abilities and their payloads into the ability pack FILE')
+    parser.add_argument('--import-pack', metavar='FILE', help='install the ability pack FILE instead of ingesting')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log every step of the ingestion')
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    for source in args.sources or []:
+        if not os.path.isdir(source):
+            parser.error(f'{source} is not a directory')
+    if args.import_pack and (args.sources or args.export_pack or args.incremental):
+        parser.error('--import-pack only takes --output')
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format='%(levelname)s %(name)s: %(message)s')
+    _install_caldera_stand_ins()
+    try:
+        report = asyncio.run(_ingest(args))
+    except Exception:
+        logging.getLogger('atomic_cli').exception('Ingestion failed')
+        return 1
+    print(json.dumps(report, indent=2, sort_keys=True, default=str))
+    return 0
+
+
+async def _ingest(args):
+    # imported once the stand-ins are in place
+    from plugins.atomic.app.atomic_fingerprint import load_fingerprint, save_fingerprint
+    from plugins.atomic.app.atomic_pack import export_pack, import_pack
+    from plugins.atomic.app.atomic_svc import AtomicService
+
+    if args.workers:
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=args.workers))
+    atomic_svc = AtomicService(PLUGIN_DIR)
+    if args.sources:
+        atomic_svc.repo_dir = os.path.abspath(args.sources[0])
+    if args.output:
+        atomic_svc.data_dir = os.path.join(os.path.abspath(args.output), 'data')
+        atomic_svc.payloads_dir = os.path.join(os.path.abspath(args.output), 'payloads')
+        atomic_svc.payload_refs_path = os.path.join(atomic_svc.data_dir, os.path.basename(atomic_svc.payload_refs_path))
+        atomic_svc.quarantine_path = os.path.join(atomic_svc.data_dir, os.path.basename(atomic_svc.quarantine_path))
+        atomic_svc.lock_path = os.path.join(atomic_svc.data_dir, os.path.basename(atomic_svc.lock_path))
+    atomic_svc.filters = _build_filters(atomic_svc.filters, args)
+
+    if args.import_pack:
+        manifest = import_pack(args.import_pack, atomic_svc.data_dir, atomic_svc.payloads_dir)
+        return dict(imported=args.import_pack, abilities=len(manifest['abilities']), payloads=len(manifest['payloads']))
+
+    fingerprint = _fingerprint(atomic_svc, args)
+    if args.incremental and fingerprint and os.path.isdir(os.path.join(atomic_svc.data_dir, 'abilities')) \
+            and fingerprint == load_fingerprint(atomic_svc.data_dir):
+        atomic_svc.log.info('Abilities in %s are up to date', atomic_svc.data_dir)
+        report = dict(up_to_date=True)
+    else:
+        os.makedirs(atomic_svc.payloads_dir, exist_ok=True)
+        sources = [dict(repo_dir=os.path.abspath(source)) for source in args.sources or [atomic_svc.repo_dir]]
+        await atomic_svc.refresh_abilities(update=False, sources=sources)
+        if fingerprint:
+            save_fingerprint(atomic_svc.data_dir, fingerprint)
+        report = dict(atomic_svc.ingestion_report, up_to_date=False)
+    if args.export_pack:
+        manifest = export_pack(atomic_svc.data_dir, atomic_svc.payloads_dir, args.export_pack)
+        report.update(pack=args.export_pack, pack_payloads=len(set(manifest['payloads'].values())))
+    return report
+
+
+def _fingerprint(atomic_svc, args):
+    """
+    The fingerprint refresh_abilities() records, which also covers the filters when they were
+    given on the command line, as they then differ from the configured ones.
+    """
+    from plugins.atomic.app.atomic_fingerprint import compute_fingerprint
+    fingerprint = compute_fingerprint(atomic_svc.repo_dir, atomic_svc.atomic_dir)
+    if fingerprint and any(getattr(args, f'{action}_{kind}') for action in ('include', 'exclude') for kind in FILTER_KINDS):
+        fingerprint['filters'] = atomic_svc.filters
+    return fingerprint
+
+
+def _build_filters(configured, args):
+    """The configured include/exclude filters, with the lists given on the command line replacing theirs."""
+    filters = dict()
+    for action in ('include', 'exclude'):
+        filters[action] = dict(configured.get(action) or dict())
+        for kind in FILTER_KINDS:
+            values = getattr(args, f'{action}_{kind}')
+            if values:
+                filters[action][kind] = values
+    return filters
+
+
+def _install_caldera_stand_ins():
+    """
+    Outside of Caldera, register the few Caldera modules ingestion imports, reduced to what it
+    uses, and make the plugin importable as plugins.atomic. Nothing is replaced within Caldera.
+    """
+    try:
+        import app.utility.base_service  # noqa: F401
+    except ImportError:
+        _add_module('app.utility', __path__=[])
+        _add_module('app.objects', __path__=[])
+        _add_module('app.utility.base_world', BaseWorld=_BaseWorld)
+        _add_module('app.utility.base_service', BaseService=_BaseService)
+        _add_module('app.objects.c_agent', Agent=_Agent)
+    try:
+        import plugins.atomic.app  # noqa: F401
+    except ImportError:
+        _add_module('plugins', __path__=[])
+        _add_module('plugins.atomic', __path__=[PLUGIN_DIR])
+
+
+def _add_module(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    sys.modules[name] = module
+
+
+class _BaseWorld:
+
+    class Access:
+        RED = 'red'
+
+    @staticmethod
+    def strip_yml(path):
+        if path:
+            with open(path, encoding='utf-8') as seed:
+                return list(yaml.safe_load_all(seed))
+        return []
+
+
+class _BaseService(_BaseWorld):
+
+    @staticmethod
+    def add_service(name, svc):
+        return logging.getLogger(name)
+
+
+class _Agent:
+    # the fact placeholders Caldera fills in itself, left untouched by ingestion
+    RESERVED = ['#{server}', '#{group}', '#{paw}', '#{location}', '#{exe_name}', '#{upstream_dest}', '#{origin_link_id}']
+
+
+if __name__ == '__main__':
+    sys.exit(main())
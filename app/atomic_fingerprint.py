@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+
+# Bump whenever a change to the conversion produces different abilities from the same tests,
+# so that existing installations ingest again
+TRANSFORMER_VERSION = 1
+
+FINGERPRINT_FILE = 'fingerprint.json'
+ATOMICS_INDEX = os.path.join('atomics', 'Indexes', 'index.yaml')
+
+
+def compute_fingerprint(repo_dir, plugin_dir):
+    """
+    Fingerprint what the ingested abilities derive from: the Atomic Red Team checkout
+    (its git HEAD commit, or a hash of its atomics index), the plugin version, the
+    transformer version and the plugin configuration.
+    Return None if the checkout cannot be identified, eg. when it is missing.
+    Only a few small files are read, so this is cheap enough to run on every start.
+    """
+    source = _git_head(repo_dir)
+    if source:
+        source = 'git:' + source
+    else:
+        index_digest = _file_digest(os.path.join(repo_dir, ATOMICS_INDEX))
+        if not index_digest:
+            return None
+        source = 'index:' + index_digest
+    return dict(source=source, plugin_version=_read(os.path.join(plugin_dir, 'VERSION.txt')),
+                transformer=TRANSFORMER_VERSION, config=_file_digest(os.path.join(plugin_dir, 'conf', 'default.yml')))
+
+
+def transformer_digest(plugin_dir):
+    """
+    Short hash of what turns tests into abilities, independently of the checkout: the plugin
+    version, the transformer version and the plugin configuration.
+    """
+    parts = [_read(os.path.join(plugin_dir, 'VERSION.txt')), TRANSFORMER_VERSION,
+             _file_digest(os.path.join(plugin_dir, 'conf', 'default.yml'))]
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()[:12]
+
+
+def load_fingerprint(data_dir):
+    try:
+        with open(os.path.join(data_dir, FINGERPRINT_FILE), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_fingerprint(data_dir, fingerprint):
+    os.makedirs(data_dir, exist_ok=True)
+    with open(os.path.join(data_dir, FINGERPRINT_FILE), 'w') as f:
+        json.dump(fingerprint, f, sort_keys=True)
+
+
+def is_stale(repo_dir, plugin_dir, data_dir):
+    """True if the abilities in `data_dir` were not ingested from the current checkout and plugin."""
+    current = compute_fingerprint(repo_dir, plugin_dir)
+    return current is not None and current != load_fingerprint(data_dir)
+
+
+def _read(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _file_digest(path):
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def _git_head(repo_dir):
+    """Resolve HEAD by reading the git files directly, without running git."""
+    git_dir = os.path.join(repo_dir, '.git')
+    head = _read(os.path.join(git_dir, 'HEAD'))
+    if not head or not head.startswith('ref: '):
+        return head
+    ref = head[len('ref: '):]
+    commit = _read(os.path.join(git_dir, *ref.split('/')))
+    if commit:
+        return commit
+    for line in (_read(os.path.join(git_dir, 'packed-refs')) or '').splitlines():
+        if line.endswith(' ' + ref):
+            return line.split(' ', 1)[0]
+    return None
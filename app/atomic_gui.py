@@ -1,14 +1,190 @@
+import asyncio
+import json
 import logging
 
+from aiohttp import web
+
 from app.service.auth_svc import for_all_public_methods, check_authorization
 from app.utility.base_world import BaseWorld
+from plugins.atomic.app.atomic_index import AtomicAbilityIndex
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
 
 
 @for_all_public_methods(check_authorization)
 class AtomicGUI(BaseWorld):
 
     def __init__(self, services, name, description):
+        self.services = services
         self.auth_svc = services.get('auth_svc')
         self.data_svc = services.get('data_svc')
 
         self.log = logging.getLogger('atomic_gui')
+
+        # Index over the atomic abilities, built from data_svc on first use, then
+        # updated incrementally by self._reload_abilities().
+        self._index = None
+
+        # Background re-ingestion job; only one may run at a time
+        self._job = None
+        self._job_status = dict(state='idle')
+        self._atomic_svc = None
+
+    async def summary(self, request):
+        """
+        Return the number of atomic abilities, broken down by tactic, platform and executor.
+        """
+        index = await self._get_index()
+        return web.json_response(index.summary())
+
+    async def query(self, request):
+        """
+        Return one page of atomic abilities, filtered by any of the query parameters
+        technique_id, tactic, platform, executor and has_payloads (true/false).
+        Pagination is controlled with offset and limit.
+        """
+        params = request.query
+        try:
+            offset = int(params.get('offset', 0))
+            limit = int(params.get('limit', DEFAULT_PAGE_SIZE))
+            has_payloads = self._parse_bool(params.get('has_payloads'))
+        except ValueError as e:
+            raise web.HTTPBadRequest(reason=str(e))
+        if offset < 0 or not 0 < limit <= MAX_PAGE_SIZE:
+            raise web.HTTPBadRequest(reason=f'offset must be >= 0 and limit between 1 and {MAX_PAGE_SIZE}')
+
+        index = await self._get_index()
+        total, abilities = index.query(offset=offset, limit=limit, technique_id=params.get('technique_id'),
+                                       tactic=params.get('tactic'), platform=params.get('platform'),
+                                       executor=params.get('executor'), has_payloads=has_payloads)
+        return web.json_response(dict(total=total, offset=offset, limit=limit,
+                                      abilities=[a.display for a in abilities]))
+
+    async def progress(self, request):
+        """
+        Stream the ingestion progress as server-sent events, until the ingestion is over.
+        Only re-ingestion jobs can be followed: the first ingestion runs in enable(), before
+        Caldera serves any request.
+        """
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+        await response.prepare(request)
+        atomic_svc = self._atomic_svc or self.services.get('atomic_svc')
+        if not atomic_svc:
+            await self._send_event(response, dict(state='idle'))
+            return response
+        queue = atomic_svc.subscribe_progress()
+        try:
+            while True:
+                event = await queue.get()
+                await self._send_event(response, event)
+                if event['state'] != 'running':
+                    break
+        finally:
+            atomic_svc.unsubscribe_progress(queue)
+        return response
+
+    async def start_ingestion(self, request):
+        """
+        Start updating the Atomic Red Team repository and re-ingesting it in the background.
+        An optional JSON body may give the repository to pull from as `repo_url`, an https, ssh
+        or file URL, or a path.
+        """
+        # imported here so that enabling the plugin does not load the ingestion code
+        from plugins.atomic.app.atomic_svc import AtomicService, check_repo_url
+        try:
+            data = await request.json() if request.can_read_body else dict()
+        except ValueError:
+            raise web.HTTPBadRequest(reason='The request body must be JSON')
+        if not isinstance(data, dict):
+            raise web.HTTPBadRequest(reason='The request body must be a JSON object')
+        if data.get('repo_url') is not None:
+            try:
+                check_repo_url(data['repo_url'])
+            except ValueError as e:
+                raise web.HTTPBadRequest(reason=str(e))
+        # no await from this check until the job is set, so concurrent requests cannot both start one
+        if self._job and not self._job.done():
+            raise web.HTTPConflict(reason='An ingestion job is already running')
+        self._atomic_svc = AtomicService()
+        self._job_status = dict(state='running', started=self.get_current_timestamp(), finished=None, error=None)
+        self._job = asyncio.create_task(self._run_ingestion(data.get('repo_url')))
+        return web.json_response(self._job_status, status=202)
+
+    async def ingestion_status(self, request):
+        """
+        Return the state of the latest re-ingestion job, with its ingestion progress.
+        """
+        progress = self._atomic_svc.progress if self._atomic_svc else None
+        return web.json_response(dict(self._job_status, progress=progress))
+
+    async def cancel_ingestion(self, request):
+        """
+        Cancel the running re-ingestion job. The current abilities are kept.
+        """
+        if not self._job or self._job.done():
+            raise web.HTTPConflict(reason='No ingestion job is running')
+        self._job.cancel()
+        try:
+            await self._job
+        except asyncio.CancelledError:
+            pass
+        return web.json_response(self._job_status)
+
+    """ PRIVATE """
+
+    async def _run_ingestion(self, repo_url):
+        try:
+            # servers sharing data/ take turns through the ingestion lock
+            if not await self._atomic_svc.run_exclusive(lambda: self._atomic_svc.refresh_abilities(repo_url)):
+                raise RuntimeError('Another server is ingesting abilities, try again later')
+            await self._reload_abilities()
+            if self.services.get('file_svc'):
+                await self._atomic_svc.register_payloads(self.services.get('file_svc'))
+            self._job_status.update(state='finished')
+        except asyncio.CancelledError:
+            self._job_status.update(state='cancelled')
+            raise
+        except Exception as e:
+            self.log.exception('Atomic re-ingestion failed')
+            self._job_status.update(state='failed', error=str(e))
+        finally:
+            self._job_status.update(finished=self.get_current_timestamp())
+
+    async def _reload_abilities(self):
+        """
+        Load the freshly ingested abilities into data_svc, then drop the atomic abilities
+        that no longer exist, so abilities are never missing in between. The index, if built,
+        is updated with the loaded and removed abilities only.
+        """
+        await self._atomic_svc.load_abilities(self.data_svc)
+        ability_ids = self._atomic_svc.ingested_ability_ids
+        for ability in await self.data_svc.locate('abilities', match=dict(plugin='atomic')):
+            if ability.ability_id not in ability_ids:
+                await self.data_svc.remove('abilities', dict(ability_id=ability.ability_id))
+                if self._index is not None:
+                    self._index.remove(ability.ability_id)
+            elif self._index is not None:
+                self._index.add(ability)
+
+    @staticmethod
+    async def _send_event(response, data):
+        await response.write(f'data: {json.dumps(data)}\n\n'.encode())
+
+    async def _get_index(self):
+        if self._index is None:
+            index = AtomicAbilityIndex()
+            for ability in await self.data_svc.locate('abilities', match=dict(plugin='atomic')):
+                index.add(ability)
+            self._index = index
+        return self._index
+
+    @staticmethod
+    def _parse_bool(value):
+        if value is None:
+            return None
+        if value.lower() in ('true', '1'):
+            return True
+        if value.lower() in ('false', '0'):
+            return False
+        raise ValueError(f'Invalid boolean value: {value}')
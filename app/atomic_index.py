@@ -0,0 +1,72 @@
+from collections import defaultdict
+
+FILTERS = ('technique_id', 'tactic', 'platform', 'executor', 'has_payloads')
+
+
+class AtomicAbilityIndex:
+    """
+    In-memory index over the atomic abilities, so that queries and summaries do not
+    scan data_svc. Each filterable value maps to the set of ability ids carrying it.
+    Abilities can be added or removed one at a time after the initial build.
+    """
+
+    def __init__(self):
+        self.abilities = dict()
+        self._keys_by_id = dict()
+        self._postings = {f: defaultdict(set) for f in FILTERS}
+
+    @staticmethod
+    def _keys(ability):
+        # Caldera's Ability.executors is a generator, which can only be iterated once
+        executors = list(ability.executors)
+        return dict(
+            technique_id={ability.technique_id},
+            tactic={ability.tactic},
+            platform={e.platform for e in executors},
+            executor={e.name for e in executors},
+            has_payloads={any(e.payloads for e in executors)},
+        )
+
+    def add(self, ability):
+        self.remove(ability.ability_id)
+        keys = self._keys(ability)
+        self.abilities[ability.ability_id] = ability
+        self._keys_by_id[ability.ability_id] = keys
+        for f, values in keys.items():
+            for value in values:
+                self._postings[f][value].add(ability.ability_id)
+
+    def remove(self, ability_id):
+        if ability_id not in self.abilities:
+            return
+        del self.abilities[ability_id]
+        for f, values in self._keys_by_id.pop(ability_id).items():
+            for value in values:
+                ids = self._postings[f][value]
+                ids.discard(ability_id)
+                if not ids:
+                    del self._postings[f][value]
+
+    def query(self, offset=0, limit=None, **filters):
+        """
+        Return (total, abilities) for the abilities matching every given filter,
+        ordered by ability id and sliced by `offset` and `limit`.
+        """
+        matches = None
+        for f, value in filters.items():
+            if value is None:
+                continue
+            ids = self._postings[f].get(value, set())
+            matches = set(ids) if matches is None else matches & ids
+            if not matches:
+                break
+        ids = sorted(self.abilities if matches is None else matches)
+        end = None if limit is None else offset + limit
+        return len(ids), [self.abilities[i] for i in ids[offset:end]]
+
+    def summary(self):
+        def counts(f):
+            return {value: len(ids) for value, ids in self._postings[f].items()}
+
+        return dict(abilities=len(self.abilities), tactics=counts('tactic'), platforms=counts('platform'),
+                    executors=counts('executor'))
@@ -0,0 +1,151 @@
+import asyncio
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+
+class FileLock:
+    """
+    Lock shared by processes, on one host or several, through a lock file created with O_EXCL,
+    which is atomic on local file systems and on NFS (v3 and later).
+    While the lock is held, a thread refreshes the file's mtime every `heartbeat` seconds. A lock
+    is stale, and broken by the next process wanting it, when its holder was a process of this host
+    which is gone, or when its file was not refreshed for `stale_after` seconds. The latter is
+    judged by watching the mtime change on the local monotonic clock, never by comparing the mtime
+    (set by the file server's clock) with local time, so clock skew between hosts can neither keep
+    an abandoned lock alive nor break a live one.
+    """
+
+    def __init__(self, path, stale_after=120, heartbeat=15, poll_interval=1):
+        self.path = path
+        self.stale_after = stale_after
+        self.heartbeat = heartbeat
+        self.poll_interval = poll_interval
+        self._token = uuid.uuid4().hex
+        self._stop = None
+        # mtime of the lock file as last seen, and the (monotonic) time it was first seen
+        self._seen = (None, None)
+
+    @property
+    def held(self):
+        return self._stop is not None
+
+    def owner(self):
+        """What the holder recorded in the lock file (host, pid, token, acquired), or None."""
+        return self._read(self.path)
+
+    def try_acquire(self):
+        """Take the lock if it is free or stale, without waiting. Return True if it was taken."""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        for _ in range(2):
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if not self._break_if_stale():
+                    return False
+                continue
+            with os.fdopen(fd, 'w') as f:
+                json.dump(dict(host=socket.gethostname(), pid=os.getpid(), token=self._token, acquired=time.time()), f)
+            self._start_heartbeat()
+            return True
+        return False
+
+    async def acquire(self, timeout=None):
+        """Wait for the lock, at most `timeout` seconds. Return True if it was taken."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.try_acquire():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(self.poll_interval)
+        return True
+
+    async def wait(self, timeout=None):
+        """Wait, at most `timeout` seconds, until the lock is released or broken. Return False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while os.path.exists(self.path) and not self._break_if_stale():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(self.poll_interval)
+        return True
+
+    def release(self):
+        if not self.held:
+            return
+        self._stop.set()
+        self._stop = None
+        # the lock may have been judged stale and taken over meanwhile
+        if (self.owner() or dict()).get('token') == self._token:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    """ PRIVATE """
+
+    def _start_heartbeat(self):
+        self._stop = stop = threading.Event()
+
+        def beat():
+            while not stop.wait(self.heartbeat):
+                try:
+                    os.utime(self.path)
+                except OSError:
+                    pass
+        threading.Thread(target=beat, name='atomic-lock-heartbeat', daemon=True).start()
+
+    def _is_stale(self, owner, mtime):
+        if owner and owner.get('host') == socket.gethostname() and not self._alive(owner.get('pid')):
+            return True
+        if self._seen[0] != mtime:
+            self._seen = (mtime, time.monotonic())
+            return False
+        return time.monotonic() - self._seen[1] > self.stale_after
+
+    def _break_if_stale(self):
+        """Remove the lock file if it is stale. Return True if the lock is now free."""
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return True
+        owner = self.owner()
+        if not self._is_stale(owner, mtime):
+            return False
+        # moved aside first, so that of several processes breaking the lock, only one removes it
+        aside = f'{self.path}.{self._token}.stale'
+        try:
+            os.rename(self.path, aside)
+        except FileNotFoundError:
+            return True
+        if self._read(aside) != owner:
+            # another process broke the stale lock and took a new one in between: put it back
+            try:
+                os.link(aside, self.path)
+            except OSError:
+                pass
+        os.remove(aside)
+        self._seen = (None, None)
+        return True
+
+    @staticmethod
+    def _alive(pid):
+        # os.kill() would terminate the process on Windows
+        if not isinstance(pid, int) or os.name == 'nt':
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
@@ -0,0 +1,61 @@
+import os
+import tracemalloc
+
+# allocations made by the profiling itself are left out of the report
+_IGNORED = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<unknown>'))
+
+
+class MemoryProfile:
+    """
+    Attribute the memory allocated during an ingestion to its phases, with tracemalloc.
+    A snapshot is taken at every phase boundary, and compared with the previous one to give
+    the phase's delta and its top allocation sites. Technique files are only measured by the
+    growth of the traced memory while each is ingested, as snapshotting every file would be too slow.
+    """
+
+    def __init__(self, top=10):
+        self.top = top
+        self.phases = []
+        self.files = []
+        self._snapshot = None
+        self._mark = 0
+        self._started = False
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started = True
+        self._snapshot = self._take_snapshot()
+        self._mark = tracemalloc.get_traced_memory()[0]
+
+    def stop(self):
+        if self._started:
+            tracemalloc.stop()
+            self._started = False
+        self._snapshot = None
+
+    def phase(self, name):
+        """Close the phase `name`, which started at the previous boundary."""
+        snapshot = self._take_snapshot()
+        stats = snapshot.compare_to(self._snapshot, 'lineno')
+        self.phases.append(dict(
+            phase=name,
+            delta=sum(s.size_diff for s in stats),
+            top=[dict(site=f'{s.traceback[0].filename}:{s.traceback[0].lineno}', size=s.size_diff, count=s.count_diff)
+                 for s in stats[:self.top] if s.size_diff > 0]
+        ))
+        self._snapshot = snapshot
+        self._mark = tracemalloc.get_traced_memory()[0]
+
+    def file_done(self, filename):
+        current = tracemalloc.get_traced_memory()[0]
+        self.files.append(dict(file=os.path.basename(filename), delta=current - self._mark))
+        self._mark = current
+
+    def report(self):
+        return dict(phases=self.phases, top_files=sorted(self.files, key=lambda f: -f['delta'])[:self.top])
+
+    @staticmethod
+    def _take_snapshot():
+        return tracemalloc.take_snapshot().filter_traces(_IGNORED)
@@ -0,0 +1,165 @@
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import tarfile
+
+import yaml
+
+from plugins.atomic.app.atomic_fingerprint import load_fingerprint, save_fingerprint
+from plugins.atomic.app.atomic_payloads import PAYLOAD_REFS_FILE, load_payload_refs, swap_directory, tree_files
+
+# Bump when the layout of a pack changes; packs of a newer format are refused
+PACK_FORMAT = 1
+MANIFEST = 'manifest.json'
+
+
+def export_pack(data_dir, payloads_dir, target):
+    """
+    Write the abilities under `data_dir` and the payloads they use into the pack `target`, a
+    tar.gz archive holding a manifest, the ability files and one blob per distinct payload content.
+    The manifest lists the sha256 digest of every file, and the fingerprint of the abilities.
+    Return the manifest.
+    """
+    abilities_dir = os.path.join(data_dir, 'abilities')
+    if not os.path.isdir(abilities_dir):
+        raise ValueError(f'No abilities to export in {data_dir}')
+    abilities = {relative_path: _file_digest(os.path.join(abilities_dir, relative_path))
+                 for relative_path in tree_files(abilities_dir)}
+    payload_sources, payloads = dict(), dict()
+    refs = load_payload_refs(os.path.join(data_dir, PAYLOAD_REFS_FILE))
+    for name in sorted(_referenced_payloads(abilities_dir, abilities)):
+        source = _payload_source(name, payloads_dir, refs)
+        payloads[name] = _file_digest(source)
+        payload_sources.setdefault(payloads[name], source)
+    manifest = dict(format=PACK_FORMAT, fingerprint=load_fingerprint(data_dir), abilities=abilities, payloads=payloads)
+
+    os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+    partial_target = target + '.partial'
+    with open(partial_target, 'wb') as raw, \
+            gzip.GzipFile(filename='', fileobj=raw, mode='wb', mtime=0) as compressed, \
+            tarfile.open(fileobj=compressed, mode='w', format=tarfile.GNU_FORMAT) as pack:
+        # the manifest comes first, so an import can check every file as it is read
+        _add_bytes(pack, MANIFEST, json.dumps(manifest, sort_keys=True, indent=1).encode())
+        for relative_path in sorted(abilities):
+            _add_file(pack, f'abilities/{relative_path}', os.path.join(abilities_dir, relative_path))
+        for digest in sorted(payload_sources):
+            _add_file(pack, f'blobs/{digest}', payload_sources[digest])
+    os.replace(partial_target, target)
+    return manifest
+
+
+def import_pack(path, data_dir, payloads_dir):
+    """
+    Install the pack at `path`: its abilities replace data_dir/abilities, its payloads are written
+    into `payloads_dir` and its fingerprint is recorded. The pack is read in one pass, checking each
+    file against the manifest digest, and nothing is installed unless every file matches.
+    Return the manifest.
+    """
+    staging_dir = os.path.join(data_dir, '.pack')
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    try:
+        with tarfile.open(path, mode='r|gz') as pack:
+            manifest = _read_manifest(pack)
+            expected = {f'abilities/{relative_path}': digest for relative_path, digest in manifest['abilities'].items()}
+            expected.update({f'blobs/{digest}': digest for digest in manifest['payloads'].values()})
+            # iterating the pack would start over from the manifest
+            for member in iter(pack.next, None):
+                if not member.isfile() or member.name not in expected:
+                    raise ValueError(f'Unexpected entry in ability pack: {member.name}')
+                _extract_verified(pack, member, os.path.join(staging_dir, *member.name.split('/')), expected.pop(member.name))
+            if expected:
+                raise ValueError(f'Ability pack is missing {len(expected)} file(s), eg. {sorted(expected)[0]}')
+
+        os.makedirs(payloads_dir, exist_ok=True)
+        for name, digest in manifest['payloads'].items():
+            target = os.path.join(payloads_dir, name)
+            if not os.path.isfile(target) or _file_digest(target) != digest:
+                shutil.copyfile(os.path.join(staging_dir, 'blobs', digest), target + '.partial')
+                os.replace(target + '.partial', target)
+        staged_abilities = os.path.join(staging_dir, 'abilities')
+        os.makedirs(staged_abilities, exist_ok=True)
+        swap_directory(staged_abilities, os.path.join(data_dir, 'abilities'))
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    # payloads now all sit in payloads/, lazy references of a previous ingestion no longer apply
+    if os.path.exists(os.path.join(data_dir, PAYLOAD_REFS_FILE)):
+        os.remove(os.path.join(data_dir, PAYLOAD_REFS_FILE))
+    if manifest['fingerprint']:
+        save_fingerprint(data_dir, manifest['fingerprint'])
+    return manifest
+
+
+def _read_manifest(pack):
+    member = pack.next()
+    if member is None or member.name != MANIFEST:
+        raise ValueError('Not an ability pack: the manifest must come first')
+    manifest = json.load(pack.extractfile(member))
+    if not isinstance(manifest.get('format'), int) or manifest['format'] > PACK_FORMAT:
+        raise ValueError(f'Unsupported ability pack format {manifest.get("format")}, upgrade the plugin')
+    for relative_path in manifest['abilities']:
+        if os.path.isabs(relative_path) or '..' in relative_path.split('/') or '\\' in relative_path:
+            raise ValueError(f'Invalid ability path in pack: {relative_path}')
+    for name in manifest['payloads']:
+        if not name or os.path.basename(name) != name or name in ('.', '..'):
+            raise ValueError(f'Invalid payload name in pack: {name}')
+    return manifest
+
+
+def _extract_verified(pack, member, target, digest):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    h = hashlib.sha256()
+    source = pack.extractfile(member)
+    with open(target, 'wb') as f:
+        for chunk in iter(lambda: source.read(1024 * 1024), b''):
+            h.update(chunk)
+            f.write(chunk)
+    if h.hexdigest() != digest:
+        raise ValueError(f'Digest mismatch for {member.name} in ability pack')
+
+
+def _referenced_payloads(abilities_dir, abilities):
+    names = set()
+    for relative_path in abilities:
+        with open(os.path.join(abilities_dir, relative_path), 'r') as f:
+            for ability in yaml.safe_load(f) or []:
+                for executors in (ability.get('platforms') or dict()).values():
+                    for executor in executors.values():
+                        names.update(executor.get('payloads') or [])
+    return names
+
+
+def _payload_source(name, payloads_dir, refs):
+    """The file holding payload `name`: in payloads_dir, or still in the checkout when ingested lazily."""
+    path = os.path.join(payloads_dir, name)
+    if os.path.isfile(path):
+        return path
+    if name in refs and os.path.isfile(refs[name]['source']):
+        with open(refs[name]['source'], 'rb') as f:
+            if hashlib.md5(f.read(), usedforsecurity=False).hexdigest() == refs[name]['digest']:
+                return refs[name]['source']
+        raise ValueError(f'{refs[name]["source"]} changed since it was ingested, run the ingestion again')
+    raise ValueError(f'Payload {name} is used by an ability but missing from {payloads_dir}')
+
+
+def _file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _add_bytes(pack, name, content):
+    info = tarfile.TarInfo(name)
+    info.size, info.mode = len(content), 0o644
+    pack.addfile(info, io.BytesIO(content))
+
+
+def _add_file(pack, name, path):
+    info = tarfile.TarInfo(name)
+    info.size, info.mode = os.path.getsize(path), 0o644
+    with open(path, 'rb') as f:
+        pack.addfile(info, f)
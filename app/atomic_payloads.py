@@ -0,0 +1,125 @@
+import asyncio
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import tarfile
+import zipfile
+
+PAYLOAD_REFS_FILE = 'payload_refs.json'
+# the earliest timestamp a zip entry can hold, given to every archived file so archives only depend on content
+ARCHIVE_DATE = (1980, 1, 1, 0, 0, 0)
+
+
+def load_payload_refs(path):
+    """Return the lazy payloads recorded at `path`: payload name -> dict(source, digest)."""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict()
+
+
+def save_payload_refs(path, refs):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(refs, f, sort_keys=True, indent=1)
+
+
+def materialize(name, ref, payloads_dir):
+    """
+    Copy the attachment behind the lazy payload `name` into `payloads_dir`, unless it is already there.
+    The copy is refused if the attachment changed since it was ingested.
+    """
+    target = os.path.join(payloads_dir, name)
+    if os.path.isfile(target):
+        return target
+    with open(ref['source'], 'rb') as f:
+        digest = hashlib.md5(f.read(), usedforsecurity=False).hexdigest()
+    if digest != ref['digest']:
+        raise ValueError(f'{ref["source"]} changed since it was ingested, run the ingestion again')
+    os.makedirs(payloads_dir, exist_ok=True)
+    partial_target = target + '.partial'
+    shutil.copyfile(ref['source'], partial_target, follow_symlinks=False)
+    os.replace(partial_target, target)
+    return target
+
+
+async def register_payload_refs(file_svc, refs, payloads_dir):
+    """
+    Register every lazy payload as a Caldera special payload, so that the first agent
+    requesting it materializes it from the Atomic Red Team checkout.
+    """
+    async def serve(headers):
+        name = headers.get('file')
+        await asyncio.get_running_loop().run_in_executor(None, materialize, name, refs[name], payloads_dir)
+        return name, name
+
+    for name in refs:
+        await file_svc.add_special_payload(name, serve)
+
+
+def tree_digest(path):
+    """Hash of the relative paths and contents of the files under `path`, ignoring timestamps."""
+    h = hashlib.md5(usedforsecurity=False)
+    for relative_path in tree_files(path):
+        with open(os.path.join(path, relative_path), 'rb') as f:
+            h.update(relative_path.encode() + b'\0' + hashlib.md5(f.read(), usedforsecurity=False).digest())
+    return h.hexdigest()
+
+
+def build_archive(path, target, folder, archive_format):
+    """
+    Archive the files under `path` into `target`, a 'zip' or 'tar.gz' archive in which they
+    sit under `folder`. Entries are sorted and stripped of timestamps and owners, so the
+    same tree always gives the same archive.
+    """
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    partial_target = target + '.partial'
+    if archive_format == 'zip':
+        with zipfile.ZipFile(partial_target, 'w') as archive:
+            for relative_path, mode, content in _tree_entries(path):
+                info = zipfile.ZipInfo(f'{folder}/{relative_path}', date_time=ARCHIVE_DATE)
+                info.external_attr = mode << 16
+                info.compress_type = zipfile.ZIP_DEFLATED
+                archive.writestr(info, content)
+    else:
+        with open(partial_target, 'wb') as raw, \
+                gzip.GzipFile(filename='', fileobj=raw, mode='wb', mtime=0) as compressed, \
+                tarfile.open(fileobj=compressed, mode='w', format=tarfile.GNU_FORMAT) as archive:
+            for relative_path, mode, content in _tree_entries(path):
+                info = tarfile.TarInfo(f'{folder}/{relative_path}')
+                info.size, info.mode = len(content), mode
+                archive.addfile(info, io.BytesIO(content))
+    os.replace(partial_target, target)
+
+
+def tree_files(path):
+    files = []
+    for root, _, names in os.walk(path):
+        for name in names:
+            full_path = os.path.join(root, name)
+            if os.path.isfile(full_path) and not os.path.islink(full_path):
+                files.append(os.path.relpath(full_path, path).replace(os.sep, '/'))
+    return sorted(files)
+
+
+def swap_directory(src, dst):
+    """Replace `dst` with `src`, keeping the window where `dst` is missing to two renames."""
+    old = dst + '.old'
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(dst):
+        os.rename(dst, old)
+    os.rename(src, dst)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def _tree_entries(path):
+    for relative_path in tree_files(path):
+        full_path = os.path.join(path, relative_path)
+        # only the executable bit is kept
+        mode = 0o755 if os.stat(full_path).st_mode & 0o111 else 0o644
+        with open(full_path, 'rb') as f:
+            yield relative_path, mode, f.read()
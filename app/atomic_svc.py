@@ -1,31 +1,68 @@
+import asyncio
 import json
 import glob
 import hashlib
 import os
 import re
 import shutil
+import shelve
+import sys
+import tempfile
+import time
 import yaml
 
-from collections import defaultdict
-from subprocess import DEVNULL, STDOUT, check_call
+from collections import defaultdict, deque
+from functools import partial
+from subprocess import DEVNULL, STDOUT, check_call, check_output
+from urllib.parse import unquote, urlparse
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, where the peak memory is not reported
+    resource = None
 
 from app.utility.base_world import BaseWorld
 from app.utility.base_service import BaseService
 from app.objects.c_agent import Agent
+from plugins.atomic.app.atomic_fingerprint import compute_fingerprint, save_fingerprint, transformer_digest
+from plugins.atomic.app.atomic_lock import FileLock
+from plugins.atomic.app.atomic_memory import MemoryProfile
+from plugins.atomic.app.atomic_payloads import (PAYLOAD_REFS_FILE, build_archive, load_payload_refs,
+                                                register_payload_refs, save_payload_refs, swap_directory, tree_digest)
 
 PLATFORMS = dict(windows='windows', macos='darwin', linux='linux')
 EXECUTORS = dict(command_prompt='cmd', sh='sh', powershell='psh', bash='sh')
+PARSERS = dict(psh='plugins.atomic.app.parsers.atomic_powershell', sh='plugins.atomic.app.parsers.atomic_sh',
+               cmd='plugins.atomic.app.parsers.atomic_cmd')
+SCRIPT_EXTENSIONS = dict(psh='ps1', sh='sh', cmd='bat')
 RE_VARIABLE = re.compile('(#{(.*?)})', re.DOTALL)
 PREFIX_HASH_LEN = 6
+ATOMIC_RED_TEAM_URL = 'https://github.com/redcanaryco/atomic-red-team.git'
+REPO_URL_SCHEMES = ('https', 'ssh', 'file')
 
 
 class ExtractionError(Exception):
     pass
 
 
+def check_repo_url(repo_url):
+    """
+    Raise ValueError unless `repo_url` is an https, ssh or file URL, or a path (scp-like ssh
+    addresses included). Anything git could read as an option or a transport helper is refused.
+    """
+    if not isinstance(repo_url, str) or not repo_url.strip() or repo_url.startswith('-'):
+        raise ValueError(f'Invalid repository URL: {repo_url!r}')
+    if '://' in repo_url:
+        if urlparse(repo_url).scheme.lower() not in REPO_URL_SCHEMES:
+            raise ValueError(f'Repository URLs must use one of the schemes {", ".join(REPO_URL_SCHEMES)}')
+    elif '::' in repo_url:
+        raise ValueError(f'Invalid repository URL: {repo_url!r}')
+
+
 class AtomicService(BaseService):
 
-    def __init__(self):
+    def __init__(self, atomic_dir=None):
         self.log = self.add_service('atomic_svc', self)
 
         # Atomic Red Team attacks don't come with the corresponding tactic (phase name)
@@ -33,57 +70,578 @@ class AtomicService(BaseService):
         # This variable is filled by self._populate_dict_techniques_tactics()
         self.technique_to_tactics = defaultdict(list)
 
-        self.atomic_dir = os.path.join('plugins', 'atomic')
+        # the plugin directory, relative to Caldera's root unless given
+        self.atomic_dir = atomic_dir or os.path.join('plugins', 'atomic')
         self.repo_dir = os.path.join(self.atomic_dir, 'data/atomic-red-team')
         self.data_dir = os.path.join(self.atomic_dir, 'data')
         self.payloads_dir = os.path.join(self.atomic_dir, 'payloads')
         self.processing_debug = False
 
+        config = self._load_config(os.path.join(self.atomic_dir, 'conf', 'default.yml'))
+        # bare mirror of the repository (a path or file:// URL) which updates fetch into, and the checkout
+        # shares its objects with, and the branch, tag or commit to check out ('' for the default branch)
+        self.repo_mirror = self._local_path(config.get('repo_mirror') or '') or None
+        self.repo_ref = config.get('repo_ref') or None
+        # include/exclude lists restricting which tests get ingested
+        self.filters = config.get('ingestion_filters') or dict()
+        # what to do with tests compiling to the same commands: 'off', 'report' or 'collapse'
+        self.duplicates_mode = config.get('duplicate_abilities', 'report')
+        self.duplicates = []
+        # 'files' writes one yaml file per ability, 'bundle' writes every ability into a single yaml file
+        self.output_format = config.get('output_format', 'files')
+        self._bundle = dict()
+        # cap how many technique documents are held at once, and keep the bundle on disk
+        self.memory_bounded = config.get('memory_bounded', False)
+        self.max_documents_in_flight = config.get('max_documents_in_flight', 2)
+
+        # ingestion runs as load -> compile -> write stages, connected by queues of this size
+        self.pipeline_queue_size = config.get('pipeline_queue_size', 8)
+        # while a pipeline runs, file operations are buffered here for the write stage
+        self._write_buffer = None
+        self._pending_writes = dict()
+
+        # 'copy' copies attachments into payloads/ during ingestion, 'lazy' only records where they are,
+        # and copies them when an agent first requests them
+        self.payload_mode = config.get('payload_mode', 'copy')
+        self.payload_refs_path = os.path.join(self.data_dir, PAYLOAD_REFS_FILE)
+        self._payload_refs = dict()
+
+        # 'archive' packages attachments which are whole directories into one archive payload, 'ignore' leaves them
+        self.directory_attachments = config.get('directory_attachments', 'archive')
+        # archive payload name -> folder it unpacks to, and directory -> tree digest
+        self._archives = dict()
+        self._directory_digests = dict()
+
+        # commands longer than script_payload_threshold once joined on one line can instead be shipped
+        # as a script payload, run by a short launcher command
+        self.script_payloads = config.get('script_payloads', False)
+        self.script_payload_threshold = config.get('script_payload_threshold', 2048)
+        self._scripts = set()
+
+        # tests which failed to ingest, skipped on later runs until their content changes
+        self.quarantine_enabled = config.get('quarantine', True)
+        self.quarantine_path = os.path.join(self.data_dir, 'quarantine.yml')
+        self.quarantine = dict()
+        self._quarantine_seen = set()
+        self._transformer_digest = None
+
+        # summary of the last ingestion: counters, duration and, when memory bounded, peak memory
+        self.ingestion_report = dict()
+        # attribute the memory allocated by ingestion to its phases, in the ingestion report (slow, for diagnosis)
+        self.memory_profile = config.get('memory_profile', False)
+        self.memory_profile_top = config.get('memory_profile_top', 10)
+        self._memory_profile = None
+
+        # prebuilt ability pack to install in place of the first ingestion
+        self.ability_pack = config.get('ability_pack') or None
+
+        # processes sharing data/ take turns ingesting through this lock file. 'wait' for the one ingesting
+        # (at most ingestion_lock_timeout seconds), or 'continue' without its result
+        self.lock_path = os.path.join(self.data_dir, '.ingestion.lock')
+        self.lock_mode = config.get('ingestion_lock', 'wait')
+        self.lock_timeout = config.get('ingestion_lock_timeout', 1800)
+        self.lock_stale_after = config.get('ingestion_lock_stale_after', 120)
+
+        # Latest ingestion progress, pushed to every queue returned by self.subscribe_progress().
+        # A refresh is 'running' from the repository update ('updating' phase) to the end of the ingestion
+        self.progress = dict(state='idle', phase=None, files_done=0, files_total=0, tests_total=0, tests_ingested=0,
+                             errors=0, eta=None)
+        self._progress_listeners = set()
+
+        # (prereq_command, get_prereq_command, dependency executor, ability executor) -> header block or ExtractionError
+        self._prereq_cache = dict()
+
+        # ability id -> (rank of the source it was saved from, file path), and payload digest -> payload name,
+        # used to deduplicate abilities and attachments across sources
+        self._ability_sources = dict()
+        self._payload_digests = dict()
+
+        # digest of the compiled platforms/executors/commands/cleanups -> (ability id, file path)
+        self._content_index = dict()
+
     async def clone_atomic_red_team_repo(self, repo_url=None):
         """
         Clone the Atomic Red Team repository. You can use a specific url via
         the `repo_url` parameter (eg. if you want to use a fork).
         """
-        if not repo_url:
-            repo_url = 'https://github.com/redcanaryco/atomic-red-team.git'
-
+        if repo_url:
+            check_repo_url(repo_url)
         if not os.path.exists(self.repo_dir) or not os.listdir(self.repo_dir):
+            if self.repo_mirror:
+                return await self._checkout_from_mirror(repo_url)
+            repo_url = repo_url or ATOMIC_RED_TEAM_URL
             self.log.debug('cloning repo %s' % repo_url)
-            check_call(['git', 'clone', '--depth', '1', repo_url, self.repo_dir], stdout=DEVNULL, stderr=STDOUT)
+            await self._git('clone', '--depth', '1', '--', repo_url, self.repo_dir)
+            if self.repo_ref:
+                await self._git('-C', self.repo_dir, 'fetch', '--depth', '1', '--', 'origin', self.repo_ref)
+                await self._git('-C', self.repo_dir, 'reset', '--hard', 'FETCH_HEAD')
             self.log.debug('clone complete')
 
-    async def populate_data_directory(self, path_yaml=None):
+    async def update_atomic_red_team_repo(self, repo_url=None):
+        """
+        Bring the Atomic Red Team repository up to date: clone it if it is missing,
+        otherwise fetch the latest commit of `repo_url` (or origin) and check it out.
+        With a mirror, only what the mirror lacks is fetched, then the pinned ref is checked out.
+        """
+        if repo_url:
+            check_repo_url(repo_url)
+        if self.repo_mirror:
+            return await self._checkout_from_mirror(repo_url)
+        if not os.path.exists(self.repo_dir) or not os.listdir(self.repo_dir):
+            return await self.clone_atomic_red_team_repo(repo_url)
+        self.log.debug('updating repo %s' % self.repo_dir)
+        ref = [self.repo_ref] if self.repo_ref else []
+        await self._git('-C', self.repo_dir, 'fetch', '--depth', '1', '--', repo_url or 'origin', *ref)
+        await self._git('-C', self.repo_dir, 'reset', '--hard', 'FETCH_HEAD')
+        self.log.debug('update complete')
+
+    async def populate_data_directory(self, path_yaml=None, sources=None, filters=None):
         """
         Populate the 'data' directory with the Atomic Red Team abilities.
         These data will be usable by caldera after importation.
         You can specify where the yaml files to import are located with the `path_yaml` parameter.
         By default, read the yaml files in the atomics/ directory inside the Atomic Red Team repository.
+
+        Several checkouts (eg. a fork next to upstream) can be imported in one pass with `sources`,
+        a list of dicts with a `repo_dir` and an optional `path_yaml`, in precedence order.
+        Sources are ingested concurrently. An ability found in several sources is written from
+        the first one listing it, and identical attachments are only stored once.
+
+        `filters` replaces the include/exclude filters read from the plugin configuration.
+        """
+        if filters is not None:
+            self.filters = filters
+        if not sources:
+            sources = [dict(repo_dir=self.repo_dir, path_yaml=path_yaml)]
+
+        self._memory_profile = MemoryProfile(self.memory_profile_top) if self.memory_profile else None
+        if self._memory_profile:
+            self._memory_profile.start()
+        try:
+            if not self.technique_to_tactics:
+                await self._populate_dict_techniques_tactics(sources[0]['repo_dir'])
+            if self._memory_profile:
+                self._memory_profile.phase('tactics')
+            await self._ingest_sources(sources)
+        finally:
+            if self._memory_profile:
+                self._memory_profile.stop()
+                self._memory_profile = None
+
+    async def refresh_abilities(self, repo_url=None, update=True, sources=None):
+        """
+        Update the repository (unless `update` is False) and ingest it again, or ingest `sources`
+        as populate_data_directory() would. Abilities are written to a staging directory first, and
+        only replace data/abilities once the ingestion completed, so a failed or cancelled refresh
+        leaves the current abilities untouched.
+        """
+        if update:
+            self._publish_progress(state='running', phase='updating', eta=None)
+            try:
+                await self.update_atomic_red_team_repo(repo_url)
+            except asyncio.CancelledError:
+                self._publish_progress(state='cancelled')
+                raise
+            except Exception:
+                self._publish_progress(state='failed')
+                raise
+        fingerprint = compute_fingerprint(self.repo_dir, self.atomic_dir)
+        final_dir = self.data_dir
+        staging_dir = os.path.join(final_dir, '.staging')
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        self.data_dir = staging_dir
+        try:
+            await self.populate_data_directory(sources=sources)
+            staged_abilities = os.path.join(staging_dir, 'abilities')
+            os.makedirs(staged_abilities, exist_ok=True)
+            swap_directory(staged_abilities, os.path.join(final_dir, 'abilities'))
+        finally:
+            self.data_dir = final_dir
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        if fingerprint:
+            save_fingerprint(self.data_dir, fingerprint)
+
+    async def run_exclusive(self, ingest, needed=lambda: True):
+        """
+        Run the coroutine function `ingest` holding the ingestion lock, so that of the processes sharing
+        data/, only one ingests at a time. `needed` tells if there is still something to ingest, and is
+        checked again once the lock is taken, as another process may have done the work meanwhile.
+        When another process holds the lock, wait for it, or return at once in 'continue' lock mode.
+        Return True if `ingest` ran.
+        """
+        lock = FileLock(self.lock_path, stale_after=self.lock_stale_after)
+        deadline = time.monotonic() + self.lock_timeout
+        while needed():
+            if lock.try_acquire():
+                try:
+                    if not needed():
+                        return False
+                    await ingest()
+                    return True
+                finally:
+                    lock.release()
+            owner = lock.owner() or dict()
+            if self.lock_mode == 'continue':
+                self.log.info('%s:%s is ingesting, continuing without its abilities', owner.get('host'), owner.get('pid'))
+                return False
+            self.log.info('Waiting for %s:%s to finish ingesting', owner.get('host'), owner.get('pid'))
+            if not await lock.wait(max(deadline - time.monotonic(), 0)):
+                self.log.warning('Gave up waiting for the ingestion lock %s after %ss', self.lock_path, self.lock_timeout)
+                return False
+        return False
+
+    @property
+    def ingested_ability_ids(self):
+        """Ids of the abilities saved by the last ingestion."""
+        return set(self._ability_sources)
+
+    async def load_abilities(self, data_svc):
         """
-        if not self.technique_to_tactics:
-            await self._populate_dict_techniques_tactics()
-
-        if not path_yaml:
-            path_yaml = os.path.join(self.repo_dir, 'atomics', '**', 'T*.yaml')
-
-        at_total = 0
-        at_ingested = 0
-        errors = 0
-        for filename in glob.iglob(path_yaml):
-            for entries in BaseWorld.strip_yml(filename):
-                for test in entries.get('atomic_tests'):
-                    at_total += 1
-                    try:
-                        if await self._save_ability(entries, test):
-                            at_ingested += 1
-                    except Exception as e:
-                        self.log.debug(e)
-                        errors += 1
-
-        errors_output = f' and ran into {errors} errors' if errors else ''
-        self.log.debug(f'Ingested {at_ingested} abilities (out of {at_total}) from Atomic plugin{errors_output}')
+        Register the ingested abilities with data_svc: a single file to load in bundle mode,
+        one file per ability otherwise.
+        """
+        if self.output_format == 'bundle':
+            filenames = [self._bundle_path()]
+        else:
+            filenames = glob.iglob(os.path.join(self.data_dir, 'abilities', '**', '*.yml'), recursive=True)
+        for filename in filenames:
+            await data_svc.load_ability_file(filename, BaseWorld.Access.RED)
+
+    def subscribe_progress(self):
+        """
+        Return a queue receiving a copy of self.progress each time ingestion progresses,
+        starting with the current state. Release it with self.unsubscribe_progress().
+        """
+        queue = asyncio.Queue()
+        queue.put_nowait(dict(self.progress))
+        self._progress_listeners.add(queue)
+        return queue
+
+    def unsubscribe_progress(self, queue):
+        self._progress_listeners.discard(queue)
+
+    async def register_payloads(self, file_svc):
+        """Make the lazy payloads recorded so far servable by Caldera."""
+        await register_payload_refs(file_svc, load_payload_refs(self.payload_refs_path), self.payloads_dir)
+
+    def quarantine_report(self):
+        """List the quarantined tests, with the error which got them quarantined."""
+        return sorted((dict(entry, digest=key.split(':')[0]) for key, entry in self.quarantine.items()),
+                      key=lambda entry: (entry['technique'] or '', entry['name'] or ''))
 
     """ PRIVATE """
 
+    @staticmethod
+    async def _git(*args):
+        # run in a thread so a long clone or fetch does not block the event loop
+        command = partial(check_call, ['git', *args], stdout=DEVNULL, stderr=STDOUT)
+        await asyncio.get_running_loop().run_in_executor(None, command)
+
+    @staticmethod
+    async def _git_output(*args):
+        command = partial(check_output, ['git', *args], stderr=DEVNULL, text=True)
+        return (await asyncio.get_running_loop().run_in_executor(None, command)).strip()
+
+    @staticmethod
+    def _local_path(location):
+        """A local path given as is or as a file:// URL."""
+        if location.startswith('file://'):
+            return unquote(urlparse(location).path)
+        return location
+
+    async def _sync_mirror(self, repo_url):
+        """Create the bare mirror of `repo_url`, or fetch only what it lacks from `repo_url` (or its origin)."""
+        if not os.path.isdir(self.repo_mirror):
+            repo_url = repo_url or ATOMIC_RED_TEAM_URL
+            self.log.debug('mirroring repo %s into %s' % (repo_url, self.repo_mirror))
+            await self._git('clone', '--mirror', '--', repo_url, self.repo_mirror)
+            return
+        if repo_url:
+            await self._git('--git-dir', self.repo_mirror, 'remote', 'set-url', '--', 'origin', repo_url)
+        self.log.debug('fetching into mirror %s' % self.repo_mirror)
+        await self._git('--git-dir', self.repo_mirror, 'fetch', '--prune', 'origin')
+
+    async def _checkout_from_mirror(self, repo_url):
+        """
+        Update the mirror, then check out the pinned ref (or the mirror's HEAD) into repo_dir, a clone
+        sharing the mirror's objects, so that checking out another commit copies nothing but its files.
+        """
+        await self._sync_mirror(repo_url)
+        commit = await self._git_output('--git-dir', self.repo_mirror, 'rev-parse', '--verify',
+                                        '%s^{commit}' % (self.repo_ref or 'HEAD'))
+        if not self._shares_mirror_objects():
+            shutil.rmtree(self.repo_dir, ignore_errors=True)
+            await self._git('clone', '--shared', '--no-checkout', '--quiet', '--', self.repo_mirror, self.repo_dir)
+        await self._git('-C', self.repo_dir, 'checkout', '--force', '--detach', commit)
+        await self._git('-C', self.repo_dir, 'clean', '-ffdx')
+        self.log.debug('checked out %s' % commit)
+
+    def _shares_mirror_objects(self):
+        try:
+            with open(os.path.join(self.repo_dir, '.git', 'objects', 'info', 'alternates'), 'r') as f:
+                alternates = [os.path.realpath(line.strip()) for line in f if line.strip()]
+        except OSError:
+            return False
+        return os.path.realpath(os.path.join(self.repo_mirror, 'objects')) in alternates
+
+    async def _ingest_sources(self, sources):
+        loop = asyncio.get_running_loop()
+        source_files = []
+        for source in sources:
+            source_path_yaml = source.get('path_yaml') or os.path.join(source['repo_dir'], 'atomics', '**', 'T*.yaml')
+            filenames = await loop.run_in_executor(None, self._discover, source_path_yaml)
+            source_files.append((source['repo_dir'], filenames))
+
+        stats = dict(files_done=0, files_total=sum(len(f) for _, f in source_files), tests_total=0,
+                     tests_ingested=0, errors=0)
+        self._ability_sources = dict()
+        self._content_index = dict()
+        self.duplicates = []
+        self._bundle = self._open_bundle_store()
+        self.quarantine = self._load_quarantine() if self.quarantine_enabled else dict()
+        self._quarantine_seen = set()
+        self._transformer_digest = transformer_digest(self.atomic_dir)
+        completed = False
+        if self.memory_bounded:
+            slots = asyncio.Semaphore(self.max_documents_in_flight)
+        else:
+            # one document being compiled and a full queue per source, so loading runs ahead of compiling
+            slots = asyncio.Semaphore(len(source_files) * (max(self.pipeline_queue_size, 1) + 1))
+        start = time.monotonic()
+        self._publish_progress(state='running', phase='ingesting', eta=None, **stats)
+        writes = asyncio.Queue(maxsize=self.pipeline_queue_size)
+        self._write_buffer = deque()
+        self._pending_writes = dict()
+
+        async def compile_sources():
+            await self._run_stages(*(self._ingest_source(rank, repo_dir, filenames, stats, start, slots, writes)
+                                     for rank, (repo_dir, filenames) in enumerate(source_files)))
+            await writes.put(None)
+
+        try:
+            await self._run_stages(compile_sources(), self._write_stage(writes))
+            if self._memory_profile:
+                self._memory_profile.phase('ingestion')
+            if self.output_format == 'bundle':
+                await loop.run_in_executor(None, self._write_bundle)
+            if self._payload_refs:
+                save_payload_refs(self.payload_refs_path, dict(load_payload_refs(self.payload_refs_path),
+                                                               **self._payload_refs))
+            if self._memory_profile:
+                self._memory_profile.phase('write')
+            completed = True
+        except asyncio.CancelledError:
+            self._publish_progress(state='cancelled')
+            raise
+        except Exception:
+            self._publish_progress(state='failed')
+            raise
+        finally:
+            self._write_buffer = None
+            self._pending_writes = dict()
+            self._close_bundle_store()
+            if self.quarantine_enabled:
+                self._save_quarantine(prune=completed)
+            self.ingestion_report = dict(stats, duplicates=len(self.duplicates), quarantined=len(self._quarantine_seen),
+                                         duration=round(time.monotonic() - start, 3))
+            if self.memory_bounded and resource:
+                self.ingestion_report['peak_memory'] = self._peak_rss()
+            if self._memory_profile:
+                self.ingestion_report['memory_profile'] = self._memory_profile.report()
+
+        self._publish_progress(state='finished', eta=0)
+        errors_output = f' and ran into {stats["errors"]} errors' if stats['errors'] else ''
+        if self.duplicates:
+            action = 'collapsed' if self.duplicates_mode == 'collapse' else 'found'
+            self.log.debug(f'{action} {len(self.duplicates)} abilities duplicating the commands of another one')
+        self.log.debug(f'Ingested {stats["tests_ingested"]} abilities (out of {stats["tests_total"]}) '
+                       f'from Atomic plugin{errors_output}')
+        for entry in self.quarantine_report():
+            self.log.debug(f'Quarantined "{entry["name"]}" ({entry["technique"]}): {entry["error"]}: {entry["reason"]}')
+        if 'peak_memory' in self.ingestion_report:
+            self.log.debug(f'Peak resident memory of the process: {self.ingestion_report["peak_memory"]} bytes')
+        for phase in self.ingestion_report.get('memory_profile', dict()).get('phases', []):
+            top_site = f', mostly at {phase["top"][0]["site"]}' if phase['top'] else ''
+            self.log.debug(f'Memory allocated by the {phase["phase"]} phase: {phase["delta"]} bytes{top_site}')
+
+    @staticmethod
+    def _peak_rss():
+        """Peak resident set size of this process so far, in bytes."""
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes everywhere but on macOS
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+    @staticmethod
+    async def _run_stages(*stages):
+        """Run pipeline stages concurrently. If one fails or is cancelled, the others are cancelled too."""
+        tasks = [asyncio.ensure_future(stage) for stage in stages]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    def _discover(self, path_yaml):
+        return [f for f in glob.iglob(path_yaml) if self._technique_file_wanted(f)]
+
+    async def _ingest_source(self, rank, repo_dir, filenames, stats, start, slots, writes):
+        """
+        Ingest the yaml files of one source, updating the shared `stats` counters.
+        `rank` is the precedence of the source, lower ranks win over higher ones.
+        Files are parsed in an executor by the load stage, a technique document being only
+        loaded while holding one of the `slots`, and compiled into abilities as they arrive.
+        """
+        documents = asyncio.Queue(maxsize=self.pipeline_queue_size)
+        await self._run_stages(self._load_stage(filenames, slots, documents),
+                               self._compile_stage(rank, repo_dir, stats, start, slots, documents, writes))
+
+    async def _load_stage(self, filenames, slots, documents):
+        loop = asyncio.get_running_loop()
+        for filename in filenames:
+            await slots.acquire()
+            try:
+                entries = await loop.run_in_executor(None, BaseWorld.strip_yml, filename)
+            except BaseException:
+                slots.release()
+                raise
+            await documents.put((filename, list(entries)))
+        await documents.put(None)
+
+    async def _compile_stage(self, rank, repo_dir, stats, start, slots, documents, writes):
+        while True:
+            item = await documents.get()
+            if item is None:
+                break
+            filename, file_documents = item
+            try:
+                while file_documents:
+                    # drop each document as soon as its tests are saved
+                    entries = file_documents.pop(0)
+                    for test in entries.get('atomic_tests'):
+                        stats['tests_total'] += 1
+                        if self._is_quarantined(test):
+                            continue
+                        try:
+                            if await self._save_ability(entries, test, repo_dir=repo_dir, rank=rank):
+                                stats['tests_ingested'] += 1
+                        except Exception as e:
+                            self.log.debug(e)
+                            stats['errors'] += 1
+                            self._quarantine_test(entries, test, e)
+                    del entries
+            finally:
+                slots.release()
+            # blocks while the write stage is behind
+            while self._write_buffer:
+                await writes.put(self._write_buffer.popleft())
+            stats['files_done'] += 1
+            if self._memory_profile:
+                self._memory_profile.file_done(filename)
+            elapsed = time.monotonic() - start
+            self._publish_progress(eta=round(elapsed / stats['files_done'] * (stats['files_total'] - stats['files_done']), 1),
+                                   **stats)
+            # let the event loop flush progress to subscribers, and other sources progress, between files
+            await asyncio.sleep(0)
+
+    async def _write_stage(self, writes):
+        loop = asyncio.get_running_loop()
+        while True:
+            operation = await writes.get()
+            if operation is None:
+                return
+            await loop.run_in_executor(None, operation)
+            if operation.func == self._dump_ability:
+                # only forget the ability if it was not saved again in the meantime
+                file_path, data = operation.args
+                if self._pending_writes.get(file_path) is data:
+                    del self._pending_writes[file_path]
+
+    def _run_io(self, function, *args, **kwargs):
+        """Run a blocking file operation now, or buffer it for the write stage while a pipeline runs."""
+        if self._write_buffer is None:
+            function(*args, **kwargs)
+        else:
+            self._write_buffer.append(partial(function, *args, **kwargs))
+
+    @staticmethod
+    def _load_config(conf_path):
+        if not os.path.isfile(conf_path):
+            return dict()
+        with open(conf_path, 'r') as f:
+            return yaml.safe_load(f) or dict()
+
+    def _passes_filters(self, kind, values):
+        """
+        Return True if at least one of `values` is included (or no include list is set)
+        and not excluded by the `kind` filters.
+        """
+        include = self.filters.get('include', dict()).get(kind) or []
+        exclude = self.filters.get('exclude', dict()).get(kind) or []
+
+        def matches(value, patterns):
+            return any(value == p or (kind == 'techniques' and value.startswith(p + '.')) for p in patterns)
+
+        return any((not include or matches(v, include)) and not matches(v, exclude) for v in values)
+
+    def _technique_file_wanted(self, filename):
+        """Filter on technique and tactic from the file name alone, before any yaml is parsed."""
+        technique_id = os.path.splitext(os.path.basename(filename))[0]
+        tactics = self.technique_to_tactics.get(technique_id, ['redcanary-unknown'])
+        return self._passes_filters('techniques', [technique_id]) and self._passes_filters('tactics', tactics)
+
+    @staticmethod
+    def _test_digest(test):
+        """Hash of a test's content, which is also the id of its ability."""
+        return hashlib.md5(json.dumps(test).encode(), usedforsecurity=False).hexdigest()
+
+    def _load_quarantine(self):
+        if not os.path.isfile(self.quarantine_path):
+            return dict()
+        with open(self.quarantine_path, 'r') as f:
+            return yaml.safe_load(f) or dict()
+
+    def _save_quarantine(self, prune=False):
+        """
+        Persist the quarantine. When `prune` is set, tests which were not met again
+        (they changed, were removed upstream, or the plugin changed since they failed) are dropped.
+        """
+        if prune:
+            self.quarantine = {d: e for d, e in self.quarantine.items() if d in self._quarantine_seen}
+        if not self.quarantine and not os.path.isfile(self.quarantine_path):
+            return
+        os.makedirs(os.path.dirname(self.quarantine_path), exist_ok=True)
+        with open(self.quarantine_path, 'w') as f:
+            yaml.safe_dump(self.quarantine, f, sort_keys=True)
+
+    def _quarantine_key(self, test):
+        """
+        The test digest, qualified by the plugin version, transformer version and configuration it
+        failed with: a test quarantined by one version of the plugin is retried by the next.
+        """
+        return f'{self._test_digest(test)}:{self._transformer_digest}'
+
+    def _is_quarantined(self, test):
+        key = self._quarantine_key(test)
+        if key not in self.quarantine:
+            return False
+        self._quarantine_seen.add(key)
+        return True
+
+    def _quarantine_test(self, entries, test, error):
+        if not self.quarantine_enabled:
+            return
+        key = self._quarantine_key(test)
+        self.quarantine[key] = dict(name=test.get('name'), technique=entries.get('attack_technique'),
+                                    error=type(error).__name__, reason=str(error))
+        self._quarantine_seen.add(key)
+
+    def _publish_progress(self, **changes):
+        self.progress.update(changes)
+        for queue in self._progress_listeners:
+            queue.put_nowait(dict(self.progress))
+
     @staticmethod
     def _gen_single_match_tactic_technique(mitre_json):
         """
@@ -103,12 +661,12 @@ class AtomicService(BaseService):
                     phase_name = kc.get('phase_name')
                     yield phase_name, external_id
 
-    async def _populate_dict_techniques_tactics(self):
+    async def _populate_dict_techniques_tactics(self, repo_dir=None):
         """
         Populate internal dictionary used to match techniques to corresponding tactics.
         Use the file 'enterprise-attack.json' located in the Atomic Red Team repository.
         """
-        enterprise_attack_path = os.path.join(self.repo_dir, 'atomic_red_team', 'enterprise-attack.json')
+        enterprise_attack_path = os.path.join(repo_dir or self.repo_dir, 'atomic_red_team', 'enterprise-attack.json')
 
         with open(enterprise_attack_path, 'r') as f:
             mitre_json = json.load(f)
@@ -122,17 +680,55 @@ class AtomicService(BaseService):
         # to avoid collisions between payloads with the same name
         with open(attachment_path, 'rb') as f:
             h = hashlib.md5(f.read(), usedforsecurity=False).hexdigest()
+        # the same file is often referenced by several tests, or shipped by several sources
+        if h in self._payload_digests:
+            return self._payload_digests[h]
         payload_name = h[:PREFIX_HASH_LEN] + '_' + payload_name
-        shutil.copyfile(attachment_path, os.path.join(self.payloads_dir, payload_name), follow_symlinks=False)
+        if self.payload_mode == 'lazy':
+            self._payload_refs[payload_name] = dict(source=os.path.abspath(attachment_path), digest=h)
+        else:
+            self._run_io(shutil.copyfile, attachment_path, os.path.join(self.payloads_dir, payload_name),
+                         follow_symlinks=False)
+        self._payload_digests[h] = payload_name
+        return payload_name
+
+    def _handle_directory_attachment(self, directory, platform):
+        """
+        Package a directory into a single archive payload (zip for windows, tar.gz otherwise),
+        named after the digest of its tree so that it is only built once for a given content.
+        Return the payload name. The archive unpacks to the folder self._archives[payload name].
+        """
+        if directory not in self._directory_digests:
+            self._directory_digests[directory] = tree_digest(directory)
+        digest = self._directory_digests[directory]
+        archive_format = 'zip' if platform == PLATFORMS['windows'] else 'tar.gz'
+        folder = digest[:PREFIX_HASH_LEN] + '_' + os.path.basename(os.path.normpath(directory))
+        payload_name = f'{folder}.{archive_format}'
+        if payload_name in self._archives:
+            return payload_name
+        self._archives[payload_name] = folder
+        target = os.path.join(self.payloads_dir, payload_name)
+        # archives are deterministic, one left by a previous ingestion is reused as is
+        if not os.path.isfile(target):
+            self._run_io(build_archive, directory, target, folder, archive_format)
         return payload_name
 
+    @staticmethod
+    def _unpack_command(payload_name, executor):
+        if payload_name.endswith('.zip') and executor == 'psh':
+            return f'Expand-Archive -Force -Path "{payload_name}" -DestinationPath .'
+        if payload_name.endswith('.zip'):
+            # bsdtar, shipped with Windows 10 and later, also reads zip archives
+            return f'tar -xf "{payload_name}"'
+        return f'tar -xzf "{payload_name}"'
+
     @staticmethod
     def _normalize_path(path, platform):
         if platform == PLATFORMS['windows']:
             return path.replace('\\', '/')
         return path
 
-    def _catch_path_to_atomics_folder(self, string_to_analyse, platform):
+    def _catch_path_to_atomics_folder(self, string_to_analyse, platform, repo_dir=None):
         """
         Catch a path to the atomics/ folder in the `string_to_analyse` variable,
         and handle it in the best way possible. If needed, will import a payload.
@@ -144,19 +740,23 @@ class AtomicService(BaseService):
             path = self._normalize_path(path, platform)
 
             # take path from index 1, as it starts with /
-            path = os.path.join(self.repo_dir, 'atomics', path[1:])
+            path = os.path.join(repo_dir or self.repo_dir, 'atomics', path[1:])
 
             if os.path.isfile(path):
                 payload_name = self._handle_attachment(path)
                 payloads.append(payload_name)
                 string_to_analyse = string_to_analyse.replace(fullpath, payload_name)
+            elif os.path.isdir(path) and self.directory_attachments == 'archive':
+                payload_name = self._handle_directory_attachment(path, platform)
+                payloads.append(payload_name)
+                string_to_analyse = string_to_analyse.replace(fullpath, self._archives[payload_name])
 
         return string_to_analyse, payloads
 
     def _has_reserved_parameter(self, command):
         return any(reserved in command for reserved in Agent.RESERVED)
 
-    def _use_default_inputs(self, test, platform, string_to_analyse):
+    def _use_default_inputs(self, test, platform, string_to_analyse, repo_dir=None):
         """
         Look if variables are used in `string_to_analyse`, and if any variable was given
         a default value, use it.
@@ -171,7 +771,7 @@ class AtomicService(BaseService):
             default_var = str(defaults.get(varname, dict()).get('default'))
 
             if default_var is not None:
-                default_var, new_payloads = self._catch_path_to_atomics_folder(default_var, platform)
+                default_var, new_payloads = self._catch_path_to_atomics_folder(default_var, platform, repo_dir)
                 payloads.extend(new_payloads)
                 string_to_analyse = string_to_analyse.replace(full_var_str, default_var)
 
@@ -260,20 +860,56 @@ class AtomicService(BaseService):
                     ret_lines.append(processed)
         return ret_lines
 
-    async def _prepare_cmd(self, test, platform, executor, cmd):
+    async def _prepare_cmd(self, test, platform, executor, cmd, repo_dir=None):
         """
         Handle a command or a cleanup (both are formatted the same way), given in `cmd`.
         Return the cmd formatted as needed and payloads we need to take into account.
         """
         payloads = []
-        cmd, new_payloads = self._use_default_inputs(test, platform, cmd)
+        cmd, new_payloads = self._use_default_inputs(test, platform, cmd, repo_dir)
         payloads.extend(new_payloads)
-        cmd, new_payloads = self._catch_path_to_atomics_folder(cmd, platform)
+        cmd, new_payloads = self._catch_path_to_atomics_folder(cmd, platform, repo_dir)
         payloads.extend(new_payloads)
-        cmd = self._handle_multiline_commands(cmd, executor)
-        return cmd, payloads
+        # directories referenced by the command are shipped as archives, unpacked before it runs
+        unpack = dict.fromkeys(self._unpack_command(p, executor) for p in payloads if p in self._archives)
+        if unpack:
+            cmd = '\n'.join([*unpack, cmd])
+        joined = self._handle_multiline_commands(cmd, executor)
+        if self.script_payloads and executor in SCRIPT_EXTENSIONS and len(joined) > self.script_payload_threshold:
+            script_name = self._handle_script(cmd, executor)
+            payloads.append(script_name)
+            return self._launcher_command(script_name, platform, executor, test), payloads
+        return joined, payloads
+
+    def _handle_script(self, body, executor):
+        """Save `body` as a script payload named after its digest, and return the payload name."""
+        if executor == 'cmd':
+            body = '@echo off\r\n' + body.replace('\r\n', '\n').replace('\n', '\r\n')
+        h = hashlib.md5(body.encode(), usedforsecurity=False).hexdigest()
+        script_name = f'atomic_{h}.{SCRIPT_EXTENSIONS[executor]}'
+        if script_name not in self._scripts:
+            self._scripts.add(script_name)
+            self._run_io(self._write_script, os.path.join(self.payloads_dir, script_name), body)
+        return script_name
+
+    @staticmethod
+    def _write_script(path, body):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', newline='') as f:
+            f.write(body)
+
+    @staticmethod
+    def _launcher_command(script_name, platform, executor, test):
+        if executor == 'psh':
+            shell = 'powershell' if platform == PLATFORMS['windows'] else 'pwsh'
+            return f'{shell} -ExecutionPolicy Bypass -NoProfile -File "{script_name}"'
+        if executor == 'cmd':
+            return f'cmd.exe /c "{script_name}"'
+        # keep bash features working for the tests written for bash
+        shell = 'bash' if test.get('executor', dict()).get('name') == 'bash' else 'sh'
+        return f'{shell} "{script_name}"'
 
-    async def _prepare_executor(self, test, platform, executor):
+    async def _prepare_executor(self, test, platform, executor, repo_dir=None):
         """
         Prepare the command and cleanup, and return them with the needed payloads.
         """
@@ -291,19 +927,24 @@ class AtomicService(BaseService):
                 except ExtractionError:
                     self.log.debug(f'Skipping pre-req for "{test["name"]}"')
         precmd = f"{dep_construct} \n {test['executor']['command']}" if dep_construct else test['executor']['command']
-        command, payloads_command = await self._prepare_cmd(test, platform, executor, precmd)
+        command, payloads_command = await self._prepare_cmd(test, platform, executor, precmd, repo_dir)
         cleanup, payloads_cleanup = await self._prepare_cmd(test, platform, executor,
-                                                            test['executor'].get('cleanup_command', ''))
+                                                            test['executor'].get('cleanup_command', ''), repo_dir)
         payloads.extend(payloads_command)
         payloads.extend(payloads_cleanup)
 
         return command, cleanup, payloads
 
-    async def _save_ability(self, entries, test):
+    async def _save_ability(self, entries, test, repo_dir=None, rank=0):
         """
-        Return True if an ability was saved.
+        Return True if a new ability was saved.
+        Attachments are resolved against `repo_dir`, the Atomic Red Team repository by default.
+        An ability already saved from a source of lower `rank` is left untouched.
         """
-        ability_id = hashlib.md5(json.dumps(test).encode(), usedforsecurity=False).hexdigest()
+        ability_id = self._test_digest(test)
+        owner = self._ability_sources.get(ability_id)
+        if owner is not None and owner[0] < rank:
+            return False
 
         tactics_li = self.technique_to_tactics.get(entries['attack_technique'], ['redcanary-unknown'])
         tactic = 'multiple' if len(tactics_li) > 1 else tactics_li[0]
@@ -319,30 +960,123 @@ class AtomicService(BaseService):
             ),
             platforms=dict()
         )
+        executor = EXECUTORS.get(test['executor']['name'], 'unknown')
+        if not self._passes_filters('executors', [executor]):
+            return False
         for p in test['supported_platforms']:
             if test['executor']['name'] != 'manual':
                 # manual tests are expected to be run manually by a human, no automation is provided
-                executor = EXECUTORS.get(test['executor']['name'], 'unknown')
                 platform = PLATFORMS.get(p, 'unknown')
+                if not self._passes_filters('platforms', [platform]):
+                    continue
 
-                command, cleanup, payloads = await self._prepare_executor(test, platform, executor)
+                command, cleanup, payloads = await self._prepare_executor(test, platform, executor, repo_dir)
                 data['platforms'][platform] = dict()
                 data['platforms'][platform][executor] = dict(command=command, payloads=payloads, cleanup=cleanup)
-                if executor == 'psh':
-                    data['platforms'][platform][executor]['parsers'] = {'plugins.atomic.app.parsers.atomic_powershell':
-                                                                        [{'source': 'validate_me'}]}
+                if executor in PARSERS:
+                    data['platforms'][platform][executor]['parsers'] = {PARSERS[executor]: [{'source': 'validate_me'}]}
+
+        if data['platforms'] and self.duplicates_mode != 'off':
+            if self._handle_duplicate(ability_id, test, data):
+                return False
 
         if data['platforms']:  # this might be empty, if so there's nothing useful to save
-            d = os.path.join(self.data_dir, 'abilities', tactic)
-            if not os.path.exists(d):
-                os.makedirs(d)
-            file_path = os.path.join(d, '%s.yml' % ability_id)
-            with open(file_path, 'w') as f:
-                f.write(yaml.dump([data], explicit_start=True, sort_keys=False))
-            return True
+            file_path = os.path.join(self.data_dir, 'abilities', tactic, '%s.yml' % ability_id)
+            self._write_ability(file_path, data)
+            if owner is not None and owner[1] != file_path:
+                # the same test filed under another technique by a lower precedence source
+                self._remove_ability(owner[1])
+            self._ability_sources[ability_id] = (rank, file_path)
+            if self.duplicates_mode != 'off':
+                digest = self._content_digest(data)
+                if self._content_index.get(digest, (ability_id,))[0] == ability_id:
+                    self._content_index[digest] = (ability_id, file_path)
+            return owner is None
 
         return False
 
+    @staticmethod
+    def _content_digest(data):
+        return hashlib.md5(json.dumps(data['platforms'], sort_keys=True).encode(), usedforsecurity=False).hexdigest()
+
+    def _handle_duplicate(self, ability_id, test, data):
+        """
+        Record an ability whose compiled commands are identical to an ability already saved.
+        In 'collapse' mode, merge its description into the saved ability and return True so it is not saved.
+        """
+        kept = self._content_index.get(self._content_digest(data))
+        if not kept or kept[0] == ability_id:
+            return False
+        kept_id, kept_path = kept
+        self.duplicates.append(dict(kept=kept_id, duplicate=ability_id, name=test['name']))
+        if self.duplicates_mode != 'collapse':
+            return False
+        kept_data = self._read_ability(kept_path)
+        kept_data['description'] += f'\n\nAlso covers "{test["name"]}": {test["description"]}'
+        self._write_ability(kept_path, kept_data)
+        return True
+
+    def _write_ability(self, file_path, data):
+        """
+        Save an ability under `file_path`. In bundle mode it is kept in the bundle store until
+        self._write_bundle() is called, `file_path` only serving as its key.
+        """
+        if self.output_format == 'bundle':
+            self._bundle[file_path] = data
+            return
+        if self._write_buffer is not None:
+            self._pending_writes[file_path] = data
+        self._run_io(self._dump_ability, file_path, data)
+
+    def _dump_ability(self, file_path, data):
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'w') as f:
+            f.write(yaml.dump([data], explicit_start=True, sort_keys=False))
+
+    def _read_ability(self, file_path):
+        if self.output_format == 'bundle':
+            return self._bundle[file_path]
+        if file_path in self._pending_writes:
+            # not written yet, copy it so the write stage never dumps a dict being modified
+            return dict(self._pending_writes[file_path])
+        with open(file_path, 'r') as f:
+            return yaml.safe_load(f)[0]
+
+    def _remove_ability(self, file_path):
+        if self.output_format == 'bundle':
+            self._bundle.pop(file_path, None)
+        else:
+            self._pending_writes.pop(file_path, None)
+            self._run_io(os.remove, file_path)
+
+    def _open_bundle_store(self):
+        """Bundled abilities are kept in memory, or in a temporary shelve when memory bounded."""
+        if self.output_format != 'bundle' or not self.memory_bounded:
+            return dict()
+        self._bundle_dir = tempfile.mkdtemp(prefix='atomic-bundle-')
+        return shelve.open(os.path.join(self._bundle_dir, 'bundle'))
+
+    def _close_bundle_store(self):
+        if isinstance(self._bundle, shelve.Shelf):
+            self._bundle.close()
+            shutil.rmtree(self._bundle_dir, ignore_errors=True)
+        self._bundle = dict()
+
+    def _bundle_path(self):
+        return os.path.join(self.data_dir, 'abilities', 'atomic-bundle.yml')
+
+    def _write_bundle(self):
+        """
+        Write every ability kept in bundle mode into a single yaml list, which Caldera
+        loads like any ability file, with one open and one parse.
+        """
+        os.makedirs(os.path.dirname(self._bundle_path()), exist_ok=True)
+        with open(self._bundle_path(), 'w') as f:
+            f.write('---\n')
+            # items are dumped one at a time, so the whole list is never serialized in memory
+            for key in sorted(self._bundle):
+                yaml.dump([self._bundle[key]], f, sort_keys=False)
+
     async def _prereq_formater(self, prereq_test, prereq, prereq_type, exec_type, ability_command):
         """
         Format prereqs as a header test block for an ability
@@ -353,7 +1087,37 @@ class AtomicService(BaseService):
         :param ability_command: Existing commands for this ability
         :return: Full formed, staged command
         """
-        output = ""
+        # many tests share the same dependencies, so header blocks (and failures to build them) are cached
+        key = (prereq_test, prereq, prereq_type, exec_type)
+        if key not in self._prereq_cache:
+            try:
+                self._prereq_cache[key] = self._format_prereq_header(prereq_test, prereq, prereq_type)
+            except ExtractionError:
+                self._prereq_cache[key] = ExtractionError
+        output = self._prereq_cache[key]
+        if output is ExtractionError:
+            raise ExtractionError
+        if output is None:
+            return ability_command
+        if prereq_type == exec_type:
+            output += '\n' + ability_command
+        else:
+            if prereq_type == "cmd" and exec_type == "psh":
+                output += '\n' + ability_command
+            elif prereq_type == "psh" and exec_type == "cmd":
+                output = f'powershell -command "{output} \n {ability_command}"'
+            else:
+                self.log.warning(f'Unable to deduce a way to link a {prereq_type} prereq and a {exec_type} ability. '
+                                 f'Defaulting to just the ability - this may cause the produced ability to behave '
+                                 f'unexpectedly.')
+                output = ability_command
+        return output
+
+    def _format_prereq_header(self, prereq_test, prereq, prereq_type):
+        """
+        Build the header test block installing `prereq` when `prereq_test` fails.
+        Return None for an unknown prereq type, raise ExtractionError if the prereq cannot be automated.
+        """
         prereq = prereq.rstrip()
         if 'exit' not in prereq_test.lower() or prereq.startswith('echo "') or \
                 (prereq.startswith('echo ') and ('Run' in prereq or 'Sorry,' in prereq)):
@@ -368,44 +1132,26 @@ class AtomicService(BaseService):
             segments = prereq_test.split(';')
             if 'exit 1' in segments[1]:
                 # check is "falsy"
-                output += f"{segments[0]}; then {prereq}; fi;"
-            else:
-                # check is "truthy"
-                output += f"{segments[0]}; then : ; else {prereq}; fi;"
+                return f"{segments[0]}; then {prereq}; fi;"
+            # check is "truthy"
+            return f"{segments[0]}; then : ; else {prereq}; fi;"
         elif prereq_type == 'psh':
             if prereq_test.startswith('Try'):
                 temp = f"{prereq_test.replace('exit 1', prereq)}"
-                output += f"{temp.replace('exit 0', ' ; ')}"
-            else:
-                segments = prereq_test.split(')')
-                test_outcomes = segments[1].split('}')
-                if 'exit 1' in test_outcomes[0]:
-                    # check is "falsy"
-                    output += f"{segments[0]}) {{{prereq}}}"
-                else:
-                    # check is "truthy"
-                    output += f"{segments[0]}) {{ ; }} else {{{prereq}}}"
+                return f"{temp.replace('exit 0', ' ; ')}"
+            segments = prereq_test.split(')')
+            test_outcomes = segments[1].split('}')
+            if 'exit 1' in test_outcomes[0]:
+                # check is "falsy"
+                return f"{segments[0]}) {{{prereq}}}"
+            # check is "truthy"
+            return f"{segments[0]}) {{ ; }} else {{{prereq}}}"
         elif prereq_type == 'cmd':
             segments = prereq_test.split('(')
             test_outcomes = segments[1].split('ELSE')
             if 'exit 1' in test_outcomes[0]:
                 # check is "falsy"
-                output += f"{segments[0]} ({prereq})"
-            else:
-                # check is "truthy"
-                output += f"{segments[0]} ( call ) ELSE ( {prereq} )"
-        else:
-            return ability_command
-        if prereq_type == exec_type:
-            output += '\n' + ability_command
-        else:
-            if prereq_type == "cmd" and exec_type == "psh":
-                output += '\n' + ability_command
-            elif prereq_type == "psh" and exec_type == "cmd":
-                output = f'powershell -command "{output} \n {ability_command}"'
-            else:
-                self.log.warning(f'Unable to deduce a way to link a {prereq_type} prereq and a {exec_type} ability. '
-                                 f'Defaulting to just the ability - this may cause the produced ability to behave '
-                                 f'unexpectedly.')
-                output = ability_command
-        return output
+                return f"{segments[0]} ({prereq})"
+            # check is "truthy"
+            return f"{segments[0]} ( call ) ELSE ( {prereq} )"
+        return None
@@ -0,0 +1,50 @@
+import logging
+import re
+from functools import lru_cache
+
+from app.utility.base_parser import BaseParser, PARSER_SIGNALS_FAILURE
+
+CHUNK_SIZE = 64 * 1024
+
+
+@lru_cache(maxsize=None)
+def _compile_flags(flags):
+    """Build a single alternation regex matching any of the given literal flags."""
+    return re.compile('|'.join(re.escape(x) for x in sorted(set(flags), key=len, reverse=True)))
+
+
+class AtomicParser(BaseParser):
+    """
+    Shared failure-signature matcher for the Atomic parsers. Subclasses only list the
+    `checked_flags` their executor prints on failure; all flags are matched in one pass
+    with a precompiled regex.
+    """
+    checked_flags = []
+    chunk_size = CHUNK_SIZE
+
+    def parse(self, blob):
+        if not self.checked_flags:
+            return []
+        matcher = _compile_flags(tuple(self.checked_flags))
+        if len(blob) > self.chunk_size:
+            failed = self._scan_chunks(blob, matcher)
+        else:
+            failed = any(matcher.search(ex_line) for ex_line in self.line(blob))
+        if failed:
+            log = logging.getLogger('parsing_svc')
+            log.warning('This ability failed for some reason. Manually updating the link to report a failed state.')
+            return [PARSER_SIGNALS_FAILURE]
+        return []
+
+    def _scan_chunks(self, blob, matcher):
+        """
+        Look for the checked flags in `blob` one window at a time, instead of splitting the whole
+        output into lines. Consecutive windows overlap by the length of the longest flag minus one,
+        so a flag split across a chunk boundary is still found. Flags never span several lines, so
+        this matches the line-based scan.
+        """
+        overlap = max(len(x) for x in self.checked_flags) - 1
+        for start in range(0, len(blob), self.chunk_size):
+            if matcher.search(blob, max(start - overlap, 0), start + self.chunk_size):
+                return True
+        return False
@@ -0,0 +1,7 @@
+from plugins.atomic.app.parsers.atomic_base import AtomicParser
+
+
+class Parser(AtomicParser):
+    checked_flags = ['is not recognized as an internal or external command', 'Access is denied',
+                     'The system cannot find the path specified', 'The system cannot find the file specified',
+                     'The syntax of the command is incorrect']
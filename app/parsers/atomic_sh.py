@@ -0,0 +1,5 @@
+from plugins.atomic.app.parsers.atomic_base import AtomicParser
+
+
+class Parser(AtomicParser):
+    checked_flags = ['command not found', 'Permission denied', 'Operation not permitted']
@@ -1,21 +1,73 @@
+import logging
 import os
+import time
 
-from app.utility.base_world import BaseWorld
-from plugins.atomic.app.atomic_svc import AtomicService
-from plugins.atomic.app.atomic_gui import AtomicGUI
+_import_start = time.perf_counter()
+
+from app.utility.base_world import BaseWorld  # noqa: E402
+from plugins.atomic.app.atomic_fingerprint import is_stale  # noqa: E402
+from plugins.atomic.app.atomic_gui import AtomicGUI  # noqa: E402
+from plugins.atomic.app.atomic_payloads import PAYLOAD_REFS_FILE, load_payload_refs, register_payload_refs  # noqa: E402
 
 name = 'Atomic'
 description = 'The collection of abilities in the Red Canary Atomic test project'
 address = '/plugin/atomic/gui'
 access = BaseWorld.Access.RED
-data_dir = os.path.join('plugins', 'atomic', 'data')
+plugin_dir = os.path.join('plugins', 'atomic')
+data_dir = os.path.join(plugin_dir, 'data')
+
+# Time spent importing this plugin and in its latest enable(), in seconds, to keep Caldera start latency tracked
+import_time = time.perf_counter() - _import_start
+enable_time = None
 
 
 async def enable(services):
+    global enable_time
+    start = time.perf_counter()
     atomic_gui = AtomicGUI(services, name, description)
+    app = services.get('app_svc').application
+    app.router.add_route('GET', '/plugin/atomic/summary', atomic_gui.summary)
+    app.router.add_route('GET', '/plugin/atomic/abilities', atomic_gui.query)
+    app.router.add_route('GET', '/plugin/atomic/progress', atomic_gui.progress)
+    app.router.add_route('POST', '/plugin/atomic/ingestion', atomic_gui.start_ingestion)
+    app.router.add_route('GET', '/plugin/atomic/ingestion', atomic_gui.ingestion_status)
+    app.router.add_route('DELETE', '/plugin/atomic/ingestion', atomic_gui.cancel_ingestion)
 
-    # we only ingest data once, and save new abilities in the data/ folder of the plugin
-    if "abilities" not in os.listdir(data_dir):
+    # we ingest data once, and save new abilities in the data/ folder of the plugin. They are ingested again
+    # only when the Atomic Red Team checkout or the plugin changed since, as recorded by their fingerprint.
+    # Instances sharing data/ (eg. on NFS) take turns through a lock file, and skip what another one ingested meanwhile
+    if _missing_abilities():
+        # the service (yaml, parsers, agent model...) is only imported when there is something to ingest
+        from plugins.atomic.app.atomic_svc import AtomicService
+        atomic_svc = AtomicService()
+        await atomic_svc.run_exclusive(lambda: _first_ingestion(atomic_svc), needed=_missing_abilities)
+    elif _stale_abilities():
+        from plugins.atomic.app.atomic_svc import AtomicService
         atomic_svc = AtomicService()
+        await atomic_svc.run_exclusive(lambda: atomic_svc.refresh_abilities(update=False), needed=_stale_abilities)
+
+    # attachments ingested in 'lazy' payload mode are only copied when an agent first requests them
+    file_svc = services.get('file_svc')
+    if file_svc:
+        await register_payload_refs(file_svc, load_payload_refs(os.path.join(data_dir, PAYLOAD_REFS_FILE)),
+                                    os.path.join(plugin_dir, 'payloads'))
+    enable_time = time.perf_counter() - start
+    logging.getLogger('atomic').debug('Atomic plugin imported in %.3fs, enabled in %.3fs', import_time, enable_time)
+
+
+def _missing_abilities():
+    return 'abilities' not in os.listdir(data_dir)
+
+
+def _stale_abilities():
+    return is_stale(os.path.join(data_dir, 'atomic-red-team'), plugin_dir, data_dir)
+
+
+async def _first_ingestion(atomic_svc):
+    if atomic_svc.ability_pack:
+        from plugins.atomic.app.atomic_pack import import_pack
+        import_pack(atomic_svc.ability_pack, atomic_svc.data_dir, atomic_svc.payloads_dir)
+    else:
+        # ingested into a staging directory, so that servers sharing data/ never load half the abilities
         await atomic_svc.clone_atomic_red_team_repo()
-        await atomic_svc.populate_data_directory()
+        await atomic_svc.refresh_abilities(update=False)
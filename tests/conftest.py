@@ -6,6 +6,7 @@ import logging
 import pytest
 from unittest.mock import MagicMock, AsyncMock, patch
 from collections import defaultdict
+from datetime import datetime, timezone
 
 # ---------------------------------------------------------------------------
 # Determine paths
@@ -61,6 +62,10 @@ class BaseWorld:
     def strip_yml(path):
         return []
 
+    @staticmethod
+    def get_current_timestamp(date_format='%Y-%m-%dT%H:%M:%SZ'):
+        return datetime.now(timezone.utc).strftime(date_format)
+
 
 _base_world_mod.BaseWorld = BaseWorld
 sys.modules['app.utility.base_world'] = _base_world_mod
@@ -129,18 +134,38 @@ sys.modules['plugins.atomic.app.parsers'] = _plugins_atomic_app_parsers
 # ---------------------------------------------------------------------------
 # Now import the real plugin modules
 # ---------------------------------------------------------------------------
+import app.atomic_fingerprint as _real_atomic_fingerprint  # noqa: E402
+import app.atomic_payloads as _real_atomic_payloads  # noqa: E402
+import app.atomic_memory as _real_atomic_memory  # noqa: E402
+import app.atomic_lock as _real_atomic_lock  # noqa: E402
+sys.modules['plugins.atomic.app.atomic_lock'] = _real_atomic_lock
+sys.modules['plugins.atomic.app.atomic_memory'] = _real_atomic_memory
+sys.modules['plugins.atomic.app.atomic_payloads'] = _real_atomic_payloads
+sys.modules['plugins.atomic.app.atomic_fingerprint'] = _real_atomic_fingerprint
 from app.atomic_svc import AtomicService  # noqa: E402
+import app.atomic_index as _real_atomic_index  # noqa: E402
+import app.atomic_pack as _real_atomic_pack  # noqa: E402
+sys.modules['plugins.atomic.app.atomic_pack'] = _real_atomic_pack
+sys.modules['plugins.atomic.app.atomic_index'] = _real_atomic_index
 from app.atomic_gui import AtomicGUI  # noqa: E402
+import app.parsers.atomic_base as _real_atomic_base_parser  # noqa: E402
+sys.modules['plugins.atomic.app.parsers.atomic_base'] = _real_atomic_base_parser
 from app.parsers.atomic_powershell import Parser as AtomicPowershellParser  # noqa: E402
+from app.parsers.atomic_sh import Parser as AtomicShParser  # noqa: E402
+from app.parsers.atomic_cmd import Parser as AtomicCmdParser  # noqa: E402
 
 # Register under plugins.atomic namespace too
 import app.atomic_svc as _real_atomic_svc
 import app.atomic_gui as _real_atomic_gui
 import app.parsers.atomic_powershell as _real_atomic_parser
+import app.parsers.atomic_sh as _real_atomic_sh_parser
+import app.parsers.atomic_cmd as _real_atomic_cmd_parser
 
 sys.modules['plugins.atomic.app.atomic_svc'] = _real_atomic_svc
 sys.modules['plugins.atomic.app.atomic_gui'] = _real_atomic_gui
 sys.modules['plugins.atomic.app.parsers.atomic_powershell'] = _real_atomic_parser
+sys.modules['plugins.atomic.app.parsers.atomic_sh'] = _real_atomic_sh_parser
+sys.modules['plugins.atomic.app.parsers.atomic_cmd'] = _real_atomic_cmd_parser
 
 # ---------------------------------------------------------------------------
 # Shared fixtures
@@ -152,8 +177,18 @@ PREFIX_HASH_LENGTH = 6
 
 
 @pytest.fixture
-def atomic_svc():
-    return AtomicService()
+def atomic_svc(tmp_path):
+    svc = AtomicService()
+    svc.quarantine_path = str(tmp_path / 'quarantine.yml')
+    return svc
+
+
+@pytest.fixture
+def ingestion_svc(atomic_svc, tmp_path):
+    """An AtomicService ingesting into tmp_path/data, with T1016 mapped to the discovery tactic."""
+    atomic_svc.data_dir = str(tmp_path / 'data')
+    atomic_svc.technique_to_tactics = defaultdict(list, {'T1016': ['discovery']})
+    return atomic_svc
 
 
 @pytest.fixture
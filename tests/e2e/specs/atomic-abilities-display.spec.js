@@ -10,7 +10,7 @@ test.describe("Atomic plugin - abilities display", () => {
   });
 
   test("should display the abilities count (numeric or placeholder)", async ({ page }) => {
-    // The Vue template shows {{ atomicAbilities.length || "---" }}
+    // The Vue template shows {{ summary.abilities || "---" }}
     const countText = page.locator(".is-size-1, h1.is-size-1").first();
     await expect(countText).toBeVisible({ timeout: 15_000 });
     const text = await countText.textContent();
@@ -8,9 +8,9 @@ test.describe("Atomic plugin - error states", () => {
     await login(page);
   });
 
-  test("should show placeholder count when abilities API fails", async ({ page }) => {
-    // Intercept abilities API to simulate failure
-    await page.route("**/api/v2/abilities", (route) => {
+  test("should show placeholder count when summary API fails", async ({ page }) => {
+    // Intercept summary API to simulate failure
+    await page.route("**/plugin/atomic/summary", (route) => {
       return route.fulfill({
         status: 500,
         contentType: "application/json",
@@ -27,12 +27,12 @@ test.describe("Atomic plugin - error states", () => {
     expect(text?.trim()).toBe("---");
   });
 
-  test("page should remain functional when abilities API returns empty array", async ({ page }) => {
-    await page.route("**/api/v2/abilities", (route) => {
+  test("page should remain functional when summary API reports no abilities", async ({ page }) => {
+    await page.route("**/plugin/atomic/summary", (route) => {
       return route.fulfill({
         status: 200,
         contentType: "application/json",
-        body: JSON.stringify([]),
+        body: JSON.stringify({ abilities: 0, tactics: {}, platforms: {}, executors: {} }),
       });
     });
 
@@ -48,28 +48,12 @@ test.describe("Atomic plugin - error states", () => {
     await expect(page.locator("h2:has-text('Atomic')").first()).toBeVisible();
   });
 
-  test("page should remain functional when adversaries API fails", async ({ page }) => {
-    await page.route("**/api/v2/adversaries", (route) => {
-      return route.fulfill({
-        status: 500,
-        contentType: "application/json",
-        body: JSON.stringify({ error: "Internal Server Error" }),
-      });
-    });
-
-    await navigateToAtomic(page);
-
-    // The page heading and description should still render
-    await expect(page.locator("h2:has-text('Atomic')").first()).toBeVisible();
-    await expect(page.locator("p:has-text('Red Canary Atomic')").first()).toBeVisible();
-  });
-
   test("View Abilities button should still be present when no abilities loaded", async ({ page }) => {
-    await page.route("**/api/v2/abilities", (route) => {
+    await page.route("**/plugin/atomic/summary", (route) => {
       return route.fulfill({
         status: 200,
         contentType: "application/json",
-        body: JSON.stringify([]),
+        body: JSON.stringify({ abilities: 0, tactics: {}, platforms: {}, executors: {} }),
       });
     });
 
@@ -83,12 +67,12 @@ test.describe("Atomic plugin - error states", () => {
 
   test("page should handle slow API responses gracefully", async ({ page }) => {
     // Simulate slow response
-    await page.route("**/api/v2/abilities", async (route) => {
+    await page.route("**/plugin/atomic/summary", async (route) => {
       await new Promise((r) => setTimeout(r, 5_000));
       return route.fulfill({
         status: 200,
         contentType: "application/json",
-        body: JSON.stringify([]),
+        body: JSON.stringify({ abilities: 0, tactics: {}, platforms: {}, executors: {} }),
       });
     });
 
@@ -105,7 +89,7 @@ test.describe("Atomic plugin - error states", () => {
   });
 
   test("page should not crash with malformed API response", async ({ page }) => {
-    await page.route("**/api/v2/abilities", (route) => {
+    await page.route("**/plugin/atomic/summary", (route) => {
       return route.fulfill({
         status: 200,
         contentType: "application/json",
@@ -8,10 +8,9 @@ test.describe("Atomic plugin - ability ingestion", () => {
     await login(page);
   });
 
-  test("atomic abilities should be filtered from the global abilities store", async ({ page }) => {
-    // Set up response interception before navigating to ensure we catch the call
+  test("the atomic summary API should be called on page mount", async ({ page }) => {
     const apiCalled = page.waitForResponse(
-      (resp) => resp.url().includes("/api/v2/abilities") && resp.status() === 200,
+      (resp) => resp.url().includes("/plugin/atomic/summary") && resp.status() === 200,
       { timeout: 20_000 }
     );
 
@@ -21,65 +20,61 @@ test.describe("Atomic plugin - ability ingestion", () => {
     expect(response.status()).toBe(200);
   });
 
-  test("the abilities API response should contain ability objects", async ({ page }) => {
-    // Intercept abilities API
-    let abilitiesData = null;
-    await page.route("**/api/v2/abilities", async (route) => {
+  test("the summary API response should contain the ability breakdowns", async ({ page }) => {
+    let summaryData = null;
+    await page.route("**/plugin/atomic/summary", async (route) => {
       const response = await route.fetch();
-      abilitiesData = await response.json();
+      summaryData = await response.json();
       return route.fulfill({ response });
     });
 
-    // Wait for the abilities API response after navigation
     const apiResponse = page.waitForResponse(
-      (resp) => resp.url().includes("/api/v2/abilities") && resp.status() === 200,
+      (resp) => resp.url().includes("/plugin/atomic/summary") && resp.status() === 200,
       { timeout: 20_000 }
     );
     await navigateToAtomic(page);
     await apiResponse;
 
-    // Verify the response is a non-empty array with standard ability fields
-    expect(Array.isArray(abilitiesData)).toBe(true);
-    expect(abilitiesData.length).toBeGreaterThan(0);
-    const first = abilitiesData[0];
-    expect(first).toHaveProperty("ability_id");
-    expect(first).toHaveProperty("name");
+    expect(Number.isInteger(summaryData.abilities)).toBe(true);
+    expect(summaryData).toHaveProperty("tactics");
+    expect(summaryData).toHaveProperty("platforms");
+    expect(summaryData).toHaveProperty("executors");
   });
 
-  test("atomic abilities should have plugin field set to 'atomic'", async ({ page }) => {
-    let abilitiesData = null;
-    await page.route("**/api/v2/abilities", async (route) => {
+  test("the displayed count should match the summary API", async ({ page }) => {
+    let summaryData = null;
+    await page.route("**/plugin/atomic/summary", async (route) => {
       const response = await route.fetch();
-      abilitiesData = await response.json();
+      summaryData = await response.json();
       return route.fulfill({ response });
     });
 
-    // Wait for the abilities API response after navigation
     const apiResponse = page.waitForResponse(
-      (resp) => resp.url().includes("/api/v2/abilities") && resp.status() === 200,
+      (resp) => resp.url().includes("/plugin/atomic/summary") && resp.status() === 200,
       { timeout: 20_000 }
     );
     await navigateToAtomic(page);
     await apiResponse;
 
-    expect(Array.isArray(abilitiesData)).toBe(true);
-    const atomicOnes = abilitiesData.filter((a) => a.plugin === "atomic");
-    // The count on the page should match the filtered count
-    const countText = await page.locator(".is-size-1, h1.is-size-1").first().textContent();
-    const displayedCount = parseInt(countText?.trim() || "", 10);
-    // Assert the displayed count is a valid number and matches the API array length
-    expect(Number.isInteger(displayedCount)).toBe(true);
-    expect(atomicOnes.length).toBe(displayedCount);
+    const countText = page.locator(".is-size-1, h1.is-size-1").first();
+    await expect(countText).toHaveText(String(summaryData.abilities || "---"), { timeout: 15_000 });
   });
 
-  test("adversaries API should also be called on page mount", async ({ page }) => {
-    const apiCalled = page.waitForResponse(
-      (resp) => resp.url().includes("/api/v2/adversaries") && resp.status() === 200,
+  test("the page should not download the full abilities list", async ({ page }) => {
+    let abilitiesRequested = false;
+    page.on("request", (req) => {
+      if (req.url().includes("/api/v2/abilities")) {
+        abilitiesRequested = true;
+      }
+    });
+
+    const apiResponse = page.waitForResponse(
+      (resp) => resp.url().includes("/plugin/atomic/summary"),
       { timeout: 20_000 }
     );
-
     await navigateToAtomic(page);
-    const response = await apiCalled;
-    expect(response.status()).toBe(200);
+    await apiResponse;
+
+    expect(abilitiesRequested).toBe(false);
   });
 });
@@ -0,0 +1,134 @@
+import json
+import os
+import subprocess
+import sys
+from unittest.mock import patch
+
+import pytest
+import yaml
+
+from app.atomic_cli import build_parser, main, _build_filters
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+@pytest.fixture
+def checkout(tmp_path):
+    """An Atomic Red Team checkout with one technique, tested on linux and windows."""
+    repo_dir = tmp_path / 'atomic-red-team'
+    tests = [dict(name='users', description='List users.', supported_platforms=['linux'], executor=dict(name='sh', command='id')),
+             dict(name='whoami', description='Current user.', supported_platforms=['windows'],
+                  executor=dict(name='command_prompt', command='whoami'))]
+    _write(str(repo_dir / 'atomics' / 'T1033' / 'T1033.yaml'),
+           yaml.safe_dump(dict(attack_technique='T1033', display_name='Owner Discovery', atomic_tests=tests)))
+    _write(str(repo_dir / 'atomics' / 'Indexes' / 'index.yaml'), 'discovery: {}\n')
+    stix = dict(objects=[dict(type='attack-pattern', external_references=[dict(source_name='mitre-attack', external_id='T1033')],
+                              kill_chain_phases=[dict(kill_chain_name='mitre-attack', phase_name='discovery')])])
+    _write(str(repo_dir / 'atomic_red_team' / 'enterprise-attack.json'), json.dumps(stix))
+    return str(repo_dir)
+
+
+def _strip_yml(path):
+    with open(path, encoding='utf-8') as f:
+        return list(yaml.safe_load_all(f))
+
+
+def _run(argv, capsys):
+    with patch('app.atomic_svc.BaseWorld.strip_yml', side_effect=_strip_yml):
+        code = main(argv)
+    return code, json.loads(capsys.readouterr().out or 'null')
+
+
+def _abilities(output):
+    return sorted(name for _, _, names in os.walk(os.path.join(output, 'data', 'abilities')) for name in names)
+
+
+class TestBuildFilters:
+
+    def test_command_line_lists_replace_configured_ones(self):
+        configured = dict(include=dict(platforms=['linux'], executors=['sh']), exclude=dict(techniques=['T1000']))
+        args = build_parser().parse_args(['--include-platform', 'windows', '--include-platform', 'darwin',
+                                          '--exclude-tactic', 'impact'])
+        filters = _build_filters(configured, args)
+        assert filters['include'] == dict(platforms=['windows', 'darwin'], executors=['sh'])
+        assert filters['exclude'] == dict(techniques=['T1000'], tactics=['impact'])
+        assert configured['include']['platforms'] == ['linux']
+
+    def test_no_configured_filters(self):
+        filters = _build_filters(dict(), build_parser().parse_args([]))
+        assert filters == dict(include=dict(), exclude=dict())
+
+
+class TestMain:
+
+    def test_ingests_into_output(self, checkout, tmp_path, capsys):
+        output = str(tmp_path / 'build')
+        code, report = _run(['--source', checkout, '--output', output, '--workers', '2'], capsys)
+        assert code == 0
+        assert report['tests_ingested'] == 2
+        assert report['up_to_date'] is False
+        assert len(_abilities(output)) == 2
+        assert os.path.isdir(os.path.join(output, 'payloads'))
+        assert os.path.isfile(os.path.join(output, 'data', 'fingerprint.json'))
+
+    def test_filters(self, checkout, tmp_path, capsys):
+        output = str(tmp_path / 'build')
+        code, report = _run(['--source', checkout, '--output', output, '--include-platform', 'windows'], capsys)
+        assert code == 0
+        assert report['tests_ingested'] == 1
+        assert len(_abilities(output)) == 1
+
+    def test_incremental(self, checkout, tmp_path, capsys):
+        output = str(tmp_path / 'build')
+        argv = ['--source', checkout, '--output', output, '--incremental']
+        assert _run(argv, capsys)[1]['up_to_date'] is False
+        assert _run(argv, capsys)[1] == dict(up_to_date=True)
+        # filters given on the command line are part of the fingerprint
+        assert _run(argv + ['--exclude-executor', 'cmd'], capsys)[1]['tests_ingested'] == 1
+        assert _run(argv + ['--exclude-executor', 'cmd'], capsys)[1] == dict(up_to_date=True)
+        # and so is the checkout
+        _write(os.path.join(checkout, 'atomics', 'Indexes', 'index.yaml'), 'discovery: {T1033: {}}\n')
+        assert _run(argv, capsys)[1]['up_to_date'] is False
+
+    def test_ability_pack(self, checkout, tmp_path, capsys):
+        pack = str(tmp_path / 'atomic-pack.tar.gz')
+        code, report = _run(['--source', checkout, '--output', str(tmp_path / 'build'), '--export-pack', pack], capsys)
+        assert code == 0
+        assert report['pack'] == pack
+        node = str(tmp_path / 'node')
+        code, report = _run(['--import-pack', pack, '--output', node], capsys)
+        assert code == 0
+        assert report == dict(imported=pack, abilities=2, payloads=0)
+        assert _abilities(node) == _abilities(str(tmp_path / 'build'))
+
+    def test_import_pack_does_not_ingest(self, tmp_path):
+        with pytest.raises(SystemExit):
+            main(['--import-pack', str(tmp_path / 'pack.tar.gz'), '--incremental'])
+
+    def test_missing_source(self, tmp_path):
+        with pytest.raises(SystemExit) as e:
+            main(['--source', str(tmp_path / 'missing')])
+        assert e.value.code == 2
+
+    def test_failure(self, tmp_path, capsys):
+        os.makedirs(str(tmp_path / 'empty'))
+        code, report = _run(['--source', str(tmp_path / 'empty'), '--output', str(tmp_path / 'build')], capsys)
+        assert code == 1
+        assert report is None
+
+
+class TestStandalone:
+
+    def test_runs_without_caldera(self, checkout, tmp_path):
+        output = str(tmp_path / 'build')
+        result = subprocess.run([sys.executable, '-m', 'app.atomic_cli', '--source', checkout, '--output', output],
+                                cwd=REPO_ROOT, capture_output=True, text=True, timeout=60)
+        assert result.returncode == 0, result.stderr
+        assert json.loads(result.stdout)['tests_ingested'] == 2
+        assert len(_abilities(output)) == 2
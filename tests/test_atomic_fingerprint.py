@@ -0,0 +1,116 @@
+import os
+
+import pytest
+
+from app.atomic_fingerprint import (ATOMICS_INDEX, TRANSFORMER_VERSION, compute_fingerprint, is_stale,
+                                    load_fingerprint, save_fingerprint, transformer_digest)
+
+COMMIT = 'a' * 40
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+@pytest.fixture
+def plugin_dir(tmp_path):
+    plugin = tmp_path / 'atomic'
+    _write(str(plugin / 'VERSION.txt'), '1.0.0\n')
+    _write(str(plugin / 'conf' / 'default.yml'), 'output_format: files\n')
+    return str(plugin)
+
+
+@pytest.fixture
+def repo_dir(tmp_path):
+    return str(tmp_path / 'atomic-red-team')
+
+
+class TestComputeFingerprint:
+
+    def test_missing_checkout(self, repo_dir, plugin_dir):
+        assert compute_fingerprint(repo_dir, plugin_dir) is None
+
+    def test_git_branch(self, repo_dir, plugin_dir):
+        _write(os.path.join(repo_dir, '.git', 'HEAD'), 'ref: refs/heads/master\n')
+        _write(os.path.join(repo_dir, '.git', 'refs', 'heads', 'master'), COMMIT + '\n')
+        fingerprint = compute_fingerprint(repo_dir, plugin_dir)
+        assert fingerprint['source'] == 'git:' + COMMIT
+        assert fingerprint['plugin_version'] == '1.0.0'
+        assert fingerprint['transformer'] == TRANSFORMER_VERSION
+
+    def test_git_packed_ref(self, repo_dir, plugin_dir):
+        _write(os.path.join(repo_dir, '.git', 'HEAD'), 'ref: refs/heads/master\n')
+        _write(os.path.join(repo_dir, '.git', 'packed-refs'), '# pack-refs with: peeled\n%s refs/heads/master\n' % COMMIT)
+        assert compute_fingerprint(repo_dir, plugin_dir)['source'] == 'git:' + COMMIT
+
+    def test_git_detached_head(self, repo_dir, plugin_dir):
+        _write(os.path.join(repo_dir, '.git', 'HEAD'), COMMIT + '\n')
+        assert compute_fingerprint(repo_dir, plugin_dir)['source'] == 'git:' + COMMIT
+
+    def test_atomics_index_without_git(self, repo_dir, plugin_dir):
+        _write(os.path.join(repo_dir, ATOMICS_INDEX), 'T1016: {}\n')
+        first = compute_fingerprint(repo_dir, plugin_dir)
+        assert first['source'].startswith('index:')
+        _write(os.path.join(repo_dir, ATOMICS_INDEX), 'T1059: {}\n')
+        assert compute_fingerprint(repo_dir, plugin_dir) != first
+
+    @pytest.mark.parametrize('path', ['VERSION.txt', os.path.join('conf', 'default.yml')])
+    def test_plugin_changes_change_fingerprint(self, repo_dir, plugin_dir, path):
+        _write(os.path.join(repo_dir, '.git', 'HEAD'), COMMIT)
+        first = compute_fingerprint(repo_dir, plugin_dir)
+        _write(os.path.join(plugin_dir, path), 'changed')
+        assert compute_fingerprint(repo_dir, plugin_dir) != first
+
+    def test_transformer_version_changes_fingerprint(self, repo_dir, plugin_dir):
+        _write(os.path.join(repo_dir, '.git', 'HEAD'), COMMIT)
+        first = compute_fingerprint(repo_dir, plugin_dir)
+        with pytest.MonkeyPatch.context() as mp:
+            mp.setattr('app.atomic_fingerprint.TRANSFORMER_VERSION', TRANSFORMER_VERSION + 1)
+            assert compute_fingerprint(repo_dir, plugin_dir) != first
+
+
+class TestTransformerDigest:
+
+    def test_ignores_checkout(self, repo_dir, plugin_dir):
+        first = transformer_digest(plugin_dir)
+        _write(os.path.join(repo_dir, '.git', 'HEAD'), COMMIT)
+        assert transformer_digest(plugin_dir) == first
+
+    @pytest.mark.parametrize('path', ['VERSION.txt', os.path.join('conf', 'default.yml')])
+    def test_plugin_changes_change_digest(self, plugin_dir, path):
+        first = transformer_digest(plugin_dir)
+        _write(os.path.join(plugin_dir, path), 'changed')
+        assert transformer_digest(plugin_dir) != first
+
+    def test_transformer_version_changes_digest(self, plugin_dir):
+        first = transformer_digest(plugin_dir)
+        with pytest.MonkeyPatch.context() as mp:
+            mp.setattr('app.atomic_fingerprint.TRANSFORMER_VERSION', TRANSFORMER_VERSION + 1)
+            assert transformer_digest(plugin_dir) != first
+
+
+class TestStoredFingerprint:
+
+    def test_round_trip(self, tmp_path):
+        data_dir = str(tmp_path / 'data')
+        assert load_fingerprint(data_dir) is None
+        save_fingerprint(data_dir, dict(source='git:' + COMMIT))
+        assert load_fingerprint(data_dir) == dict(source='git:' + COMMIT)
+
+    def test_corrupt_file(self, tmp_path):
+        _write(str(tmp_path / 'fingerprint.json'), '{not json')
+        assert load_fingerprint(str(tmp_path)) is None
+
+    def test_is_stale(self, tmp_path, repo_dir, plugin_dir):
+        data_dir = str(tmp_path / 'data')
+        _write(os.path.join(repo_dir, '.git', 'HEAD'), COMMIT)
+        assert is_stale(repo_dir, plugin_dir, data_dir)
+        save_fingerprint(data_dir, compute_fingerprint(repo_dir, plugin_dir))
+        assert not is_stale(repo_dir, plugin_dir, data_dir)
+        _write(os.path.join(repo_dir, '.git', 'HEAD'), 'b' * 40)
+        assert is_stale(repo_dir, plugin_dir, data_dir)
+
+    def test_unknown_checkout_is_not_stale(self, tmp_path, repo_dir, plugin_dir):
+        assert not is_stale(repo_dir, plugin_dir, str(tmp_path / 'data'))
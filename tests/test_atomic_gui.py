@@ -1,10 +1,20 @@
+import asyncio
+import json
 import logging
 import pytest
-from unittest.mock import MagicMock
+from aiohttp import web
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
 
 from app.atomic_gui import AtomicGUI
 
 
+async def _run_exclusive(ingest, needed=lambda: True):
+    # AtomicService.run_exclusive() when no other process holds the ingestion lock
+    await ingest()
+    return True
+
+
 class TestAtomicGUIInit:
     """Tests for AtomicGUI initialization and configuration."""
 
@@ -58,3 +68,322 @@ class TestAtomicGUIIsBaseWorld:
         # AtomicGUI should be an instance of the BaseWorld stub
         from app.utility.base_world import BaseWorld
         assert isinstance(gui, BaseWorld)
+
+
+class _Ability(SimpleNamespace):
+    @property
+    def executors(self):
+        # a generator, like Caldera's Ability.executors
+        yield from self.executor_list
+
+
+def _ability(tactic, *executors, ability_id=None, technique_id='T1016', payloads=()):
+    ability_id = ability_id or '%s-%s' % (tactic, '-'.join(e for _, e in executors))
+    return _Ability(ability_id=ability_id, technique_id=technique_id, tactic=tactic, display=dict(ability_id=ability_id),
+                    executor_list=[SimpleNamespace(platform=p, name=e, payloads=list(payloads)) for p, e in executors])
+
+
+class TestAtomicGUISummary:
+    """Tests for the /plugin/atomic/summary endpoint."""
+
+    @pytest.fixture
+    def gui(self):
+        data_svc = MagicMock()
+        data_svc.locate = AsyncMock(return_value=[
+            _ability('discovery', ('windows', 'psh'), ('windows', 'cmd')),
+            _ability('discovery', ('linux', 'sh'), ('darwin', 'sh')),
+            _ability('execution', ('windows', 'psh')),
+        ])
+        return AtomicGUI({'auth_svc': MagicMock(), 'data_svc': data_svc}, 'Atomic', 'desc')
+
+    @pytest.mark.asyncio
+    async def test_summary_counts(self, gui):
+        response = await gui.summary(MagicMock())
+        assert json.loads(response.text) == {
+            'abilities': 3,
+            'tactics': {'discovery': 2, 'execution': 1},
+            'platforms': {'windows': 2, 'linux': 1, 'darwin': 1},
+            'executors': {'psh': 2, 'cmd': 1, 'sh': 1},
+        }
+        gui.data_svc.locate.assert_called_once_with('abilities', match=dict(plugin='atomic'))
+
+    @pytest.mark.asyncio
+    async def test_summary_is_precomputed(self, gui):
+        await gui.summary(MagicMock())
+        await gui.summary(MagicMock())
+        gui.data_svc.locate.assert_called_once()
+
+
+class TestAtomicGUIQuery:
+    """Tests for the /plugin/atomic/abilities query endpoint."""
+
+    @pytest.fixture
+    def gui(self):
+        data_svc = MagicMock()
+        data_svc.locate = AsyncMock(return_value=[
+            _ability('discovery', ('windows', 'psh'), ability_id='a1'),
+            _ability('discovery', ('linux', 'sh'), ability_id='a2', payloads=['x.sh']),
+            _ability('execution', ('windows', 'cmd'), ability_id='a3', technique_id='T1059'),
+        ])
+        return AtomicGUI({'auth_svc': MagicMock(), 'data_svc': data_svc}, 'Atomic', 'desc')
+
+    @staticmethod
+    def _request(**query):
+        return SimpleNamespace(query=query)
+
+    async def _query(self, gui, **query):
+        return json.loads((await gui.query(self._request(**query))).text)
+
+    @pytest.mark.asyncio
+    async def test_query_all(self, gui):
+        result = await self._query(gui)
+        assert result['total'] == 3
+        assert [a['ability_id'] for a in result['abilities']] == ['a1', 'a2', 'a3']
+
+    @pytest.mark.asyncio
+    async def test_query_filters(self, gui):
+        assert (await self._query(gui, tactic='discovery', platform='linux'))['total'] == 1
+        assert (await self._query(gui, technique_id='T1059'))['abilities'] == [{'ability_id': 'a3'}]
+        assert (await self._query(gui, executor='psh'))['abilities'] == [{'ability_id': 'a1'}]
+        assert (await self._query(gui, has_payloads='true'))['abilities'] == [{'ability_id': 'a2'}]
+        assert (await self._query(gui, has_payloads='false'))['total'] == 2
+        assert (await self._query(gui, tactic='collection'))['total'] == 0
+
+    @pytest.mark.asyncio
+    async def test_query_pagination(self, gui):
+        result = await self._query(gui, offset='1', limit='1')
+        assert result['total'] == 3
+        assert result['abilities'] == [{'ability_id': 'a2'}]
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('query', [dict(limit='0'), dict(offset='-1'), dict(limit='abc'), dict(has_payloads='maybe')])
+    async def test_query_bad_request(self, gui, query):
+        with pytest.raises(web.HTTPBadRequest):
+            await gui.query(self._request(**query))
+
+    @pytest.mark.asyncio
+    async def test_query_does_not_rescan_data_svc(self, gui):
+        await self._query(gui)
+        await self._query(gui, tactic='discovery')
+        gui.data_svc.locate.assert_called_once()
+
+
+class TestAtomicGUIProgress:
+    """Tests for the /plugin/atomic/progress server-sent events stream."""
+
+    @staticmethod
+    def _events(response):
+        return [json.loads(c.args[0].decode()[len('data: '):]) for c in response.write.call_args_list]
+
+    @pytest.mark.asyncio
+    async def test_progress_idle_without_atomic_svc(self):
+        gui = AtomicGUI({'auth_svc': MagicMock(), 'data_svc': MagicMock()}, 'Atomic', 'desc')
+        with patch('app.atomic_gui.web.StreamResponse') as response_cls:
+            response = response_cls.return_value
+            response.prepare, response.write = AsyncMock(), AsyncMock()
+            await gui.progress(MagicMock())
+        assert self._events(response) == [{'state': 'idle'}]
+
+    @pytest.mark.asyncio
+    async def test_progress_streams_until_finished(self, atomic_svc):
+        gui = AtomicGUI({'auth_svc': MagicMock(), 'data_svc': MagicMock(), 'atomic_svc': atomic_svc}, 'Atomic', 'desc')
+        atomic_svc.progress['state'] = 'running'
+        atomic_svc.subscribe_progress = MagicMock(wraps=atomic_svc.subscribe_progress)
+
+        async def ingest():
+            await asyncio.sleep(0)
+            atomic_svc._publish_progress(files_done=1)
+            atomic_svc._publish_progress(state='finished')
+
+        with patch('app.atomic_gui.web.StreamResponse') as response_cls:
+            response = response_cls.return_value
+            response.prepare, response.write = AsyncMock(), AsyncMock()
+            await asyncio.gather(gui.progress(MagicMock()), ingest())
+
+        events = self._events(response)
+        assert [e['state'] for e in events] == ['running', 'running', 'finished']
+        assert events[1]['files_done'] == 1
+        assert not atomic_svc._progress_listeners
+        for chunk in response.write.call_args_list:
+            assert chunk.args[0].endswith(b'\n\n')
+
+
+class TestAtomicGUIIngestionJob:
+    """Tests for the /plugin/atomic/ingestion job endpoints."""
+
+    @pytest.fixture
+    def gui(self):
+        data_svc = MagicMock()
+        data_svc.locate = AsyncMock(return_value=[])
+        data_svc.load_ability_file = AsyncMock()
+        data_svc.remove = AsyncMock()
+        return AtomicGUI({'auth_svc': MagicMock(), 'data_svc': data_svc}, 'Atomic', 'desc')
+
+    @staticmethod
+    def _request(body=None):
+        return SimpleNamespace(can_read_body=body is not None, json=AsyncMock(return_value=body))
+
+    @pytest.mark.asyncio
+    async def test_status_idle(self, gui):
+        status = json.loads((await gui.ingestion_status(MagicMock())).text)
+        assert status == dict(state='idle', progress=None)
+
+    @pytest.mark.asyncio
+    async def test_start_runs_job_and_reloads(self, gui):
+        with patch('plugins.atomic.app.atomic_svc.AtomicService') as svc_cls:
+            svc_cls.return_value.run_exclusive = AsyncMock(side_effect=_run_exclusive)
+            svc_cls.return_value.refresh_abilities = AsyncMock()
+            svc_cls.return_value.load_abilities = AsyncMock()
+            svc_cls.return_value.ingested_ability_ids = set()
+            svc_cls.return_value.progress = dict(state='finished')
+            response = await gui.start_ingestion(self._request(dict(repo_url='https://example.com/fork.git')))
+            assert response.status == 202
+            await gui._job
+
+        svc_cls.return_value.refresh_abilities.assert_called_once_with('https://example.com/fork.git')
+        status = json.loads((await gui.ingestion_status(MagicMock())).text)
+        assert status['state'] == 'finished'
+        assert status['progress'] == dict(state='finished')
+        assert status['finished']
+
+    @pytest.mark.asyncio
+    async def test_job_registers_lazy_payloads(self, gui):
+        gui.services['file_svc'] = MagicMock(add_special_payload=AsyncMock())
+        with patch('plugins.atomic.app.atomic_svc.AtomicService') as svc_cls:
+            svc_cls.return_value.run_exclusive = AsyncMock(side_effect=_run_exclusive)
+            svc_cls.return_value.refresh_abilities = AsyncMock()
+            svc_cls.return_value.load_abilities = AsyncMock()
+            svc_cls.return_value.register_payloads = AsyncMock()
+            svc_cls.return_value.ingested_ability_ids = set()
+            await gui.start_ingestion(self._request())
+            await gui._job
+        svc_cls.return_value.register_payloads.assert_awaited_once_with(gui.services['file_svc'])
+        assert gui._job_status['state'] == 'finished'
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('repo_url', ['--upload-pack=touch /tmp/pwned', 'ext::sh -c touch% /tmp/pwned', 'http://example.com/fork.git', ''])
+    async def test_start_rejects_invalid_repo_url(self, gui, repo_url):
+        with patch('plugins.atomic.app.atomic_svc.AtomicService') as svc_cls:
+            with pytest.raises(web.HTTPBadRequest):
+                await gui.start_ingestion(self._request(dict(repo_url=repo_url)))
+        svc_cls.assert_not_called()
+        assert gui._job is None
+
+    @pytest.mark.asyncio
+    async def test_start_rejects_malformed_body(self, gui):
+        request = SimpleNamespace(can_read_body=True, json=AsyncMock(side_effect=json.JSONDecodeError('Expecting value', '{', 1)))
+        with pytest.raises(web.HTTPBadRequest):
+            await gui.start_ingestion(request)
+        with pytest.raises(web.HTTPBadRequest):
+            await gui.start_ingestion(self._request(['https://example.com/fork.git']))
+
+    @pytest.mark.asyncio
+    async def test_start_conflicts_with_running_job(self, gui):
+        release = asyncio.Event()
+        with patch('plugins.atomic.app.atomic_svc.AtomicService') as svc_cls:
+            svc_cls.return_value.run_exclusive = AsyncMock(side_effect=_run_exclusive)
+
+            async def refresh(repo_url):
+                await release.wait()
+
+            svc_cls.return_value.refresh_abilities = refresh
+            await gui.start_ingestion(self._request())
+            with pytest.raises(web.HTTPConflict):
+                await gui.start_ingestion(self._request())
+            release.set()
+            await gui._job
+
+    @pytest.mark.asyncio
+    async def test_concurrent_starts_run_one_job(self, gui):
+        release = asyncio.Event()
+
+        async def json_body():
+            # the body arrives in several chunks
+            await asyncio.sleep(0)
+            return dict()
+
+        def request():
+            return SimpleNamespace(can_read_body=True, json=json_body)
+
+        async def refresh(repo_url):
+            await release.wait()
+
+        with patch('plugins.atomic.app.atomic_svc.AtomicService') as svc_cls:
+            svc_cls.return_value.run_exclusive = AsyncMock(side_effect=_run_exclusive)
+            svc_cls.return_value.refresh_abilities = AsyncMock(side_effect=refresh)
+            svc_cls.return_value.load_abilities = AsyncMock()
+            svc_cls.return_value.ingested_ability_ids = set()
+            results = await asyncio.gather(gui.start_ingestion(request()), gui.start_ingestion(request()),
+                                           return_exceptions=True)
+            assert [type(r) for r in results].count(web.HTTPConflict) == 1
+            assert svc_cls.call_count == 1
+            release.set()
+            await gui._job
+        svc_cls.return_value.refresh_abilities.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_failed_job(self, gui):
+        with patch('plugins.atomic.app.atomic_svc.AtomicService') as svc_cls:
+            svc_cls.return_value.run_exclusive = AsyncMock(side_effect=_run_exclusive)
+            svc_cls.return_value.refresh_abilities = AsyncMock(side_effect=RuntimeError('clone failed'))
+            await gui.start_ingestion(self._request())
+            await gui._job
+        assert gui._job_status['state'] == 'failed'
+        assert gui._job_status['error'] == 'clone failed'
+        svc_cls.return_value.load_abilities.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_job_fails_when_another_server_holds_the_lock(self, gui):
+        with patch('plugins.atomic.app.atomic_svc.AtomicService') as svc_cls:
+            svc_cls.return_value.run_exclusive = AsyncMock(return_value=False)
+            svc_cls.return_value.refresh_abilities = AsyncMock()
+            await gui.start_ingestion(self._request())
+            await gui._job
+        assert gui._job_status['state'] == 'failed'
+        svc_cls.return_value.refresh_abilities.assert_not_called()
+        svc_cls.return_value.load_abilities.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_cancel_job(self, gui):
+        with patch('plugins.atomic.app.atomic_svc.AtomicService') as svc_cls:
+            svc_cls.return_value.run_exclusive = AsyncMock(side_effect=_run_exclusive)
+
+            async def refresh(repo_url):
+                await asyncio.sleep(60)
+
+            svc_cls.return_value.refresh_abilities = refresh
+            await gui.start_ingestion(self._request())
+            await asyncio.sleep(0)
+            status = json.loads((await gui.cancel_ingestion(MagicMock())).text)
+        assert status['state'] == 'cancelled'
+        svc_cls.return_value.load_abilities.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_cancel_without_job(self, gui):
+        with pytest.raises(web.HTTPConflict):
+            await gui.cancel_ingestion(MagicMock())
+
+    @pytest.mark.asyncio
+    async def test_reload_abilities(self, gui):
+        gui._atomic_svc = MagicMock(load_abilities=AsyncMock(), ingested_ability_ids={'kept'})
+        gui.data_svc.locate = AsyncMock(return_value=[SimpleNamespace(ability_id='kept'),
+                                                      SimpleNamespace(ability_id='stale')])
+        await gui._reload_abilities()
+        gui._atomic_svc.load_abilities.assert_called_once_with(gui.data_svc)
+        gui.data_svc.remove.assert_called_once_with('abilities', dict(ability_id='stale'))
+        assert gui._index is None
+
+    @pytest.mark.asyncio
+    async def test_reload_updates_index_incrementally(self, gui):
+        kept, stale = _ability('discovery', ('linux', 'sh'), ability_id='kept'), _ability('impact', ('windows', 'psh'), ability_id='stale')
+        gui.data_svc.locate = AsyncMock(return_value=[kept, stale])
+        await gui._get_index()
+        updated = _ability('execution', ('windows', 'cmd'), ability_id='kept')
+        added = _ability('discovery', ('darwin', 'sh'), ability_id='added')
+        gui.data_svc.locate = AsyncMock(return_value=[updated, stale, added])
+        gui._atomic_svc = MagicMock(load_abilities=AsyncMock(), ingested_ability_ids={'kept', 'added'})
+        index = gui._index
+        await gui._reload_abilities()
+        assert gui._index is index
+        assert index.summary() == dict(abilities=2, tactics={'execution': 1, 'discovery': 1}, platforms={'windows': 1, 'darwin': 1},
+                                       executors={'cmd': 1, 'sh': 1})
@@ -0,0 +1,73 @@
+from types import SimpleNamespace
+
+from app.atomic_index import AtomicAbilityIndex
+
+
+class _Ability(SimpleNamespace):
+    @property
+    def executors(self):
+        # a generator, like Caldera's Ability.executors
+        yield from self.executor_list
+
+
+def _ability(ability_id, tactic='discovery', technique_id='T1016', executors=(('windows', 'psh'),), payloads=()):
+    return _Ability(ability_id=ability_id, tactic=tactic, technique_id=technique_id,
+                    executor_list=[SimpleNamespace(platform=p, name=e, payloads=list(payloads)) for p, e in executors])
+
+
+class TestAtomicAbilityIndex:
+
+    def test_empty_index(self):
+        index = AtomicAbilityIndex()
+        assert index.query() == (0, [])
+        assert index.summary() == dict(abilities=0, tactics={}, platforms={}, executors={})
+
+    def test_add_and_query(self):
+        index = AtomicAbilityIndex()
+        a1, a2 = _ability('a1'), _ability('a2', tactic='execution', executors=(('linux', 'sh'),))
+        index.add(a2)
+        index.add(a1)
+        assert index.query() == (2, [a1, a2])
+        assert index.query(tactic='execution') == (1, [a2])
+        assert index.query(platform='linux', executor='psh') == (0, [])
+
+    def test_none_filters_are_ignored(self):
+        index = AtomicAbilityIndex()
+        index.add(_ability('a1'))
+        assert index.query(tactic=None, platform=None)[0] == 1
+
+    def test_has_payloads(self):
+        index = AtomicAbilityIndex()
+        index.add(_ability('a1', payloads=['payload.ps1']))
+        index.add(_ability('a2'))
+        assert [a.ability_id for a in index.query(has_payloads=True)[1]] == ['a1']
+        assert [a.ability_id for a in index.query(has_payloads=False)[1]] == ['a2']
+
+    def test_pagination(self):
+        index = AtomicAbilityIndex()
+        for i in range(5):
+            index.add(_ability('a%d' % i))
+        total, page = index.query(offset=2, limit=2)
+        assert total == 5
+        assert [a.ability_id for a in page] == ['a2', 'a3']
+
+    def test_remove_updates_postings(self):
+        index = AtomicAbilityIndex()
+        index.add(_ability('a1', tactic='execution'))
+        index.remove('a1')
+        index.remove('unknown')
+        assert index.query(tactic='execution') == (0, [])
+        assert index.summary()['tactics'] == {}
+
+    def test_re_adding_replaces_previous_entry(self):
+        index = AtomicAbilityIndex()
+        index.add(_ability('a1', tactic='discovery'))
+        index.add(_ability('a1', tactic='execution'))
+        assert index.summary()['tactics'] == {'execution': 1}
+
+    def test_summary_counts_each_ability_once_per_value(self):
+        index = AtomicAbilityIndex()
+        index.add(_ability('a1', executors=(('windows', 'psh'), ('windows', 'cmd'))))
+        index.add(_ability('a2', executors=(('linux', 'sh'),)))
+        assert index.summary() == dict(abilities=2, tactics={'discovery': 2}, platforms={'windows': 1, 'linux': 1},
+                                       executors={'psh': 1, 'cmd': 1, 'sh': 1})
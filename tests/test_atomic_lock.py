@@ -0,0 +1,158 @@
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from app.atomic_lock import FileLock
+
+
+@pytest.fixture
+def lock_path(tmp_path):
+    return str(tmp_path / 'data' / '.ingestion.lock')
+
+
+def _write_lock(path, mtime=None, **owner):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(dict(dict(host='other-host', pid=1, token='other'), **owner), f)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def _dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+class TestFileLock:
+
+    def test_acquire_and_release(self, lock_path):
+        lock = FileLock(lock_path)
+        assert lock.try_acquire()
+        assert lock.held
+        assert lock.owner()['pid'] == os.getpid()
+        assert not FileLock(lock_path).try_acquire()
+        lock.release()
+        assert not os.path.exists(lock_path)
+        assert FileLock(lock_path).try_acquire()
+
+    def test_release_leaves_a_lock_taken_over(self, lock_path):
+        lock = FileLock(lock_path)
+        assert lock.try_acquire()
+        _write_lock(lock_path, token='newer')
+        lock.release()
+        assert FileLock(lock_path).owner()['token'] == 'newer'
+
+    def test_heartbeat_refreshes_the_lock(self, lock_path):
+        lock = FileLock(lock_path, heartbeat=0.01)
+        assert lock.try_acquire()
+        os.utime(lock_path, (0, 0))
+        time.sleep(0.2)
+        assert os.stat(lock_path).st_mtime > time.time() - 60
+        lock.release()
+        assert not os.path.exists(lock_path)
+
+    def test_live_lock_is_kept(self, lock_path):
+        _write_lock(lock_path)
+        assert not FileLock(lock_path).try_acquire()
+        assert FileLock(lock_path).owner()['token'] == 'other'
+
+    def test_dead_holder_on_this_host(self, lock_path):
+        _write_lock(lock_path, host=socket.gethostname(), pid=_dead_pid())
+        lock = FileLock(lock_path)
+        assert lock.try_acquire()
+        assert lock.owner()['pid'] == os.getpid()
+        lock.release()
+
+    def test_old_mtime_alone_does_not_break_the_lock(self, lock_path):
+        # eg. this host's clock runs ahead of the file server's: the holder may still be refreshing the lock
+        _write_lock(lock_path, mtime=time.time() - 600)
+        lock = FileLock(lock_path, stale_after=120)
+        assert not lock.try_acquire()
+        assert not lock.try_acquire()
+        assert FileLock(lock_path).owner()['token'] == 'other'
+
+    def test_lock_not_refreshed(self, lock_path):
+        _write_lock(lock_path, mtime=time.time() - 600)
+        lock = FileLock(lock_path, stale_after=0.05)
+        assert not lock.try_acquire()
+        time.sleep(0.1)
+        assert lock.try_acquire()
+        lock.release()
+
+    def test_refreshed_lock_is_kept(self, lock_path):
+        _write_lock(lock_path, mtime=time.time() - 600)
+        lock = FileLock(lock_path, stale_after=0.05)
+        assert not lock.try_acquire()
+        time.sleep(0.1)
+        # the holder's heartbeat
+        os.utime(lock_path, (time.time() - 500, time.time() - 500))
+        assert not lock.try_acquire()
+
+    def test_lock_not_refreshed_while_watched(self, lock_path):
+        # a holder on a file server whose clock runs ahead, and which stopped refreshing the lock
+        _write_lock(lock_path, mtime=time.time() + 3600)
+        lock = FileLock(lock_path, stale_after=0.05)
+        assert not lock.try_acquire()
+        time.sleep(0.1)
+        assert lock.try_acquire()
+        lock.release()
+        assert not [name for name in os.listdir(os.path.dirname(lock_path)) if name.endswith('.stale')]
+
+    def test_empty_lock_file(self, lock_path):
+        # a holder which created the file but did not write it yet
+        os.makedirs(os.path.dirname(lock_path))
+        open(lock_path, 'w').close()
+        assert not FileLock(lock_path).try_acquire()
+
+    @pytest.mark.asyncio
+    async def test_wait(self, lock_path):
+        holder = FileLock(lock_path)
+        assert holder.try_acquire()
+        asyncio.get_running_loop().call_later(0.05, holder.release)
+        assert await FileLock(lock_path, poll_interval=0.01).wait(timeout=5)
+
+    @pytest.mark.asyncio
+    async def test_wait_timeout(self, lock_path):
+        _write_lock(lock_path)
+        assert not await FileLock(lock_path, poll_interval=0.01).wait(timeout=0.05)
+        assert os.path.exists(lock_path)
+
+    @pytest.mark.asyncio
+    async def test_acquire(self, lock_path):
+        holder = FileLock(lock_path)
+        assert holder.try_acquire()
+        waiter = FileLock(lock_path, poll_interval=0.01)
+        assert not await waiter.acquire(timeout=0.05)
+        holder.release()
+        assert await waiter.acquire(timeout=5)
+        waiter.release()
+
+    def test_processes_take_turns(self, lock_path, tmp_path):
+        """Processes appending to a file while holding the lock never interleave their lines."""
+        script = (
+            'import asyncio, sys, time\n'
+            'from app.atomic_lock import FileLock\n'
+            'async def main():\n'
+            '    lock = FileLock(sys.argv[1], poll_interval=0.01)\n'
+            '    assert await lock.acquire(timeout=30)\n'
+            '    with open(sys.argv[2], "a") as f:\n'
+            '        for i in range(5):\n'
+            '            f.write(sys.argv[3] + "\\n"); f.flush(); time.sleep(0.01)\n'
+            '    lock.release()\n'
+            'asyncio.run(main())\n'
+        )
+        out = str(tmp_path / 'out.txt')
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        processes = [subprocess.Popen([sys.executable, '-c', script, lock_path, out, str(i)], cwd=root) for i in range(4)]
+        assert all(p.wait(timeout=60) == 0 for p in processes)
+        with open(out) as f:
+            lines = f.read().split()
+        assert len(lines) == 20
+        assert all(len(set(lines[i:i + 5])) == 1 for i in range(0, 20, 5))
@@ -0,0 +1,55 @@
+import tracemalloc
+
+from app.atomic_memory import MemoryProfile
+
+
+def _allocate(size):
+    return bytearray(size)
+
+
+class TestMemoryProfile:
+
+    def test_phases_and_top_sites(self):
+        profile = MemoryProfile(top=3)
+        profile.start()
+        try:
+            kept = _allocate(1024 * 1024)
+            profile.phase('allocate')
+            profile.phase('idle')
+        finally:
+            profile.stop()
+
+        allocate, idle = profile.report()['phases']
+        assert allocate['phase'] == 'allocate'
+        assert allocate['delta'] >= 1024 * 1024
+        assert 'test_atomic_memory.py' in allocate['top'][0]['site']
+        assert allocate['top'][0]['size'] >= 1024 * 1024
+        assert abs(idle['delta']) < 1024 * 1024
+        assert len(kept) == 1024 * 1024
+
+    def test_files_are_ranked_by_growth(self):
+        profile = MemoryProfile(top=2)
+        profile.start()
+        try:
+            kept = []
+            for name, size in (('small.yaml', 1024), ('large.yaml', 512 * 1024), ('medium.yaml', 64 * 1024)):
+                kept.append(_allocate(size))
+                profile.file_done(f'atomics/{name}')
+        finally:
+            profile.stop()
+
+        assert [f['file'] for f in profile.report()['top_files']] == ['large.yaml', 'medium.yaml']
+
+    def test_stop_leaves_existing_tracing_alone(self):
+        tracemalloc.start()
+        try:
+            profile = MemoryProfile()
+            profile.start()
+            profile.stop()
+            assert tracemalloc.is_tracing()
+        finally:
+            tracemalloc.stop()
+        profile = MemoryProfile()
+        profile.start()
+        profile.stop()
+        assert not tracemalloc.is_tracing()
@@ -0,0 +1,178 @@
+import hashlib
+import io
+import json
+import os
+import tarfile
+
+import pytest
+import yaml
+
+from app.atomic_pack import MANIFEST, PACK_FORMAT, export_pack, import_pack
+
+FINGERPRINT = dict(source='git:' + 'a' * 40, plugin_version='1.0.0', transformer=1, config='c' * 64)
+
+
+def _write(path, content, mode='w'):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, mode) as f:
+        f.write(content)
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _ability(ability_id, payloads):
+    return [dict(id=ability_id, name=ability_id, tactic='discovery',
+                 platforms=dict(windows=dict(psh=dict(command='.\\tool.exe', payloads=payloads))))]
+
+
+@pytest.fixture
+def ingested(tmp_path):
+    """Abilities as ingestion leaves them: two use the same tool under different names, one uses a lazy payload."""
+    data_dir, payloads_dir = str(tmp_path / 'data'), str(tmp_path / 'payloads')
+    abilities = os.path.join(data_dir, 'abilities', 'discovery')
+    _write(os.path.join(abilities, 'a.yml'), yaml.dump(_ability('a', ['aaaaaa_tool.exe'])))
+    _write(os.path.join(abilities, 'b.yml'), yaml.dump(_ability('b', ['bbbbbb_tool.exe', 'cccccc_lazy.ps1'])))
+    _write(os.path.join(abilities, 'c.yml'), yaml.dump(_ability('c', [])))
+    _write(os.path.join(payloads_dir, 'aaaaaa_tool.exe'), b'MZ tool', 'wb')
+    _write(os.path.join(payloads_dir, 'bbbbbb_tool.exe'), b'MZ tool', 'wb')
+    _write(os.path.join(payloads_dir, 'unused.txt'), 'not referenced')
+    lazy_source = str(tmp_path / 'atomics' / 'lazy.ps1')
+    _write(lazy_source, 'Write-Host lazy')
+    refs = {'cccccc_lazy.ps1': dict(source=lazy_source, digest=hashlib.md5(b'Write-Host lazy').hexdigest())}
+    _write(os.path.join(data_dir, 'payload_refs.json'), json.dumps(refs))
+    _write(os.path.join(data_dir, 'fingerprint.json'), json.dumps(FINGERPRINT))
+    return data_dir, payloads_dir
+
+
+@pytest.fixture
+def node(tmp_path):
+    return str(tmp_path / 'node' / 'data'), str(tmp_path / 'node' / 'payloads')
+
+
+def _members(pack):
+    with tarfile.open(pack, 'r:gz') as f:
+        return [(m, f.extractfile(m).read()) for m in f.getmembers()]
+
+
+def _rewrite(pack, members):
+    with tarfile.open(pack, 'w:gz') as f:
+        for member, content in members:
+            member.size = len(content)
+            f.addfile(member, io.BytesIO(content))
+
+
+class TestExportPack:
+
+    def test_manifest(self, ingested, tmp_path):
+        data_dir, payloads_dir = ingested
+        manifest = export_pack(data_dir, payloads_dir, str(tmp_path / 'pack.tar.gz'))
+        tool, lazy = hashlib.sha256(b'MZ tool').hexdigest(), hashlib.sha256(b'Write-Host lazy').hexdigest()
+        assert manifest['format'] == PACK_FORMAT
+        assert manifest['fingerprint'] == FINGERPRINT
+        assert sorted(manifest['abilities']) == ['discovery/a.yml', 'discovery/b.yml', 'discovery/c.yml']
+        assert manifest['payloads'] == {'aaaaaa_tool.exe': tool, 'bbbbbb_tool.exe': tool, 'cccccc_lazy.ps1': lazy}
+
+    def test_payloads_are_stored_once_per_digest(self, ingested, tmp_path):
+        data_dir, payloads_dir = ingested
+        pack = str(tmp_path / 'pack.tar.gz')
+        export_pack(data_dir, payloads_dir, pack)
+        names = [m.name for m, _ in _members(pack)]
+        assert names[0] == MANIFEST
+        assert sorted(n for n in names if n.startswith('blobs/')) == sorted(
+            'blobs/' + hashlib.sha256(c).hexdigest() for c in (b'MZ tool', b'Write-Host lazy'))
+        assert len(names) == 1 + 3 + 2
+
+    def test_deterministic(self, ingested, tmp_path):
+        data_dir, payloads_dir = ingested
+        export_pack(data_dir, payloads_dir, str(tmp_path / 'first.tar.gz'))
+        os.utime(os.path.join(payloads_dir, 'aaaaaa_tool.exe'), (0, 0))
+        export_pack(data_dir, payloads_dir, str(tmp_path / 'second.tar.gz'))
+        assert _read(str(tmp_path / 'first.tar.gz')) == _read(str(tmp_path / 'second.tar.gz'))
+
+    def test_missing_payload(self, ingested, tmp_path):
+        data_dir, payloads_dir = ingested
+        os.remove(os.path.join(payloads_dir, 'aaaaaa_tool.exe'))
+        with pytest.raises(ValueError, match='aaaaaa_tool.exe'):
+            export_pack(data_dir, payloads_dir, str(tmp_path / 'pack.tar.gz'))
+        assert not os.path.exists(str(tmp_path / 'pack.tar.gz'))
+
+    def test_changed_lazy_payload(self, ingested, tmp_path):
+        data_dir, payloads_dir = ingested
+        _write(str(tmp_path / 'atomics' / 'lazy.ps1'), 'Write-Host changed')
+        with pytest.raises(ValueError, match='changed since it was ingested'):
+            export_pack(data_dir, payloads_dir, str(tmp_path / 'pack.tar.gz'))
+
+    def test_no_abilities(self, tmp_path):
+        with pytest.raises(ValueError, match='No abilities'):
+            export_pack(str(tmp_path / 'data'), str(tmp_path / 'payloads'), str(tmp_path / 'pack.tar.gz'))
+
+
+class TestImportPack:
+
+    @pytest.fixture
+    def pack(self, ingested, tmp_path):
+        pack = str(tmp_path / 'pack.tar.gz')
+        export_pack(*ingested, pack)
+        return pack
+
+    def test_round_trip(self, ingested, pack, node):
+        data_dir, payloads_dir = ingested
+        node_data, node_payloads = node
+        _write(os.path.join(node_data, 'payload_refs.json'), '{}')
+        import_pack(pack, node_data, node_payloads)
+        for name in ('a.yml', 'b.yml', 'c.yml'):
+            path = os.path.join('abilities', 'discovery', name)
+            assert _read(os.path.join(node_data, path)) == _read(os.path.join(data_dir, path))
+        assert sorted(os.listdir(node_payloads)) == ['aaaaaa_tool.exe', 'bbbbbb_tool.exe', 'cccccc_lazy.ps1']
+        assert _read(os.path.join(node_payloads, 'bbbbbb_tool.exe')) == b'MZ tool'
+        assert _read(os.path.join(node_payloads, 'cccccc_lazy.ps1')) == b'Write-Host lazy'
+        with open(os.path.join(node_data, 'fingerprint.json')) as f:
+            assert json.load(f) == FINGERPRINT
+        assert sorted(os.listdir(node_data)) == ['abilities', 'fingerprint.json']
+
+    def test_replaces_abilities(self, pack, node):
+        node_data, node_payloads = node
+        _write(os.path.join(node_data, 'abilities', 'impact', 'old.yml'), 'old')
+        import_pack(pack, node_data, node_payloads)
+        assert os.listdir(os.path.join(node_data, 'abilities')) == ['discovery']
+
+    def test_tampered_file(self, pack, node):
+        node_data, node_payloads = node
+        _write(os.path.join(node_data, 'abilities', 'impact', 'old.yml'), 'old')
+        members = _members(pack)
+        members = [(m, b'MZ evil' if m.name.startswith('blobs/') and c == b'MZ tool' else c) for m, c in members]
+        _rewrite(pack, members)
+        with pytest.raises(ValueError, match='Digest mismatch'):
+            import_pack(pack, node_data, node_payloads)
+        assert os.listdir(os.path.join(node_data, 'abilities')) == ['impact']
+        assert not os.path.exists(node_payloads)
+        assert os.listdir(node_data) == ['abilities']
+
+    def test_unexpected_entry(self, pack, node):
+        members = _members(pack) + [(tarfile.TarInfo('abilities/discovery/extra.yml'), b'extra')]
+        _rewrite(pack, members)
+        with pytest.raises(ValueError, match='Unexpected entry'):
+            import_pack(pack, *node)
+
+    def test_missing_entry(self, pack, node):
+        _rewrite(pack, [(m, c) for m, c in _members(pack) if m.name != 'abilities/discovery/c.yml'])
+        with pytest.raises(ValueError, match='missing 1 file'):
+            import_pack(pack, *node)
+
+    @pytest.mark.parametrize('change', [dict(format=PACK_FORMAT + 1), dict(abilities={'../../hook.py': '0' * 64}),
+                                        dict(payloads={'../hook.py': '0' * 64})])
+    def test_refused_manifest(self, pack, node, change):
+        members = _members(pack)
+        manifest = dict(json.loads(members[0][1]), **change)
+        _rewrite(pack, [(members[0][0], json.dumps(manifest).encode())] + members[1:])
+        with pytest.raises(ValueError):
+            import_pack(pack, *node)
+        assert not os.path.exists(os.path.join(node[0], 'abilities'))
+
+    def test_not_a_pack(self, tmp_path, node):
+        _rewrite(str(tmp_path / 'other.tar.gz'), [(tarfile.TarInfo('readme.txt'), b'hello')])
+        with pytest.raises(ValueError, match='Not an ability pack'):
+            import_pack(str(tmp_path / 'other.tar.gz'), *node)
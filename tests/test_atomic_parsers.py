@@ -0,0 +1,83 @@
+import time
+
+import pytest
+
+from app.parsers.atomic_base import AtomicParser, _compile_flags
+from app.parsers.atomic_cmd import Parser as CmdParser
+from app.parsers.atomic_powershell import Parser as PowershellParser
+from app.parsers.atomic_sh import Parser as ShParser
+from app.utility.base_parser import PARSER_SIGNALS_FAILURE
+
+
+class TestAtomicParserEngine:
+    """Tests for the matcher shared by all Atomic parsers."""
+
+    def test_no_flags_never_fails(self):
+        assert AtomicParser().parse('anything at all') == []
+
+    def test_compiled_matcher_is_cached(self):
+        flags = ('command not found', 'Permission denied')
+        assert _compile_flags(flags) is _compile_flags(flags)
+
+    def test_matcher_escapes_flags(self):
+        matcher = _compile_flags(('a.b',))
+        assert matcher.search('a.b')
+        assert not matcher.search('axb')
+
+    def test_all_parsers_share_engine(self):
+        for parser_cls in (PowershellParser, ShParser, CmdParser):
+            assert issubclass(parser_cls, AtomicParser)
+
+
+class TestShParser:
+    @pytest.mark.parametrize('blob', [
+        'sh: 1: nmap: command not found',
+        'bash: /etc/shadow: Permission denied',
+        'rm: cannot remove /proc/1: Operation not permitted',
+    ])
+    def test_failure_signatures(self, blob):
+        assert ShParser().parse('some output\n' + blob) == [PARSER_SIGNALS_FAILURE]
+
+    def test_clean_output(self):
+        assert ShParser().parse('root\nlocalhost\n') == []
+
+
+class TestCmdParser:
+    @pytest.mark.parametrize('blob', [
+        "'foo' is not recognized as an internal or external command,",
+        'Access is denied.',
+        'The system cannot find the path specified.',
+        'The system cannot find the file specified.',
+        'The syntax of the command is incorrect.',
+    ])
+    def test_failure_signatures(self, blob):
+        assert CmdParser().parse('some output\n' + blob) == [PARSER_SIGNALS_FAILURE]
+
+    def test_clean_output(self):
+        assert CmdParser().parse('Windows IP Configuration\n   Host Name . . . : DESKTOP') == []
+
+    def test_large_output_with_failure_at_end(self):
+        parser = CmdParser()
+        parser.chunk_size = 1024
+        blob = 'Directory of C:\\Windows\n' * 500 + 'Access is denied.'
+        assert parser.parse(blob) == [PARSER_SIGNALS_FAILURE]
+
+
+@pytest.mark.performance
+class TestParserBenchmark:
+    """
+    Keep the per-link parse cost negligible: a typical output must parse well under a millisecond.
+    Machine dependent, so only run with `-m performance`.
+    """
+
+    ROUNDS = 1000
+    BUDGET_PER_PARSE = 0.001
+
+    @pytest.mark.parametrize('parser_cls', [ShParser, CmdParser])
+    def test_parse_cost_per_link(self, parser_cls):
+        parser = parser_cls()
+        blob = '\n'.join('line %d of a typical ability output' % i for i in range(50))
+        start = time.perf_counter()
+        for _ in range(self.ROUNDS):
+            parser.parse(blob)
+        assert (time.perf_counter() - start) / self.ROUNDS < self.BUDGET_PER_PARSE
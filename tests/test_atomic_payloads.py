@@ -0,0 +1,139 @@
+import hashlib
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from app.atomic_payloads import (build_archive, load_payload_refs, materialize, register_payload_refs,
+                                 save_payload_refs, swap_directory, tree_digest)
+
+
+@pytest.fixture
+def attachment(tmp_path):
+    path = tmp_path / 'atomics' / 'T1016' / 'src' / 'tool.exe'
+    path.parent.mkdir(parents=True)
+    path.write_bytes(b'binary content')
+    return str(path)
+
+
+@pytest.fixture
+def ref(attachment):
+    with open(attachment, 'rb') as f:
+        return dict(source=attachment, digest=hashlib.md5(f.read(), usedforsecurity=False).hexdigest())
+
+
+@pytest.fixture
+def tree(tmp_path):
+    src = tmp_path / 'atomics' / 'T1016' / 'src'
+    (src / 'bin').mkdir(parents=True)
+    (src / 'readme.txt').write_text('read me')
+    (src / 'bin' / 'run.sh').write_text('echo run')
+    os.chmod(src / 'bin' / 'run.sh', 0o755)
+    return src
+
+
+class FileSvc:
+    def __init__(self):
+        self.special_payloads = dict()
+
+    async def add_special_payload(self, name, func):
+        self.special_payloads[name] = func
+
+
+class TestPayloadRefs:
+
+    def test_round_trip(self, tmp_path, ref):
+        path = str(tmp_path / 'data' / 'payload_refs.json')
+        assert load_payload_refs(path) == dict()
+        save_payload_refs(path, {'abc123_tool.exe': ref})
+        assert load_payload_refs(path) == {'abc123_tool.exe': ref}
+
+    def test_materialize_copies_once(self, tmp_path, ref):
+        payloads_dir = str(tmp_path / 'payloads')
+        target = materialize('abc123_tool.exe', ref, payloads_dir)
+        assert target == os.path.join(payloads_dir, 'abc123_tool.exe')
+        with open(target, 'rb') as f:
+            assert f.read() == b'binary content'
+        os.remove(ref['source'])
+        assert materialize('abc123_tool.exe', ref, payloads_dir) == target
+        assert os.listdir(payloads_dir) == ['abc123_tool.exe']
+
+    def test_materialize_refuses_changed_attachment(self, tmp_path, ref):
+        with open(ref['source'], 'wb') as f:
+            f.write(b'tampered')
+        with pytest.raises(ValueError):
+            materialize('abc123_tool.exe', ref, str(tmp_path / 'payloads'))
+        assert not os.path.exists(tmp_path / 'payloads' / 'abc123_tool.exe')
+
+    @pytest.mark.asyncio
+    async def test_registered_payload_is_served_on_request(self, tmp_path, ref):
+        file_svc = FileSvc()
+        payloads_dir = str(tmp_path / 'payloads')
+        await register_payload_refs(file_svc, {'abc123_tool.exe': ref}, payloads_dir)
+        assert list(file_svc.special_payloads) == ['abc123_tool.exe']
+        assert not os.path.exists(payloads_dir)
+
+        served = await file_svc.special_payloads['abc123_tool.exe']({'file': 'abc123_tool.exe'})
+        assert served == ('abc123_tool.exe', 'abc123_tool.exe')
+        assert os.listdir(payloads_dir) == ['abc123_tool.exe']
+
+
+class TestDirectoryArchives:
+
+    def test_tree_digest_ignores_timestamps(self, tree):
+        digest = tree_digest(str(tree))
+        os.utime(tree / 'readme.txt', (0, 0))
+        assert tree_digest(str(tree)) == digest
+        (tree / 'readme.txt').write_text('changed')
+        assert tree_digest(str(tree)) != digest
+
+    def test_tree_digest_covers_paths(self, tree):
+        digest = tree_digest(str(tree))
+        os.rename(tree / 'readme.txt', tree / 'README.txt')
+        assert tree_digest(str(tree)) != digest
+
+    @pytest.mark.parametrize('archive_format', ['zip', 'tar.gz'])
+    def test_archives_are_deterministic(self, tmp_path, tree, archive_format):
+        first, second = str(tmp_path / f'first.{archive_format}'), str(tmp_path / f'second.{archive_format}')
+        build_archive(str(tree), first, 'abc123_src', archive_format)
+        os.utime(tree / 'readme.txt', (0, 0))
+        build_archive(str(tree), second, 'abc123_src', archive_format)
+        with open(first, 'rb') as f1, open(second, 'rb') as f2:
+            assert f1.read() == f2.read()
+
+    def test_zip_content(self, tmp_path, tree):
+        target = str(tmp_path / 'payloads' / 'abc123_src.zip')
+        build_archive(str(tree), target, 'abc123_src', 'zip')
+        with zipfile.ZipFile(target) as archive:
+            assert archive.namelist() == ['abc123_src/bin/run.sh', 'abc123_src/readme.txt']
+            assert archive.read('abc123_src/readme.txt') == b'read me'
+            assert archive.getinfo('abc123_src/bin/run.sh').external_attr >> 16 == 0o755
+        assert os.listdir(tmp_path / 'payloads') == ['abc123_src.zip']
+
+    def test_tar_content(self, tmp_path, tree):
+        target = str(tmp_path / 'abc123_src.tar.gz')
+        build_archive(str(tree), target, 'abc123_src', 'tar.gz')
+        with tarfile.open(target) as archive:
+            assert archive.getnames() == ['abc123_src/bin/run.sh', 'abc123_src/readme.txt']
+            assert archive.getmember('abc123_src/bin/run.sh').mode == 0o755
+            assert archive.extractfile('abc123_src/readme.txt').read() == b'read me'
+
+
+class TestSwapDirectory:
+
+    def test_replaces_target(self, tmp_path):
+        (tmp_path / 'src').mkdir()
+        (tmp_path / 'src' / 'new.yml').write_text('new')
+        (tmp_path / 'dst').mkdir()
+        (tmp_path / 'dst' / 'old.yml').write_text('old')
+        swap_directory(str(tmp_path / 'src'), str(tmp_path / 'dst'))
+        assert os.listdir(tmp_path / 'dst') == ['new.yml']
+        assert sorted(os.listdir(tmp_path)) == ['dst']
+
+    def test_without_existing_target(self, tmp_path):
+        src = tmp_path / 'src'
+        src.mkdir()
+        swap_directory(str(src), str(tmp_path / 'dst'))
+        assert os.path.isdir(tmp_path / 'dst')
+        assert not os.path.exists(src)
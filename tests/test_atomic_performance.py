@@ -0,0 +1,129 @@
+import json
+import os
+import time
+import tracemalloc
+from unittest.mock import patch
+
+import pytest
+import yaml
+
+from app.atomic_svc import AtomicService
+
+TECHNIQUES = 500
+TESTS_PER_TECHNIQUE = 4
+TACTICS = ('discovery', 'execution', 'persistence', 'defense-evasion', 'credential-access')
+
+
+def _technique_id(i):
+    return f'T{1000 + i}'
+
+
+def _tests(technique_id):
+    """Tests shaped like Atomic Red Team's: several platforms, inputs, an attachment and dependencies."""
+    return [
+        dict(name=f'{technique_id} powershell', description='Run a script from the atomics folder.',
+             supported_platforms=['windows'],
+             input_arguments=dict(script=dict(type='path', default=f'PathToAtomicsFolder\\{technique_id}\\src\\tool.ps1')),
+             executor=dict(name='powershell', command='Import-Module #{script}\nInvoke-Tool -Verbose\nGet-Process | Out-Null',
+                           cleanup_command='Remove-Item $env:TEMP\\tool.log -ErrorAction Ignore')),
+        dict(name=f'{technique_id} bash', description='Enumerate the host.', supported_platforms=['linux', 'macos'],
+             dependency_executor_name='sh',
+             dependencies=[dict(description='curl is installed',
+                                prereq_command='if [ -x "$(command -v curl)" ]; then exit 0; else exit 1; fi;',
+                                get_prereq_command='apt-get install -y curl')],
+             executor=dict(name='bash', command='uname -a\n# comment\nid\ncat /etc/passwd | head -n #{lines}'),
+             input_arguments=dict(lines=dict(type='integer', default=5))),
+        dict(name=f'{technique_id} cmd', description='List the directory.', supported_platforms=['windows'],
+             executor=dict(name='command_prompt', command='dir %TEMP%\nwhoami /all\nREM done')),
+        dict(name=f'{technique_id} manual', description='Done by hand.', supported_platforms=['windows'],
+             executor=dict(name='manual', steps='Open the control panel.')),
+    ][:TESTS_PER_TECHNIQUE]
+
+
+@pytest.fixture(scope='module')
+def corpus(tmp_path_factory):
+    """Synthesize an Atomic Red Team checkout, with the enterprise ATT&CK mapping of its techniques."""
+    repo_dir = tmp_path_factory.mktemp('corpus') / 'atomic-red-team'
+    objects = []
+    for i in range(TECHNIQUES):
+        technique_id = _technique_id(i)
+        technique_dir = repo_dir / 'atomics' / technique_id
+        (technique_dir / 'src').mkdir(parents=True)
+        (technique_dir / 'src' / 'tool.ps1').write_text(f'function Invoke-Tool {{ "{technique_id}" }}\n' * 20)
+        doc = dict(attack_technique=technique_id, display_name=f'Technique {i}', atomic_tests=_tests(technique_id))
+        (technique_dir / f'{technique_id}.yaml').write_text(yaml.safe_dump(doc, sort_keys=False))
+        objects.append(dict(type='attack-pattern',
+                            external_references=[dict(source_name='mitre-attack', external_id=technique_id)],
+                            kill_chain_phases=[dict(kill_chain_name='mitre-attack', phase_name=TACTICS[i % len(TACTICS)])]))
+    (repo_dir / 'atomic_red_team').mkdir()
+    (repo_dir / 'atomic_red_team' / 'enterprise-attack.json').write_text(json.dumps(dict(objects=objects)))
+    return str(repo_dir)
+
+
+def _strip_yml(path):
+    # what Caldera's BaseWorld.strip_yml does
+    with open(path, encoding='utf-8') as f:
+        return list(yaml.safe_load_all(f))
+
+
+async def _ingest(corpus, tmp_path, path_yaml=None):
+    svc = AtomicService()
+    svc.repo_dir = corpus
+    svc.data_dir = str(tmp_path / 'data')
+    svc.payloads_dir = str(tmp_path / 'payloads')
+    svc.quarantine_path = str(tmp_path / 'quarantine.yml')
+    os.makedirs(svc.payloads_dir)
+    with patch('app.atomic_svc.BaseWorld.strip_yml', side_effect=_strip_yml):
+        await svc.populate_data_directory(path_yaml=path_yaml)
+    files_written = sum(len(files) for _, _, files in os.walk(tmp_path))
+    return svc, files_written
+
+
+@pytest.mark.integration
+@pytest.mark.performance
+class TestIngestionPerformance:
+    """
+    Ingest a production-sized corpus end to end, and fail when ingestion gets slower or
+    hungrier than the budgets below. Raise a budget only with a reason in the commit.
+    Budgets leave about 3x headroom over a run on a developer laptop (420 tests/s, 0.65MB
+    peak over 50 techniques), so that only real regressions trip them. They assume a run
+    without coverage tracing, so these checks only run with `-m performance`.
+    """
+
+    MIN_TESTS_PER_SECOND = 150
+    MAX_SECONDS = 15
+    # tracing allocations slows ingestion down ~5x, so memory is measured over the first 50 techniques
+    MEMORY_TECHNIQUES = 50
+    MAX_PEAK_MEMORY = 2 * 1024 * 1024
+
+    @staticmethod
+    def _expected_files(techniques):
+        # one ability per automated test, plus one payload per attachment
+        return techniques * 3 + techniques
+
+    @pytest.mark.asyncio
+    async def test_throughput(self, corpus, tmp_path):
+        start = time.perf_counter()
+        svc, files_written = await _ingest(corpus, tmp_path)
+        elapsed = time.perf_counter() - start
+
+        assert svc.progress['tests_total'] == TECHNIQUES * TESTS_PER_TECHNIQUE
+        assert svc.progress['tests_ingested'] == TECHNIQUES * 3
+        assert svc.progress['errors'] == 0
+        assert files_written == self._expected_files(TECHNIQUES)
+        assert elapsed < self.MAX_SECONDS
+        assert svc.progress['tests_total'] / elapsed > self.MIN_TESTS_PER_SECOND
+
+    @pytest.mark.asyncio
+    async def test_peak_memory(self, corpus, tmp_path):
+        path_yaml = os.path.join(corpus, 'atomics', 'T10[0-4]?', 'T*.yaml')
+        tracemalloc.start()
+        try:
+            svc, files_written = await _ingest(corpus, tmp_path, path_yaml)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        assert svc.progress['files_total'] == self.MEMORY_TECHNIQUES
+        assert files_written == self._expected_files(self.MEMORY_TECHNIQUES)
+        assert peak < self.MAX_PEAK_MEMORY
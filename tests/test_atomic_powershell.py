@@ -185,3 +185,40 @@ class TestParserLineMethod:
         parser = Parser()
         lines = list(parser.line('single'))
         assert lines == ['single']
+
+
+class TestParserChunkedScan:
+    """Tests for the windowed scan used on outputs larger than Parser.chunk_size."""
+
+    def test_small_blob_does_not_use_chunks(self):
+        parser = Parser()
+        parser._scan_chunks = lambda *args: pytest.fail('small blobs are scanned line by line')
+        assert parser.parse('0123') == []
+
+    def test_large_clean_blob(self):
+        parser = Parser()
+        parser.chunk_size = 8
+        assert parser.parse('0123456789\n' * 50) == []
+
+    def test_large_blob_with_flag(self):
+        parser = Parser()
+        parser.chunk_size = 8
+        from app.utility.base_parser import PARSER_SIGNALS_FAILURE
+        assert parser.parse('0123456789\n' * 50 + 'F') == [PARSER_SIGNALS_FAILURE]
+
+    def test_flag_split_across_chunk_boundary(self):
+        parser = Parser()
+        parser.checked_flags = ['FullyQualifiedErrorId']
+        parser.chunk_size = 16
+        from app.utility.base_parser import PARSER_SIGNALS_FAILURE
+        blob = 'x' * 10 + 'FullyQualifiedErrorId' + 'x' * 100
+        assert parser.parse(blob) == [PARSER_SIGNALS_FAILURE]
+
+    def test_chunked_scan_matches_line_scan(self):
+        parser = Parser()
+        parser.checked_flags = ['FullyQualifiedErrorId']
+        blob = ('ok line\n' * 20) + 'FullyQualified\nErrorId\n'
+        parser.chunk_size = 4
+        chunked = parser.parse(blob)
+        parser.chunk_size = len(blob)
+        assert chunked == parser.parse(blob) == []
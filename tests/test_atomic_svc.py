@@ -1,12 +1,22 @@
+import asyncio
 import hashlib
 import json
 import os
 import re
+import shelve
+import shutil
+import subprocess
+import sys
+import threading
+import tracemalloc
+import yaml
 import pytest
-from collections import defaultdict
+from collections import defaultdict, deque
 from unittest.mock import patch, MagicMock, AsyncMock, mock_open
 
-from app.atomic_svc import AtomicService, ExtractionError, PLATFORMS, EXECUTORS, RE_VARIABLE, PREFIX_HASH_LEN
+from app.atomic_fingerprint import compute_fingerprint
+from app.atomic_lock import FileLock
+from app.atomic_svc import AtomicService, ExtractionError, PLATFORMS, EXECUTORS, RE_VARIABLE, PREFIX_HASH_LEN, check_repo_url
 
 
 DUMMY_PAYLOAD_PATH = '/tmp/dummyatomicpayload'
@@ -14,6 +24,16 @@ DUMMY_PAYLOAD_CONTENT = 'Dummy payload content.'
 PREFIX_HASH_LENGTH = 6
 
 
+def _test(name, command='whoami'):
+    """A linux test running `command` with sh."""
+    return dict(name=name, description=name, supported_platforms=['linux'], executor=dict(name='sh', command=command))
+
+
+def _entries(*tests, technique='T1016'):
+    """A technique document holding `tests`."""
+    return dict(attack_technique=technique, display_name='Discovery', atomic_tests=list(tests))
+
+
 # ============================================================================
 # Module-level constants
 # ============================================================================
@@ -142,6 +162,59 @@ class TestHandleAttachment:
         name2 = atomic_svc._handle_attachment(path2)
         assert name1 != name2
 
+    def test_handle_attachment_dedupes_identical_content(self, atomic_svc, tmp_path):
+        atomic_svc.payloads_dir = str(tmp_path / 'payloads')
+        os.makedirs(atomic_svc.payloads_dir, exist_ok=True)
+        path1 = str(tmp_path / 'upstream.ps1')
+        path2 = str(tmp_path / 'fork.ps1')
+        for path in (path1, path2):
+            with open(path, 'w') as f:
+                f.write('same content')
+        assert atomic_svc._handle_attachment(path1) == atomic_svc._handle_attachment(path2)
+        assert len(os.listdir(atomic_svc.payloads_dir)) == 1
+
+    def test_handle_attachment_lazy_records_reference(self, atomic_svc, generate_dummy_payload, tmp_path):
+        atomic_svc.payloads_dir = str(tmp_path / 'payloads')
+        atomic_svc.payload_mode = 'lazy'
+        name = atomic_svc._handle_attachment(generate_dummy_payload)
+        assert not os.path.exists(atomic_svc.payloads_dir)
+        digest = hashlib.md5(DUMMY_PAYLOAD_CONTENT.encode()).hexdigest()
+        assert name == digest[:PREFIX_HASH_LENGTH] + '_dummyatomicpayload'
+        assert atomic_svc._payload_refs == {name: dict(source=generate_dummy_payload, digest=digest)}
+
+    @pytest.mark.asyncio
+    async def test_populate_saves_lazy_payload_references(self, atomic_svc, generate_dummy_payload, tmp_path):
+        atomic_svc.data_dir = str(tmp_path / 'data')
+        atomic_svc.payload_refs_path = str(tmp_path / 'data' / 'payload_refs.json')
+        atomic_svc.payload_mode = 'lazy'
+        atomic_svc.technique_to_tactics = {'T1016': ['discovery']}
+        os.makedirs(atomic_svc.data_dir)
+        with open(atomic_svc.payload_refs_path, 'w') as f:
+            json.dump({'old_tool.exe': dict(source='/old', digest='0')}, f)
+
+        async def save(entries, test, **kwargs):
+            atomic_svc._handle_attachment(generate_dummy_payload)
+            return True
+
+        with patch('glob.iglob', return_value=['T1016.yaml']), \
+             patch('app.atomic_svc.BaseWorld.strip_yml', return_value=[dict(atomic_tests=[dict(name='a')])]), \
+             patch.object(atomic_svc, '_save_ability', side_effect=save):
+            await atomic_svc.populate_data_directory()
+
+        with open(atomic_svc.payload_refs_path) as f:
+            refs = json.load(f)
+        assert sorted(refs) == sorted(['old_tool.exe', *atomic_svc._payload_refs])
+
+    @pytest.mark.asyncio
+    async def test_register_payloads(self, atomic_svc, tmp_path):
+        atomic_svc.payload_refs_path = str(tmp_path / 'payload_refs.json')
+        with open(atomic_svc.payload_refs_path, 'w') as f:
+            json.dump({'abc123_tool.exe': dict(source='/tool.exe', digest='abc123')}, f)
+        file_svc = MagicMock(add_special_payload=AsyncMock())
+        await atomic_svc.register_payloads(file_svc)
+        file_svc.add_special_payload.assert_awaited_once()
+        assert file_svc.add_special_payload.call_args[0][0] == 'abc123_tool.exe'
+
 
 # ============================================================================
 # Multiline command handling
@@ -513,6 +586,106 @@ class TestCatchPathToAtomicsFolder:
         assert payloads == []
 
 
+class TestDirectoryAttachments:
+    @pytest.fixture
+    def svc(self, atomic_svc, tmp_path):
+        atomic_svc.repo_dir = str(tmp_path / 'repo')
+        atomic_svc.payloads_dir = str(tmp_path / 'payloads')
+        src = tmp_path / 'repo' / 'atomics' / 'T1016' / 'src'
+        src.mkdir(parents=True)
+        (src / 'script.ps1').write_text('Get-Process')
+        return atomic_svc
+
+    def test_directory_is_archived(self, svc):
+        result, payloads = svc._catch_path_to_atomics_folder('$PathToAtomicsFolder/T1016/src --flag', 'linux')
+        [payload] = payloads
+        folder = svc._archives[payload]
+        assert payload == folder + '.tar.gz' and folder.endswith('_src')
+        assert result == folder + ' --flag'
+        assert os.listdir(svc.payloads_dir) == [payload]
+
+    def test_windows_directory_is_zipped(self, svc):
+        result, payloads = svc._catch_path_to_atomics_folder('PathToAtomicsFolder\\T1016\\src', 'windows')
+        assert payloads[0].endswith('_src.zip')
+        assert result == svc._archives[payloads[0]]
+
+    def test_archive_is_built_once(self, svc):
+        _, first = svc._catch_path_to_atomics_folder('$PathToAtomicsFolder/T1016/src', 'linux')
+        with patch('app.atomic_svc.build_archive') as build:
+            _, second = svc._catch_path_to_atomics_folder('$PathToAtomicsFolder/T1016/src', 'linux')
+            fresh = AtomicService()
+            fresh.repo_dir, fresh.payloads_dir = svc.repo_dir, svc.payloads_dir
+            _, third = fresh._catch_path_to_atomics_folder('$PathToAtomicsFolder/T1016/src', 'linux')
+        build.assert_not_called()
+        assert first == second == third
+
+    def test_ignore_mode(self, svc):
+        svc.directory_attachments = 'ignore'
+        cmd = '$PathToAtomicsFolder/T1016/src'
+        assert svc._catch_path_to_atomics_folder(cmd, 'linux') == (cmd, [])
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('platform, executor, unpack', [
+        ('linux', 'sh', 'tar -xzf "{}"'),
+        ('windows', 'psh', 'Expand-Archive -Force -Path "{}" -DestinationPath .'),
+        ('windows', 'cmd', 'tar -xf "{}"'),
+    ])
+    async def test_command_unpacks_archive_first(self, svc, platform, executor, unpack):
+        test = dict(name='t')
+        cmd, payloads = await svc._prepare_cmd(test, platform, executor, 'ls $PathToAtomicsFolder/T1016/src')
+        [payload] = payloads
+        separator = ' && ' if executor == 'cmd' else '; '
+        assert cmd == unpack.format(payload) + separator + 'ls ' + svc._archives[payload]
+
+
+class TestScriptPayloads:
+    LONG_COMMAND = '\n'.join(f'echo line {i}' for i in range(50))
+
+    @pytest.fixture
+    def svc(self, atomic_svc, tmp_path):
+        atomic_svc.payloads_dir = str(tmp_path / 'payloads')
+        atomic_svc.script_payloads = True
+        atomic_svc.script_payload_threshold = 100
+        return atomic_svc
+
+    def test_disabled_by_default(self, atomic_svc):
+        assert atomic_svc.script_payloads is False
+        assert atomic_svc.script_payload_threshold == 2048
+
+    @pytest.mark.asyncio
+    async def test_short_command_stays_inline(self, svc):
+        cmd, payloads = await svc._prepare_cmd(dict(name='t'), 'linux', 'sh', 'echo a\necho b')
+        assert (cmd, payloads) == ('echo a; echo b', [])
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('platform, executor, test_executor, launcher', [
+        ('linux', 'sh', 'sh', 'sh "{}"'),
+        ('linux', 'sh', 'bash', 'bash "{}"'),
+        ('windows', 'psh', 'powershell', 'powershell -ExecutionPolicy Bypass -NoProfile -File "{}"'),
+        ('linux', 'psh', 'powershell', 'pwsh -ExecutionPolicy Bypass -NoProfile -File "{}"'),
+        ('windows', 'cmd', 'command_prompt', 'cmd.exe /c "{}"'),
+    ])
+    async def test_long_command_becomes_script(self, svc, platform, executor, test_executor, launcher):
+        test = dict(name='t', executor=dict(name=test_executor))
+        cmd, [script] = await svc._prepare_cmd(test, platform, executor, self.LONG_COMMAND)
+        assert cmd == launcher.format(script)
+        assert script.startswith('atomic_') and script.endswith('.' + dict(sh='sh', psh='ps1', cmd='bat')[executor])
+        with open(os.path.join(svc.payloads_dir, script), newline='') as f:
+            body = f.read()
+        if executor == 'cmd':
+            assert body == '@echo off\r\n' + self.LONG_COMMAND.replace('\n', '\r\n')
+        else:
+            assert body == self.LONG_COMMAND
+
+    @pytest.mark.asyncio
+    async def test_identical_scripts_are_written_once(self, svc):
+        first = await svc._prepare_cmd(dict(name='a'), 'linux', 'sh', self.LONG_COMMAND)
+        with patch.object(svc, '_write_script') as write:
+            second = await svc._prepare_cmd(dict(name='b'), 'linux', 'sh', self.LONG_COMMAND)
+        write.assert_not_called()
+        assert first == second
+
+
 # ============================================================================
 # gen_single_match_tactic_technique (generator)
 # ============================================================================
@@ -612,6 +785,259 @@ class TestCloneAtomicRedTeamRepo:
             await atomic_svc.clone_atomic_red_team_repo()
             mock_call.assert_called_once()
 
+    @pytest.mark.asyncio
+    async def test_update_clones_when_missing(self, atomic_svc):
+        with patch('os.path.exists', return_value=False), \
+             patch('app.atomic_svc.check_call') as mock_call:
+            await atomic_svc.update_atomic_red_team_repo()
+            assert mock_call.call_args[0][0][:2] == ['git', 'clone']
+
+    @pytest.mark.asyncio
+    async def test_update_fetches_when_exists(self, atomic_svc):
+        with patch('os.path.exists', return_value=True), \
+             patch('os.listdir', return_value=['atomics']), \
+             patch('app.atomic_svc.check_call') as mock_call:
+            await atomic_svc.update_atomic_red_team_repo(repo_url='https://example.com/fork.git')
+            commands = [c[0][0] for c in mock_call.call_args_list]
+            assert commands == [
+                ['git', '-C', atomic_svc.repo_dir, 'fetch', '--depth', '1', '--', 'https://example.com/fork.git'],
+                ['git', '-C', atomic_svc.repo_dir, 'reset', '--hard', 'FETCH_HEAD'],
+            ]
+
+    @pytest.mark.asyncio
+    async def test_clone_checks_out_pinned_ref(self, atomic_svc):
+        atomic_svc.repo_ref = 'v1.0'
+        with patch('os.path.exists', return_value=False), \
+             patch('app.atomic_svc.check_call') as mock_call:
+            await atomic_svc.clone_atomic_red_team_repo()
+            commands = [c[0][0] for c in mock_call.call_args_list]
+            assert commands[1:] == [
+                ['git', '-C', atomic_svc.repo_dir, 'fetch', '--depth', '1', '--', 'origin', 'v1.0'],
+                ['git', '-C', atomic_svc.repo_dir, 'reset', '--hard', 'FETCH_HEAD'],
+            ]
+
+    @pytest.mark.asyncio
+    async def test_update_fetches_pinned_ref(self, atomic_svc):
+        atomic_svc.repo_ref = 'v1.0'
+        with patch('os.path.exists', return_value=True), \
+             patch('os.listdir', return_value=['atomics']), \
+             patch('app.atomic_svc.check_call') as mock_call:
+            await atomic_svc.update_atomic_red_team_repo()
+            assert mock_call.call_args_list[0][0][0] == ['git', '-C', atomic_svc.repo_dir, 'fetch', '--depth', '1', '--', 'origin', 'v1.0']
+
+
+class TestCheckRepoUrl:
+    @pytest.mark.parametrize('repo_url', ['https://github.com/redcanaryco/atomic-red-team.git', 'ssh://git@example.com/art.git',
+                                          'git@example.com:art.git', 'file:///srv/git/art.git', '/srv/git/art.git', 'C:\\git\\art'])
+    def test_accepts(self, repo_url):
+        check_repo_url(repo_url)
+
+    @pytest.mark.parametrize('repo_url', ['--upload-pack=touch /tmp/pwned', '-u', 'ext::sh -c touch% /tmp/pwned', 'fd::3',
+                                          'http://example.com/art.git', 'git://example.com/art.git', '', None])
+    def test_rejects(self, repo_url):
+        with pytest.raises(ValueError):
+            check_repo_url(repo_url)
+
+    @pytest.mark.asyncio
+    async def test_update_rejects_before_running_git(self, atomic_svc):
+        with patch('app.atomic_svc.check_call') as mock_call:
+            with pytest.raises(ValueError):
+                await atomic_svc.update_atomic_red_team_repo(repo_url='--upload-pack=touch /tmp/pwned')
+        mock_call.assert_not_called()
+
+
+def _git(*args, cwd=None):
+    return subprocess.run(['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com', *args], cwd=cwd,
+                          check=True, capture_output=True, text=True).stdout.strip()
+
+
+@pytest.mark.skipif(not shutil.which('git'), reason='git is not installed')
+class TestRepositoryMirror:
+    @pytest.fixture
+    def upstream(self, tmp_path):
+        """A local stand-in for the Atomic Red Team repository, with a tagged first commit."""
+        repo = str(tmp_path / 'upstream')
+        _git('init', '--quiet', '--initial-branch', 'master', repo)
+        self._commit(repo, 'first')
+        _git('tag', 'v1', cwd=repo)
+        self._commit(repo, 'second')
+        return repo
+
+    @staticmethod
+    def _commit(repo, content):
+        os.makedirs(os.path.join(repo, 'atomics', 'T1000'), exist_ok=True)
+        with open(os.path.join(repo, 'atomics', 'T1000', 'T1000.yaml'), 'w') as f:
+            f.write(content)
+        _git('add', '-A', cwd=repo)
+        _git('commit', '--quiet', '-m', content, cwd=repo)
+        return _git('rev-parse', 'HEAD', cwd=repo)
+
+    @pytest.fixture
+    def svc(self, atomic_svc, tmp_path):
+        atomic_svc.repo_dir = str(tmp_path / 'data' / 'atomic-red-team')
+        atomic_svc.repo_mirror = str(tmp_path / 'mirror' / 'atomic-red-team.git')
+        return atomic_svc
+
+    @staticmethod
+    def _checked_out(svc):
+        with open(os.path.join(svc.repo_dir, 'atomics', 'T1000', 'T1000.yaml')) as f:
+            return f.read()
+
+    @pytest.mark.asyncio
+    async def test_clone_through_mirror(self, svc, upstream):
+        await svc.clone_atomic_red_team_repo(upstream)
+        assert self._checked_out(svc) == 'second'
+        assert _git('--git-dir', svc.repo_mirror, 'rev-parse', 'HEAD') == _git('rev-parse', 'HEAD', cwd=upstream)
+        # the checkout borrows the mirror's objects instead of copying them
+        assert svc._shares_mirror_objects()
+        assert not os.listdir(os.path.join(svc.repo_dir, '.git', 'objects', 'pack'))
+
+    @pytest.mark.asyncio
+    async def test_pinned_ref(self, svc, upstream):
+        svc.repo_ref = 'v1'
+        await svc.clone_atomic_red_team_repo(upstream)
+        assert self._checked_out(svc) == 'first'
+
+    @pytest.mark.asyncio
+    async def test_update_fetches_into_mirror(self, svc, upstream):
+        await svc.clone_atomic_red_team_repo(upstream)
+        head = self._commit(upstream, 'third')
+        with open(os.path.join(svc.repo_dir, 'stray.txt'), 'w') as f:
+            f.write('left by a previous run')
+        await svc.update_atomic_red_team_repo()
+        assert self._checked_out(svc) == 'third'
+        assert not os.path.exists(os.path.join(svc.repo_dir, 'stray.txt'))
+        assert compute_fingerprint(svc.repo_dir, svc.atomic_dir)['source'] == 'git:' + head
+
+    @pytest.mark.asyncio
+    async def test_update_from_another_url(self, svc, upstream, tmp_path):
+        await svc.clone_atomic_red_team_repo(upstream)
+        fork = str(tmp_path / 'fork')
+        _git('clone', '--quiet', upstream, fork)
+        self._commit(fork, 'fork')
+        await svc.update_atomic_red_team_repo('file://' + fork)
+        assert self._checked_out(svc) == 'fork'
+
+    @pytest.mark.asyncio
+    async def test_replaces_checkout_made_without_mirror(self, svc, upstream):
+        _git('clone', '--quiet', upstream, svc.repo_dir)
+        svc.repo_ref = 'v1'
+        await svc.update_atomic_red_team_repo(upstream)
+        assert svc._shares_mirror_objects()
+        assert self._checked_out(svc) == 'first'
+
+    @pytest.mark.asyncio
+    async def test_unknown_ref(self, svc, upstream):
+        svc.repo_ref = 'no-such-ref'
+        with pytest.raises(subprocess.CalledProcessError):
+            await svc.clone_atomic_red_team_repo(upstream)
+
+    def test_mirror_given_as_file_url(self, tmp_path):
+        with patch.object(AtomicService, '_load_config', return_value=dict(repo_mirror='file:///srv/atomic%20red.git')):
+            assert AtomicService().repo_mirror == '/srv/atomic red.git'
+
+
+# ============================================================================
+# refresh_abilities
+# ============================================================================
+
+class TestRefreshAbilities:
+    @staticmethod
+    def _write_ability(atomic_svc, name):
+        d = os.path.join(atomic_svc.data_dir, 'abilities', 'discovery')
+        os.makedirs(d, exist_ok=True)
+        with open(os.path.join(d, name), 'w') as f:
+            f.write('---')
+
+    @pytest.mark.asyncio
+    async def test_refresh_swaps_in_new_abilities(self, atomic_svc, tmp_path):
+        atomic_svc.data_dir = str(tmp_path / 'data')
+        self._write_ability(atomic_svc, 'old.yml')
+
+        async def populate(sources=None):
+            assert atomic_svc.data_dir.endswith('.staging')
+            self._write_ability(atomic_svc, 'new.yml')
+
+        with patch.object(atomic_svc, 'update_atomic_red_team_repo', new_callable=AsyncMock), \
+             patch.object(atomic_svc, 'populate_data_directory', side_effect=populate):
+            await atomic_svc.refresh_abilities()
+
+        assert atomic_svc.data_dir == str(tmp_path / 'data')
+        assert os.listdir(os.path.join(atomic_svc.data_dir, 'abilities', 'discovery')) == ['new.yml']
+        assert sorted(os.listdir(atomic_svc.data_dir)) == ['abilities']
+
+    @pytest.mark.asyncio
+    async def test_refresh_failure_keeps_current_abilities(self, atomic_svc, tmp_path):
+        atomic_svc.data_dir = str(tmp_path / 'data')
+        self._write_ability(atomic_svc, 'old.yml')
+
+        async def populate(sources=None):
+            self._write_ability(atomic_svc, 'partial.yml')
+            raise RuntimeError('boom')
+
+        with patch.object(atomic_svc, 'update_atomic_red_team_repo', new_callable=AsyncMock), \
+             patch.object(atomic_svc, 'populate_data_directory', side_effect=populate):
+            with pytest.raises(RuntimeError):
+                await atomic_svc.refresh_abilities()
+
+        assert os.listdir(os.path.join(atomic_svc.data_dir, 'abilities', 'discovery')) == ['old.yml']
+        assert sorted(os.listdir(atomic_svc.data_dir)) == ['abilities']
+
+    @pytest.mark.asyncio
+    async def test_refresh_is_running_while_updating(self, atomic_svc, tmp_path):
+        atomic_svc.data_dir = str(tmp_path / 'data')
+        queue = atomic_svc.subscribe_progress()
+
+        async def update(repo_url):
+            # what a client opening the progress stream now gets
+            assert atomic_svc.progress['state'] == 'running'
+            assert atomic_svc.progress['phase'] == 'updating'
+
+        with patch.object(atomic_svc, 'update_atomic_red_team_repo', side_effect=update) as update_repo, \
+             patch.object(atomic_svc, '_populate_dict_techniques_tactics', new_callable=AsyncMock), \
+             patch('glob.iglob', return_value=[]):
+            await atomic_svc.refresh_abilities()
+
+        update_repo.assert_awaited_once()
+        events = []
+        while not queue.empty():
+            events.append(queue.get_nowait())
+        assert [(e['state'], e['phase']) for e in events] == [('idle', None), ('running', 'updating'), ('running', 'ingesting'),
+                                                              ('finished', 'ingesting')]
+
+    @pytest.mark.asyncio
+    async def test_refresh_publishes_update_failure(self, atomic_svc, tmp_path):
+        atomic_svc.data_dir = str(tmp_path / 'data')
+        with patch.object(atomic_svc, 'update_atomic_red_team_repo', new_callable=AsyncMock, side_effect=RuntimeError('clone failed')):
+            with pytest.raises(RuntimeError):
+                await atomic_svc.refresh_abilities()
+        assert atomic_svc.progress['state'] == 'failed'
+
+    @pytest.mark.asyncio
+    async def test_refresh_records_fingerprint(self, atomic_svc, tmp_path):
+        atomic_svc.data_dir = str(tmp_path / 'data')
+        fingerprint = dict(source='git:abc')
+
+        async def populate(sources=None):
+            self._write_ability(atomic_svc, 'new.yml')
+
+        with patch.object(atomic_svc, 'update_atomic_red_team_repo', new_callable=AsyncMock) as update, \
+             patch.object(atomic_svc, 'populate_data_directory', side_effect=populate), \
+             patch('app.atomic_svc.compute_fingerprint', return_value=fingerprint):
+            await atomic_svc.refresh_abilities(update=False)
+
+        update.assert_not_called()
+        with open(os.path.join(atomic_svc.data_dir, 'fingerprint.json')) as f:
+            assert json.load(f) == fingerprint
+
+    @pytest.mark.asyncio
+    async def test_refresh_without_fingerprint_of_unknown_checkout(self, atomic_svc, tmp_path):
+        atomic_svc.data_dir = str(tmp_path / 'data')
+        atomic_svc.repo_dir = str(tmp_path / 'missing')
+        with patch.object(atomic_svc, 'populate_data_directory', new_callable=AsyncMock):
+            await atomic_svc.refresh_abilities(update=False)
+        assert sorted(os.listdir(atomic_svc.data_dir)) == ['abilities']
+
 
 # ============================================================================
 # prepare_cmd
@@ -808,13 +1234,40 @@ class TestSaveAbility:
         result = await atomic_svc._save_ability(atomic_entries, test)
         assert result is True
 
-        import yaml
         ability_dir = os.path.join(atomic_svc.data_dir, 'abilities', 'discovery')
         files = os.listdir(ability_dir)
         with open(os.path.join(ability_dir, files[0]), 'r') as f:
             data = yaml.safe_load(f)
         assert 'parsers' in data[0]['platforms']['windows']['psh']
 
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('executor_name, executor, parser', [
+        ('sh', 'sh', 'plugins.atomic.app.parsers.atomic_sh'),
+        ('command_prompt', 'cmd', 'plugins.atomic.app.parsers.atomic_cmd'),
+    ])
+    async def test_save_ability_sh_cmd_have_parsers(self, atomic_svc, atomic_entries, tmp_path,
+                                                    executor_name, executor, parser):
+        atomic_svc.data_dir = str(tmp_path / 'data')
+        atomic_svc.technique_to_tactics = defaultdict(list, {'T1016': ['discovery']})
+        atomic_svc.repo_dir = str(tmp_path / 'repo')
+
+        test = {
+            'name': 'Shell Test',
+            'description': 'Shell test',
+            'supported_platforms': ['windows'],
+            'input_arguments': {},
+            'executor': {
+                'command': 'whoami',
+                'name': executor_name
+            }
+        }
+        assert await atomic_svc._save_ability(atomic_entries, test) is True
+
+        ability_dir = os.path.join(atomic_svc.data_dir, 'abilities', 'discovery')
+        with open(os.path.join(ability_dir, os.listdir(ability_dir)[0]), 'r') as f:
+            data = yaml.safe_load(f)
+        assert data[0]['platforms']['windows'][executor]['parsers'] == {parser: [{'source': 'validate_me'}]}
+
 
 # ============================================================================
 # populate_data_directory
@@ -836,6 +1289,673 @@ class TestPopulateDataDirectory:
             await atomic_svc.populate_data_directory()
             mock_pop.assert_not_called()
 
+    @pytest.mark.asyncio
+    async def test_populate_publishes_progress(self, atomic_svc):
+        atomic_svc.technique_to_tactics = {'T1016': ['discovery']}
+        entries = {'attack_technique': 'T1016', 'atomic_tests': [{'name': 'a'}, {'name': 'b'}]}
+        queue = atomic_svc.subscribe_progress()
+        with patch('glob.iglob', return_value=['T1016.yaml', 'T1059.yaml']), \
+             patch('app.atomic_svc.BaseWorld.strip_yml', return_value=[entries]), \
+             patch.object(atomic_svc, '_save_ability', new_callable=AsyncMock, side_effect=[True, False, True, Exception]):
+            await atomic_svc.populate_data_directory()
+
+        events = []
+        while not queue.empty():
+            events.append(queue.get_nowait())
+        assert [e['state'] for e in events] == ['idle', 'running', 'running', 'running', 'finished']
+        assert [e['files_done'] for e in events[1:]] == [0, 1, 2, 2]
+        assert events[-1] == dict(state='finished', phase='ingesting', files_done=2, files_total=2, tests_total=4,
+                                  tests_ingested=2, errors=1, eta=0)
+        assert atomic_svc.progress == events[-1]
+
+    @pytest.mark.asyncio
+    async def test_populate_publishes_failure(self, atomic_svc):
+        atomic_svc.technique_to_tactics = {'T1016': ['discovery']}
+        with patch('glob.iglob', return_value=['T1016.yaml']), \
+             patch('app.atomic_svc.BaseWorld.strip_yml', side_effect=OSError):
+            with pytest.raises(OSError):
+                await atomic_svc.populate_data_directory()
+        assert atomic_svc.progress['state'] == 'failed'
+
+    @pytest.mark.asyncio
+    async def test_populate_publishes_cancellation(self, atomic_svc):
+        atomic_svc.technique_to_tactics = {'T1016': ['discovery']}
+        with patch('glob.iglob', return_value=['T1016.yaml']), \
+             patch('app.atomic_svc.BaseWorld.strip_yml', side_effect=asyncio.CancelledError):
+            with pytest.raises(asyncio.CancelledError):
+                await atomic_svc.populate_data_directory()
+        assert atomic_svc.progress['state'] == 'cancelled'
+
+    def test_unsubscribe_progress(self, atomic_svc):
+        queue = atomic_svc.subscribe_progress()
+        atomic_svc.unsubscribe_progress(queue)
+        atomic_svc._publish_progress(state='running')
+        assert queue.qsize() == 1
+
+
+# ============================================================================
+# multi-source ingestion
+# ============================================================================
+
+class TestMultiSourceIngestion:
+    @staticmethod
+    def _make_source(root, tests, attachment=None):
+        technique_dir = root / 'atomics' / 'T1016'
+        (technique_dir / 'src').mkdir(parents=True)
+        if attachment:
+            (technique_dir / 'src' / attachment).write_text('shared script')
+        doc = dict(attack_technique='T1016', display_name='Discovery', atomic_tests=tests)
+        (technique_dir / 'T1016.yaml').write_text(yaml.dump(doc))
+        return dict(repo_dir=str(root))
+
+    @pytest.fixture
+    def svc(self, ingestion_svc, tmp_path):
+        ingestion_svc.payloads_dir = str(tmp_path / 'payloads')
+        os.makedirs(ingestion_svc.payloads_dir)
+        return ingestion_svc
+
+    @pytest.mark.asyncio
+    async def test_sources_are_merged_and_deduplicated(self, svc, tmp_path):
+        shared = _test('shared')
+        upstream = self._make_source(tmp_path / 'upstream', [shared, _test('upstream only', 'sh $PathToAtomicsFolder/T1016/src/a.sh')],
+                                     attachment='a.sh')
+        fork = self._make_source(tmp_path / 'fork', [shared, _test('fork only', 'sh $PathToAtomicsFolder/T1016/src/b.sh')],
+                                 attachment='b.sh')
+
+        def strip_yml(path):
+            with open(path) as f:
+                return list(yaml.safe_load_all(f))
+
+        with patch('app.atomic_svc.BaseWorld.strip_yml', side_effect=strip_yml):
+            await svc.populate_data_directory(sources=[fork, upstream])
+
+        abilities = os.listdir(os.path.join(svc.data_dir, 'abilities', 'discovery'))
+        assert len(abilities) == 3
+        assert svc.progress['tests_total'] == 4
+        assert svc.progress['tests_ingested'] == 3
+        assert svc.progress['files_total'] == 2
+        # a.sh and b.sh have the same content
+        assert len(os.listdir(svc.payloads_dir)) == 1
+
+    @pytest.mark.asyncio
+    async def test_populate_uses_first_source_for_tactics(self, atomic_svc):
+        with patch.object(atomic_svc, '_populate_dict_techniques_tactics', new_callable=AsyncMock) as mock_pop, \
+             patch('glob.iglob', return_value=[]):
+            await atomic_svc.populate_data_directory(sources=[dict(repo_dir='fork'), dict(repo_dir='upstream')])
+            mock_pop.assert_called_once_with('fork')
+
+    @pytest.mark.asyncio
+    async def test_higher_precedence_source_wins(self, svc):
+        test = _test('shared')
+        assert await svc._save_ability({'attack_technique': 'T1016', 'display_name': 'D'}, test, rank=1) is True
+        # the higher precedence source overwrites, without counting a new ability
+        assert await svc._save_ability({'attack_technique': 'T1059', 'display_name': 'E'}, test, rank=0) is False
+        assert await svc._save_ability({'attack_technique': 'T1016', 'display_name': 'D'}, test, rank=1) is False
+
+        files = [os.path.join(d, f) for d, _, fs in os.walk(os.path.join(svc.data_dir, 'abilities')) for f in fs]
+        assert len(files) == 1
+        assert os.path.basename(os.path.dirname(files[0])) == 'redcanary-unknown'
+
+
+# ============================================================================
+# ingestion filters
+# ============================================================================
+
+class TestIngestionFilters:
+    def test_no_filters_by_default(self, atomic_svc):
+        assert atomic_svc.filters == dict()
+        assert atomic_svc._passes_filters('platforms', ['darwin'])
+
+    def test_load_config(self, tmp_path):
+        conf = tmp_path / 'default.yml'
+        conf.write_text('ingestion_filters:\n  include:\n    executors: [psh, sh]\n')
+        assert AtomicService._load_config(str(conf)) == {'ingestion_filters': {'include': {'executors': ['psh', 'sh']}}}
+        assert AtomicService._load_config(str(tmp_path / 'missing.yml')) == dict()
+
+    def test_plugin_config_accepts_everything(self):
+        conf = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'conf', 'default.yml')
+        svc = AtomicService()
+        svc.filters = AtomicService._load_config(conf)['ingestion_filters']
+        assert svc.filters['include']['platforms'] == []
+        for kind, values in (('platforms', ['darwin']), ('executors', ['cmd']), ('techniques', ['T1016']),
+                             ('tactics', ['discovery'])):
+            assert svc._passes_filters(kind, values)
+
+    def test_include_and_exclude(self, atomic_svc):
+        atomic_svc.filters = dict(include=dict(platforms=['windows', 'linux']), exclude=dict(platforms=['linux']))
+        assert atomic_svc._passes_filters('platforms', ['windows'])
+        assert not atomic_svc._passes_filters('platforms', ['linux'])
+        assert not atomic_svc._passes_filters('platforms', ['darwin'])
+
+    def test_techniques_match_sub_techniques(self, atomic_svc):
+        atomic_svc.filters = dict(include=dict(techniques=['T1016']), exclude=dict(techniques=['T1016.002']))
+        assert atomic_svc._passes_filters('techniques', ['T1016'])
+        assert atomic_svc._passes_filters('techniques', ['T1016.001'])
+        assert not atomic_svc._passes_filters('techniques', ['T1016.002'])
+        assert not atomic_svc._passes_filters('techniques', ['T10160'])
+
+    def test_technique_file_wanted_uses_tactics(self, atomic_svc):
+        atomic_svc.technique_to_tactics = defaultdict(list, {'T1059': ['execution', 'persistence']})
+        atomic_svc.filters = dict(exclude=dict(tactics=['execution']))
+        assert atomic_svc._technique_file_wanted('atomics/T1059/T1059.yaml')
+        atomic_svc.filters = dict(include=dict(tactics=['discovery']))
+        assert not atomic_svc._technique_file_wanted('atomics/T1059/T1059.yaml')
+        assert not atomic_svc._technique_file_wanted('atomics/T9999/T9999.yaml')
+
+    @pytest.mark.asyncio
+    async def test_filtered_files_are_never_parsed(self, atomic_svc):
+        atomic_svc.technique_to_tactics = defaultdict(list, {'T1016': ['discovery']})
+        with patch('glob.iglob', return_value=['atomics/T1016/T1016.yaml', 'atomics/T1059/T1059.yaml']), \
+             patch('app.atomic_svc.BaseWorld.strip_yml', return_value=[]) as mock_strip:
+            await atomic_svc.populate_data_directory(filters=dict(exclude=dict(techniques=['T1059'])))
+        mock_strip.assert_called_once_with('atomics/T1016/T1016.yaml')
+        assert atomic_svc.progress['files_total'] == 1
+
+    @pytest.mark.asyncio
+    async def test_save_ability_filters_platforms_and_executors(self, atomic_svc, atomic_entries, tmp_path):
+        atomic_svc.data_dir = str(tmp_path / 'data')
+        atomic_svc.technique_to_tactics = defaultdict(list, {'T1016': ['discovery']})
+        test = {
+            'name': 'Cross platform',
+            'description': 'Cross platform test',
+            'supported_platforms': ['linux', 'macos'],
+            'executor': {'command': 'whoami', 'name': 'sh'}
+        }
+        atomic_svc.filters = dict(exclude=dict(executors=['sh']))
+        assert await atomic_svc._save_ability(atomic_entries, test) is False
+
+        atomic_svc.filters = dict(exclude=dict(platforms=['darwin']))
+        with patch.object(atomic_svc, '_prepare_executor', wraps=atomic_svc._prepare_executor) as mock_prepare:
+            assert await atomic_svc._save_ability(atomic_entries, test) is True
+        assert [c.args[1] for c in mock_prepare.call_args_list] == ['linux']
+
+        atomic_svc.filters = dict(include=dict(platforms=['windows']))
+        assert await atomic_svc._save_ability(dict(atomic_entries, display_name='other'), dict(test, name='x')) is False
+
+
+# ============================================================================
+# duplicate abilities
+# ============================================================================
+
+class TestDuplicateAbilities:
+    @staticmethod
+    def _saved(ingestion_svc):
+        d = os.path.join(ingestion_svc.data_dir, 'abilities', 'discovery')
+        saved = []
+        for name in sorted(os.listdir(d)):
+            with open(os.path.join(d, name)) as f:
+                saved.append(yaml.safe_load(f)[0])
+        return saved
+
+    def test_default_mode_is_report(self, atomic_svc):
+        assert atomic_svc.duplicates_mode == 'report'
+
+    @pytest.mark.asyncio
+    async def test_report_mode_saves_and_records(self, ingestion_svc, atomic_entries):
+        assert await ingestion_svc._save_ability(atomic_entries, _test('first'))
+        assert await ingestion_svc._save_ability(atomic_entries, _test('second'))
+        assert await ingestion_svc._save_ability(atomic_entries, _test('other', 'hostname'))
+        assert len(self._saved(ingestion_svc)) == 3
+        assert [d['name'] for d in ingestion_svc.duplicates] == ['second']
+
+    @pytest.mark.asyncio
+    async def test_collapse_mode_merges_descriptions(self, ingestion_svc, atomic_entries):
+        ingestion_svc.duplicates_mode = 'collapse'
+        assert await ingestion_svc._save_ability(atomic_entries, _test('first'))
+        assert await ingestion_svc._save_ability(atomic_entries, _test('second')) is False
+        saved = self._saved(ingestion_svc)
+        assert len(saved) == 1
+        assert saved[0]['name'] == 'first'
+        assert saved[0]['description'] == 'first\n\nAlso covers "second": second'
+        assert ingestion_svc.duplicates[0]['kept'] == saved[0]['id']
+
+    @pytest.mark.asyncio
+    async def test_off_mode_ignores_duplicates(self, ingestion_svc, atomic_entries):
+        ingestion_svc.duplicates_mode = 'off'
+        assert await ingestion_svc._save_ability(atomic_entries, _test('first'))
+        assert await ingestion_svc._save_ability(atomic_entries, _test('second'))
+        assert ingestion_svc.duplicates == []
+        assert ingestion_svc._content_index == dict()
+
+    @pytest.mark.asyncio
+    async def test_same_ability_is_not_its_own_duplicate(self, ingestion_svc, atomic_entries):
+        test = _test('first')
+        await ingestion_svc._save_ability(atomic_entries, test)
+        await ingestion_svc._save_ability(atomic_entries, test)
+        assert ingestion_svc.duplicates == []
+
+
+# ============================================================================
+# bundle output
+# ============================================================================
+
+class TestBundleOutput:
+    @pytest.fixture
+    def svc(self, ingestion_svc):
+        ingestion_svc.output_format = 'bundle'
+        return ingestion_svc
+
+    def test_default_output_format(self, atomic_svc):
+        assert atomic_svc.output_format == 'files'
+
+    @pytest.mark.asyncio
+    async def test_populate_writes_single_bundle(self, svc):
+        entries = _entries(_test('first'), _test('second', 'hostname'))
+        with patch('glob.iglob', return_value=['T1016.yaml']), \
+             patch('app.atomic_svc.BaseWorld.strip_yml', return_value=[entries]):
+            await svc.populate_data_directory()
+
+        assert os.listdir(os.path.join(svc.data_dir, 'abilities')) == ['atomic-bundle.yml']
+        with open(svc._bundle_path()) as f:
+            abilities = yaml.safe_load(f)
+        assert sorted(a['name'] for a in abilities) == ['first', 'second']
+        assert {a['id'] for a in abilities} == svc.ingested_ability_ids
+        assert svc._bundle == dict()
+
+    @pytest.mark.asyncio
+    async def test_bundle_supports_collapse_and_overwrite(self, svc, atomic_entries):
+        svc.duplicates_mode = 'collapse'
+        await svc._save_ability(atomic_entries, _test('first'))
+        await svc._save_ability(atomic_entries, _test('second'))
+        moved = _test('moved', 'hostname')
+        await svc._save_ability(atomic_entries, moved, rank=1)
+        await svc._save_ability(dict(atomic_entries, attack_technique='T9999'), moved, rank=0)
+        assert len(svc._bundle) == 2
+        assert [d['description'] for d in svc._bundle.values()] == ['first\n\nAlso covers "second": second', 'moved']
+        assert not os.path.exists(os.path.join(svc.data_dir, 'abilities'))
+
+    @pytest.mark.asyncio
+    async def test_load_abilities_bundle(self, svc):
+        data_svc = MagicMock(load_ability_file=AsyncMock())
+        await svc.load_abilities(data_svc)
+        data_svc.load_ability_file.assert_called_once_with(svc._bundle_path(), 'red')
+
+    @pytest.mark.asyncio
+    async def test_load_abilities_files(self, ingestion_svc, atomic_entries):
+        await ingestion_svc._save_ability(atomic_entries, _test('first'))
+        await ingestion_svc._save_ability(atomic_entries, _test('second', 'hostname'))
+        data_svc = MagicMock(load_ability_file=AsyncMock())
+        await ingestion_svc.load_abilities(data_svc)
+        assert data_svc.load_ability_file.call_count == 2
+
+
+class TestMemoryBoundedIngestion:
+    @pytest.fixture
+    def svc(self, ingestion_svc):
+        ingestion_svc.technique_to_tactics['T1059'] = ['execution']
+        ingestion_svc.memory_bounded = True
+        ingestion_svc.max_documents_in_flight = 1
+        return ingestion_svc
+
+    def test_defaults(self, atomic_svc):
+        assert atomic_svc.memory_bounded is False
+        assert atomic_svc.max_documents_in_flight == 2
+
+    @pytest.mark.asyncio
+    async def test_documents_in_flight_are_capped(self, svc):
+        in_flight, peak = 0, 0
+        original = svc._save_ability
+
+        async def save(*args, **kwargs):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0)
+            in_flight -= 1
+            return await original(*args, **kwargs)
+
+        sources = [dict(repo_dir='first', path_yaml='first/*.yaml'), dict(repo_dir='second', path_yaml='second/*.yaml')]
+        with patch('glob.iglob', side_effect=lambda path: [path.replace('*', 'T1016')]), \
+             patch('app.atomic_svc.BaseWorld.strip_yml', side_effect=lambda f: [_entries(_test('T1016'))]), \
+             patch.object(svc, '_save_ability', side_effect=save):
+            await svc.populate_data_directory(sources=sources)
+        assert peak == 1
+
+    @pytest.mark.asyncio
+    @pytest.mark.skipif(sys.platform == 'win32', reason='resource is not available on Windows')
+    async def test_report_records_peak_memory(self, svc):
+        with patch('glob.iglob', return_value=['T1016.yaml']), \
+             patch('app.atomic_svc.BaseWorld.strip_yml', return_value=[_entries(_test('T1016'))]), \
+             patch('tracemalloc.start') as start_tracing:
+            await svc.populate_data_directory()
+        assert svc.ingestion_report['tests_ingested'] == 1
+        # the resident memory of the process, far above what the test allocates
+        assert svc.ingestion_report['peak_memory'] > 1024 * 1024
+        # tracemalloc slows everything down, it is only started by memory_profile
+        start_tracing.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_report_without_resource_module(self, svc):
+        with patch('app.atomic_svc.resource', None), \
+             patch('glob.iglob', return_value=['T1016.yaml']), \
+             patch('app.atomic_svc.BaseWorld.strip_yml', return_value=[_entries(_test('T1016'))]):
+            await svc.populate_data_directory()
+        assert svc.ingestion_report['tests_ingested'] == 1
+        assert 'peak_memory' not in svc.ingestion_report
+
+    @pytest.mark.asyncio
+    async def test_report_without_memory_bound(self, svc):
+        svc.memory_bounded = False
+        with patch('glob.iglob', return_value=['T1016.yaml']), \
+             patch('app.atomic_svc.BaseWorld.strip_yml', return_value=[_entries(_test('T1016'))]):
+            await svc.populate_data_directory()
+        assert svc.ingestion_report['tests_ingested'] == 1
+        assert 'peak_memory' not in svc.ingestion_report
+
+    @pytest.mark.asyncio
+    async def test_bundle_is_built_on_disk(self, svc):
+        svc.output_format = 'bundle'
+        stores = []
+        original = svc._open_bundle_store
+
+        def open_store():
+            stores.append(original())
+            return stores[-1]
+
+        with patch('glob.iglob', return_value=['T1016.yaml', 'T1059.yaml']), \
+             patch('app.atomic_svc.BaseWorld.strip_yml', side_effect=[[_entries(_test('T1016'))], [_entries(_test('T1059'), technique='T1059')]]), \
+             patch.object(svc, '_open_bundle_store', side_effect=open_store):
+            await svc.populate_data_directory()
+
+        assert isinstance(stores[0], shelve.Shelf)
+        assert not os.path.exists(svc._bundle_dir)
+        with open(svc._bundle_path()) as f:
+            abilities = yaml.safe_load(f)
+        assert sorted(a['name'] for a in abilities) == ['T1016', 'T1059']
+        assert svc._bundle == dict()
+
+
+class TestMemoryProfile:
+    @pytest.mark.asyncio
+    async def test_report_attributes_memory_to_phases(self, atomic_svc, tmp_path):
+        atomic_svc.data_dir = str(tmp_path / 'data')
+        atomic_svc.memory_profile = True
+        entries = dict(attack_technique='T1016', display_name='Discovery',
+                       atomic_tests=[dict(name='a', description='a', supported_platforms=['linux'],
+                                          executor=dict(name='sh', command='whoami'))])
+        with patch.object(atomic_svc, '_populate_dict_techniques_tactics', new_callable=AsyncMock), \
+             patch('glob.iglob', return_value=['T1016.yaml', 'T1059.yaml']), \
+             patch('app.atomic_svc.BaseWorld.strip_yml', return_value=[entries]):
+            await atomic_svc.populate_data_directory()
+
+        profile = atomic_svc.ingestion_report['memory_profile']
+        assert [p['phase'] for p in profile['phases']] == ['tactics', 'ingestion', 'write']
+        assert sorted(f['file'] for f in profile['top_files']) == ['T1016.yaml', 'T1059.yaml']
+        assert atomic_svc._memory_profile is None
+        assert not tracemalloc.is_tracing()
+
+    @pytest.mark.asyncio
+    async def test_disabled_by_default(self, atomic_svc):
+        with patch('glob.iglob', return_value=[]):
+            atomic_svc.technique_to_tactics = {'T1016': ['discovery']}
+            await atomic_svc.populate_data_directory()
+        assert 'memory_profile' not in atomic_svc.ingestion_report
+
+
+class TestIngestionPipeline:
+    def test_default_queue_size(self, atomic_svc):
+        assert atomic_svc.pipeline_queue_size == 8
+
+    @pytest.mark.asyncio
+    async def test_files_are_loaded_and_written_off_the_event_loop(self, ingestion_svc):
+        threads = []
+
+        def strip_yml(filename):
+            threads.append(threading.current_thread())
+            return [_entries(_test('first'))]
+
+        original = ingestion_svc._dump_ability
+
+        def dump(*args):
+            threads.append(threading.current_thread())
+            original(*args)
+
+        with patch('glob.iglob', return_value=['T1016.yaml']), \
+             patch('app.atomic_svc.BaseWorld.strip_yml', side_effect=strip_yml), \
+             patch.object(ingestion_svc, '_dump_ability', side_effect=dump):
+            await ingestion_svc.populate_data_directory()
+
+        assert len(threads) == 2
+        assert threading.main_thread() not in threads
+        assert len(os.listdir(os.path.join(ingestion_svc.data_dir, 'abilities', 'discovery'))) == 1
+        assert ingestion_svc._write_buffer is None
+        assert ingestion_svc._pending_writes == dict()
+
+    @pytest.mark.asyncio
+    async def test_loading_overlaps_compiling(self, ingestion_svc):
+        loop = asyncio.get_running_loop()
+        next_file_loaded = asyncio.Event()
+
+        def strip_yml(filename):
+            if filename == 'T1016.001.yaml':
+                loop.call_soon_threadsafe(next_file_loaded.set)
+            return [_entries(_test(filename))]
+
+        original = ingestion_svc._save_ability
+        overlapped = []
+
+        async def save(entries, test, **kwargs):
+            if test['name'] == 'T1016.yaml':
+                # the first file is still being compiled when the next one is loaded
+                await asyncio.wait_for(next_file_loaded.wait(), 5)
+                overlapped.append(test['name'])
+            return await original(entries, test, **kwargs)
+
+        with patch('glob.iglob', return_value=['T1016.yaml', 'T1016.001.yaml']), \
+             patch('app.atomic_svc.BaseWorld.strip_yml', side_effect=strip_yml), \
+             patch.object(ingestion_svc, '_save_ability', side_effect=save):
+            await ingestion_svc.populate_data_directory()
+
+        assert overlapped == ['T1016.yaml']
+        assert ingestion_svc.ingestion_report['errors'] == 0
+        assert ingestion_svc.ingestion_report['tests_ingested'] == 2
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('memory_bounded', [False, True])
+    async def test_technique_without_tests_is_skipped(self, ingestion_svc, memory_bounded):
+        ingestion_svc.memory_bounded = memory_bounded
+        with patch('glob.iglob', return_value=['T1000.yaml', 'T1016.yaml']), \
+             patch('app.atomic_svc.BaseWorld.strip_yml', side_effect=[[_entries(technique='T1000')], [_entries(_test('first'))]]):
+            await ingestion_svc.populate_data_directory()
+        assert ingestion_svc.ingestion_report['tests_ingested'] == 1
+        assert ingestion_svc.ingestion_report['files_done'] == 2
+        assert ingestion_svc.progress['state'] == 'finished'
+
+    @pytest.mark.asyncio
+    async def test_collapse_sees_pending_writes(self, ingestion_svc):
+        ingestion_svc.duplicates_mode = 'collapse'
+        ingestion_svc.pipeline_queue_size = 1
+        with patch('glob.iglob', return_value=['T1016.yaml', 'T1016.001.yaml']), \
+             patch('app.atomic_svc.BaseWorld.strip_yml', side_effect=[[_entries(_test('first'))], [_entries(_test('second'))]]):
+            await ingestion_svc.populate_data_directory()
+
+        [filename] = os.listdir(os.path.join(ingestion_svc.data_dir, 'abilities', 'discovery'))
+        with open(os.path.join(ingestion_svc.data_dir, 'abilities', 'discovery', filename)) as f:
+            [ability] = yaml.safe_load(f)
+        assert ability['description'] == 'first\n\nAlso covers "second": second'
+
+    def test_read_ability_returns_pending_copy(self, ingestion_svc):
+        ingestion_svc._write_buffer = deque()
+        file_path = os.path.join(ingestion_svc.data_dir, 'abilities', 'discovery', 'a.yml')
+        data = dict(id='a', description='a')
+        ingestion_svc._write_ability(file_path, data)
+        assert not os.path.exists(file_path)
+        assert len(ingestion_svc._write_buffer) == 1
+        pending = ingestion_svc._read_ability(file_path)
+        assert pending == data and pending is not data
+
+    @pytest.mark.asyncio
+    async def test_failing_stage_cancels_the_others(self):
+        waiting = asyncio.Event()
+
+        async def fail():
+            raise OSError
+
+        with pytest.raises(OSError):
+            await AtomicService._run_stages(waiting.wait(), fail())
+
+    @pytest.mark.asyncio
+    async def test_load_failure_stops_the_pipeline(self, ingestion_svc):
+        with patch('glob.iglob', return_value=['T1016.yaml', 'T1016.001.yaml']), \
+             patch('app.atomic_svc.BaseWorld.strip_yml', side_effect=[[_entries(_test('first'))], OSError]):
+            with pytest.raises(OSError):
+                await ingestion_svc.populate_data_directory()
+        assert ingestion_svc.progress['state'] == 'failed'
+        assert ingestion_svc._write_buffer is None
+
+
+class TestQuarantine:
+    async def _populate(self, ingestion_svc, entries):
+        with patch('glob.iglob', return_value=['T1016.yaml']), \
+             patch('app.atomic_svc.BaseWorld.strip_yml', return_value=[entries]):
+            await ingestion_svc.populate_data_directory()
+
+    @pytest.mark.asyncio
+    async def test_failing_test_is_quarantined(self, ingestion_svc):
+        bad = dict(_test('bad'), executor=dict(name='sh'))  # no command
+        await self._populate(ingestion_svc, _entries(_test('good'), bad))
+
+        assert ingestion_svc.progress['errors'] == 1
+        [entry] = ingestion_svc.quarantine_report()
+        assert entry == dict(digest=ingestion_svc._test_digest(bad), name='bad', technique='T1016', error='KeyError',
+                             reason="'command'")
+        assert os.path.isfile(ingestion_svc.quarantine_path)
+
+    @pytest.mark.asyncio
+    async def test_quarantined_test_is_skipped_on_rerun(self, ingestion_svc):
+        bad = dict(_test('bad'), executor=dict(name='sh'))
+        await self._populate(ingestion_svc, _entries(bad))
+
+        rerun = AtomicService()
+        rerun.data_dir, rerun.quarantine_path = ingestion_svc.data_dir, ingestion_svc.quarantine_path
+        rerun.technique_to_tactics = ingestion_svc.technique_to_tactics
+        with patch.object(rerun, '_save_ability', new_callable=AsyncMock) as save:
+            await self._populate(rerun, _entries(bad))
+        save.assert_not_called()
+        assert rerun.progress['errors'] == 0
+        assert rerun.ingestion_report['quarantined'] == 1
+        assert len(rerun.quarantine_report()) == 1
+
+    @pytest.mark.asyncio
+    async def test_changed_test_leaves_quarantine(self, ingestion_svc):
+        bad = dict(_test('bad'), executor=dict(name='sh'))
+        await self._populate(ingestion_svc, _entries(bad))
+        await self._populate(ingestion_svc, _entries(_test('bad', 'hostname')))
+
+        assert ingestion_svc.progress['tests_ingested'] == 1
+        assert ingestion_svc.quarantine_report() == []
+        with open(ingestion_svc.quarantine_path) as f:
+            assert yaml.safe_load(f) == dict()
+
+    @pytest.mark.asyncio
+    async def test_plugin_change_retries_quarantined_test(self, ingestion_svc):
+        bad = dict(_test('bad'), executor=dict(name='sh'))
+        await self._populate(ingestion_svc, _entries(bad))
+        [old_key] = ingestion_svc.quarantine
+
+        # eg. a new transformer version, which may now convert the test
+        with patch('app.atomic_svc.transformer_digest', return_value='upgraded'), \
+             patch.object(ingestion_svc, '_save_ability', new_callable=AsyncMock, return_value=True) as save:
+            await self._populate(ingestion_svc, _entries(bad))
+        save.assert_awaited_once()
+        assert ingestion_svc.progress['tests_ingested'] == 1
+        assert old_key not in ingestion_svc._load_quarantine()
+
+    @pytest.mark.asyncio
+    async def test_quarantine_disabled(self, ingestion_svc):
+        ingestion_svc.quarantine_enabled = False
+        await self._populate(ingestion_svc, _entries(dict(_test('bad'), executor=dict(name='sh'))))
+        assert ingestion_svc.progress['errors'] == 1
+        assert ingestion_svc.quarantine == dict()
+        assert not os.path.exists(ingestion_svc.quarantine_path)
+
+    @pytest.mark.asyncio
+    async def test_quarantine_kept_when_ingestion_fails(self, ingestion_svc):
+        ingestion_svc.quarantine = {'abc': dict(name='old', technique='T1016', error='KeyError', reason='x')}
+        ingestion_svc._save_quarantine()
+        with patch('glob.iglob', return_value=['T1016.yaml']), \
+             patch('app.atomic_svc.BaseWorld.strip_yml', side_effect=OSError):
+            with pytest.raises(OSError):
+                await ingestion_svc.populate_data_directory()
+        assert set(ingestion_svc._load_quarantine()) == {'abc'}
+
+
+class TestRunExclusive:
+    @pytest.fixture
+    def svc(self, atomic_svc, tmp_path):
+        atomic_svc.lock_path = str(tmp_path / 'data' / '.ingestion.lock')
+        return atomic_svc
+
+    @staticmethod
+    def _hold(svc):
+        holder = FileLock(svc.lock_path)
+        assert holder.try_acquire()
+        return holder
+
+    @pytest.mark.asyncio
+    async def test_runs_holding_the_lock(self, svc):
+        async def ingest():
+            assert not FileLock(svc.lock_path).try_acquire()
+
+        assert await svc.run_exclusive(ingest)
+        assert not os.path.exists(svc.lock_path)
+
+    @pytest.mark.asyncio
+    async def test_lock_released_on_failure(self, svc):
+        with pytest.raises(RuntimeError):
+            await svc.run_exclusive(AsyncMock(side_effect=RuntimeError))
+        assert not os.path.exists(svc.lock_path)
+
+    @pytest.mark.asyncio
+    async def test_nothing_needed(self, svc):
+        ingest = AsyncMock()
+        assert not await svc.run_exclusive(ingest, needed=lambda: False)
+        ingest.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_waits_for_another_process(self, svc):
+        holder = self._hold(svc)
+        done = []
+        ingest = AsyncMock()
+
+        async def other_process():
+            await asyncio.sleep(0.05)
+            done.append(True)
+            holder.release()
+
+        with patch('app.atomic_svc.FileLock', lambda path, stale_after: FileLock(path, stale_after, poll_interval=0.01)):
+            results = await asyncio.gather(svc.run_exclusive(ingest, needed=lambda: not done), other_process())
+        # the other process did the work while this one waited
+        assert results[0] is False
+        ingest.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_runs_after_another_process_failed(self, svc):
+        holder = self._hold(svc)
+        ingest = AsyncMock()
+        asyncio.get_running_loop().call_later(0.05, holder.release)
+        with patch('app.atomic_svc.FileLock', lambda path, stale_after: FileLock(path, stale_after, poll_interval=0.01)):
+            assert await svc.run_exclusive(ingest)
+        ingest.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_continue_mode(self, svc):
+        holder = self._hold(svc)
+        svc.lock_mode = 'continue'
+        ingest = AsyncMock()
+        assert not await svc.run_exclusive(ingest)
+        ingest.assert_not_called()
+        holder.release()
+
+    @pytest.mark.asyncio
+    async def test_wait_timeout(self, svc):
+        holder = self._hold(svc)
+        svc.lock_timeout = 0
+        ingest = AsyncMock()
+        assert not await svc.run_exclusive(ingest)
+        ingest.assert_not_called()
+        holder.release()
+
 
 # ============================================================================
 # prereq_formater
@@ -963,3 +2083,33 @@ class TestPrereqFormater:
             ability_command='run_file'
         )
         assert 'powershell -command' in result
+
+    @pytest.mark.asyncio
+    async def test_header_is_cached_across_abilities(self, atomic_svc):
+        prereq_test = 'if [ -x "$(command -v nmap)" ]; then exit 0; else exit 1; fi;'
+        prereq = 'apt-get install -y nmap'
+        with patch.object(atomic_svc, '_format_prereq_header',
+                          wraps=atomic_svc._format_prereq_header) as mock_header:
+            first = await atomic_svc._prereq_formater(prereq_test, prereq, 'sh', 'sh', 'nmap -h')
+            second = await atomic_svc._prereq_formater(prereq_test, prereq, 'sh', 'sh', 'nmap -v')
+        mock_header.assert_called_once()
+        assert first.endswith('\nnmap -h')
+        assert second.endswith('\nnmap -v')
+        assert first.split('\n')[0] == second.split('\n')[0]
+
+    @pytest.mark.asyncio
+    async def test_extraction_error_is_cached(self, atomic_svc):
+        with patch.object(atomic_svc, '_format_prereq_header', side_effect=ExtractionError) as mock_header:
+            for _ in range(2):
+                with pytest.raises(ExtractionError):
+                    await atomic_svc._prereq_formater('no check', 'echo "Run it"', 'sh', 'sh', 'cmd')
+        mock_header.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_cache_key_includes_executors(self, atomic_svc):
+        prereq_test = 'if (Test-Path C:\\x) {exit 0} else {exit 1}'
+        psh = await atomic_svc._prereq_formater(prereq_test, 'Install-It', 'psh', 'psh', 'run')
+        cmd = await atomic_svc._prereq_formater(prereq_test, 'Install-It', 'psh', 'cmd', 'run')
+        assert not psh.startswith('powershell -command')
+        assert cmd.startswith('powershell -command')
+        assert len(atomic_svc._prereq_cache) == 2
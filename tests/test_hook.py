@@ -1,8 +1,15 @@
+import ast
 import os
 import pytest
 from unittest.mock import MagicMock, AsyncMock, patch
 
 
+async def _run_exclusive(ingest, needed):
+    # AtomicService.run_exclusive() when no other process holds the ingestion lock
+    if needed():
+        await ingest()
+
+
 class TestHookModuleAttributes:
     """Test module-level attributes in hook.py."""
 
@@ -65,17 +72,19 @@ class TestHookEnable:
             'app_svc': mock_app_svc,
         }
 
-        mock_atomic_svc = MagicMock()
+        mock_atomic_svc = MagicMock(ability_pack=None, run_exclusive=AsyncMock(side_effect=_run_exclusive))
         mock_atomic_svc.clone_atomic_red_team_repo = AsyncMock()
-        mock_atomic_svc.populate_data_directory = AsyncMock()
+        mock_atomic_svc.refresh_abilities = AsyncMock()
 
         with patch.object(hook, 'data_dir', '/tmp/atomic_test_hook_data'), \
              patch('os.listdir', return_value=['some_file']), \
-             patch('hook.AtomicService', return_value=mock_atomic_svc), \
+             patch('plugins.atomic.app.atomic_svc.AtomicService', return_value=mock_atomic_svc), \
              patch('hook.AtomicGUI'):
             await hook.enable(services)
             mock_atomic_svc.clone_atomic_red_team_repo.assert_called_once()
-            mock_atomic_svc.populate_data_directory.assert_called_once()
+            # staged and swapped in, never written straight into data/abilities
+            mock_atomic_svc.refresh_abilities.assert_awaited_once_with(update=False)
+            mock_atomic_svc.populate_data_directory.assert_not_called()
 
     @pytest.mark.asyncio
     async def test_enable_skips_ingest_when_abilities_exist(self):
@@ -97,9 +106,165 @@ class TestHookEnable:
 
         with patch.object(hook, 'data_dir', '/tmp/atomic_test_hook_data'), \
              patch('os.listdir', return_value=['abilities', 'other_stuff']), \
-             patch('hook.AtomicService', return_value=mock_atomic_svc) as mock_svc_cls, \
+             patch('plugins.atomic.app.atomic_svc.AtomicService', return_value=mock_atomic_svc) as mock_svc_cls, \
              patch('hook.AtomicGUI'):
             await hook.enable(services)
             # AtomicService should NOT be instantiated when abilities dir exists
             mock_svc_cls.assert_not_called()
 
+    @pytest.mark.asyncio
+    async def test_enable_registers_routes(self):
+        import hook
+
+        mock_app_svc = MagicMock()
+        services = {
+            'auth_svc': MagicMock(),
+            'data_svc': MagicMock(),
+            'app_svc': mock_app_svc,
+        }
+
+        with patch.object(hook, 'data_dir', '/tmp/atomic_test_hook_data'), \
+             patch('os.listdir', return_value=['abilities']), \
+             patch('hook.AtomicGUI') as mock_gui_cls:
+            await hook.enable(services)
+            mock_app_svc.application.router.add_route.assert_any_call(
+                'GET', '/plugin/atomic/summary', mock_gui_cls.return_value.summary)
+            mock_app_svc.application.router.add_route.assert_any_call(
+                'GET', '/plugin/atomic/abilities', mock_gui_cls.return_value.query)
+            mock_app_svc.application.router.add_route.assert_any_call(
+                'GET', '/plugin/atomic/progress', mock_gui_cls.return_value.progress)
+            mock_app_svc.application.router.add_route.assert_any_call(
+                'POST', '/plugin/atomic/ingestion', mock_gui_cls.return_value.start_ingestion)
+            mock_app_svc.application.router.add_route.assert_any_call(
+                'GET', '/plugin/atomic/ingestion', mock_gui_cls.return_value.ingestion_status)
+            mock_app_svc.application.router.add_route.assert_any_call(
+                'DELETE', '/plugin/atomic/ingestion', mock_gui_cls.return_value.cancel_ingestion)
+
+    @pytest.mark.asyncio
+    async def test_first_ingestion_stages_abilities(self, tmp_path):
+        import hook
+        from app.atomic_svc import AtomicService
+        atomic_svc = AtomicService()
+        atomic_svc.data_dir = str(tmp_path / 'data')
+        atomic_svc.repo_dir = str(tmp_path / 'data' / 'atomic-red-team')
+        atomic_svc.ability_pack = None
+        seen = []
+
+        async def populate(sources=None):
+            seen.append(atomic_svc.data_dir)
+            os.makedirs(os.path.join(atomic_svc.data_dir, 'abilities', 'discovery'))
+
+        with patch.object(atomic_svc, 'clone_atomic_red_team_repo', AsyncMock()), \
+             patch.object(atomic_svc, 'populate_data_directory', side_effect=populate), \
+             patch('app.atomic_svc.compute_fingerprint', return_value=dict(repo='abc')):
+            await hook._first_ingestion(atomic_svc)
+        assert seen == [os.path.join(str(tmp_path / 'data'), '.staging')]
+        assert os.listdir(tmp_path / 'data' / 'abilities') == ['discovery']
+        assert not os.path.exists(tmp_path / 'data' / '.staging')
+        assert os.path.exists(tmp_path / 'data' / 'fingerprint.json')
+
+    @pytest.mark.asyncio
+    async def test_enable_skips_abilities_ingested_by_another_instance(self):
+        import hook
+        services = {'auth_svc': MagicMock(), 'data_svc': MagicMock(), 'app_svc': MagicMock()}
+        mock_atomic_svc = MagicMock(clone_atomic_red_team_repo=AsyncMock(), populate_data_directory=AsyncMock(),
+                                    ability_pack=None, run_exclusive=AsyncMock(side_effect=_run_exclusive))
+        # missing at start, there once the ingestion lock is taken
+        with patch('os.listdir', side_effect=[[], ['abilities']]), \
+             patch('plugins.atomic.app.atomic_svc.AtomicService', return_value=mock_atomic_svc), \
+             patch('hook.AtomicGUI'):
+            await hook.enable(services)
+        mock_atomic_svc.run_exclusive.assert_awaited_once()
+        mock_atomic_svc.clone_atomic_red_team_repo.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_enable_installs_ability_pack_when_no_abilities(self):
+        import hook
+        services = {'auth_svc': MagicMock(), 'data_svc': MagicMock(), 'app_svc': MagicMock()}
+        mock_atomic_svc = MagicMock(clone_atomic_red_team_repo=AsyncMock(), populate_data_directory=AsyncMock(),
+                                    ability_pack='atomic-pack.tar.gz', data_dir='data', payloads_dir='payloads',
+                                    run_exclusive=AsyncMock(side_effect=_run_exclusive))
+        with patch('os.listdir', return_value=[]), \
+             patch('plugins.atomic.app.atomic_svc.AtomicService', return_value=mock_atomic_svc), \
+             patch('plugins.atomic.app.atomic_pack.import_pack') as import_pack, \
+             patch('hook.AtomicGUI'):
+            await hook.enable(services)
+        import_pack.assert_called_once_with('atomic-pack.tar.gz', 'data', 'payloads')
+        mock_atomic_svc.clone_atomic_red_team_repo.assert_not_called()
+        mock_atomic_svc.populate_data_directory.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_enable_reingests_stale_abilities(self):
+        import hook
+        services = {'auth_svc': MagicMock(), 'data_svc': MagicMock(), 'app_svc': MagicMock()}
+        mock_atomic_svc = MagicMock(refresh_abilities=AsyncMock(), run_exclusive=AsyncMock(side_effect=_run_exclusive))
+        with patch('os.listdir', return_value=['abilities']), \
+             patch('hook.is_stale', return_value=True) as stale, \
+             patch('plugins.atomic.app.atomic_svc.AtomicService', return_value=mock_atomic_svc), \
+             patch('hook.AtomicGUI'):
+            await hook.enable(services)
+        stale.assert_called_with(os.path.join(hook.data_dir, 'atomic-red-team'), hook.plugin_dir, hook.data_dir)
+        mock_atomic_svc.refresh_abilities.assert_awaited_once_with(update=False)
+
+    @pytest.mark.asyncio
+    async def test_enable_skips_fresh_abilities(self):
+        import hook
+        services = {'auth_svc': MagicMock(), 'data_svc': MagicMock(), 'app_svc': MagicMock()}
+        with patch('os.listdir', return_value=['abilities']), \
+             patch('hook.is_stale', return_value=False), \
+             patch('plugins.atomic.app.atomic_svc.AtomicService') as mock_svc_cls, \
+             patch('hook.AtomicGUI'):
+            await hook.enable(services)
+        mock_svc_cls.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_enable_registers_lazy_payloads(self, tmp_path):
+        import hook
+        file_svc = MagicMock(add_special_payload=AsyncMock())
+        services = {'auth_svc': MagicMock(), 'data_svc': MagicMock(), 'app_svc': MagicMock(), 'file_svc': file_svc}
+        refs = {'abc123_tool.exe': dict(source='/atomics/tool.exe', digest='abc123')}
+        with patch.object(hook, 'data_dir', str(tmp_path)), \
+             patch('os.listdir', return_value=['abilities']), \
+             patch('hook.is_stale', return_value=False), \
+             patch('hook.load_payload_refs', return_value=refs) as load, \
+             patch('hook.AtomicGUI'):
+            await hook.enable(services)
+        load.assert_called_once_with(os.path.join(str(tmp_path), 'payload_refs.json'))
+        file_svc.add_special_payload.assert_awaited_once()
+        assert file_svc.add_special_payload.call_args[0][0] == 'abc123_tool.exe'
+
+
+class TestHookStartLatency:
+    """Enabling the plugin when abilities were already ingested must stay cheap."""
+
+    HEAVY_MODULES = ('plugins.atomic.app.atomic_svc', 'yaml')
+
+    @staticmethod
+    def _module_level_imports(path):
+        with open(os.path.join(os.path.dirname(os.path.dirname(__file__)), path)) as f:
+            tree = ast.parse(f.read())
+        for node in tree.body:
+            if isinstance(node, ast.Import):
+                yield from (alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom):
+                yield node.module
+
+    @pytest.mark.parametrize('path', ['hook.py', 'app/atomic_gui.py', 'app/atomic_index.py', 'app/atomic_fingerprint.py',
+                                      'app/atomic_payloads.py'])
+    def test_ingestion_code_is_not_imported_at_load(self, path):
+        assert not set(self._module_level_imports(path)) & set(self.HEAVY_MODULES)
+
+    def test_import_time_is_recorded(self):
+        import hook
+        assert 0 <= hook.import_time
+
+    @pytest.mark.asyncio
+    async def test_enable_fast_path_records_enable_time(self):
+        import hook
+        services = {'auth_svc': MagicMock(), 'data_svc': MagicMock(), 'app_svc': MagicMock()}
+        with patch.object(hook, 'data_dir', '/tmp/atomic_test_hook_data'), \
+             patch('os.listdir', return_value=['abilities']), \
+             patch('plugins.atomic.app.atomic_svc.AtomicService') as mock_svc_cls:
+            await hook.enable(services)
+        mock_svc_cls.assert_not_called()
+        assert 0 <= hook.enable_time